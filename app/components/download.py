@@ -1,6 +1,10 @@
+import os
 import streamlit as st
 import pandas as pd
 import fsspec
+from .results_store import list_result_studies, get_results, get_history, export_results
+from .harmonise import harmonise_study, harmonised_path
+from .materialise import materialise_study, relational_path
 
 results_path = "results"
 
@@ -25,12 +29,12 @@ def download_page():
     This function lists available study results, allows the user to select one,
     displays the DataFrame, and provides a download button for the selected study.
     """
-    avail_data = [f.split('/')[-1].split('.')[0] for f in fs.ls(f"{results_path}/")]
+    avail_data = list_result_studies()
     if len(avail_data) == 0:
         st.write(':red[No results available, please initialise the mapping app]')
     else:
         name = st.selectbox('Select study to download:', avail_data)
-        df = pd.read_csv(f"{results_path}/{name}.csv")
+        df = get_results(name)
         df.replace('0%', None, inplace=True)
         # only keep the core columns and drop the rest where all values are NaN
         df1 = df[['study_var', 'codebook_var', 'confidence', 'notes', 'marked']]
@@ -50,4 +54,57 @@ def download_page():
                 file_name=f'{name}_mapping_results.csv',
                 mime='text/csv',
                 )
+            st.download_button(
+                label="Download change history as CSV",
+                data=convert_to_download(get_history(name)),
+                file_name=f'{name}_mapping_history.csv',
+                mime='text/csv',
+                )
+            if st.button('Export to results folder', help=f'Write the current results to {results_path}/{name}.csv on the server.'):
+                st.write(f'Results written to `{export_results(name)}`')
+
+        st.divider()
+        harmonise_page(name)
+
+def harmonise_page(name):
+    """
+    Display a form to harmonise a study's full dataset with its mapping results.
+
+    Args:
+        name (str): The study name.
+    """
+    st.write('### Harmonise Study Data')
+    st.write('Apply the successfully mapped variables, and their transformation instructions, to the full study dataset. The output uses the target codebook variable names.')
+    source_file = st.text_input('Path to the full study dataset (CSV) on the server:', '')
+    layouts = {'One table': None,
+               'Relational, long (patient ID, date, variable, value)': 'long',
+               'Relational, wide (one row per patient ID and date)': 'wide'}
+    layout = layouts[st.selectbox('Layout:', list(layouts), help='The relational layouts group variables by the patient ID and date recorded for them in relational mode.')]
+    col1, col2 = st.columns(2)
+    with col1:
+        output_format = st.selectbox('Output format:', ['parquet', 'csv'], disabled=layout is not None)
+    with col2:
+        n_workers = st.number_input('Worker processes:', min_value=1, max_value=os.cpu_count() or 1, value=1, disabled=layout is not None)
+    if st.button('Harmonise', disabled=source_file == ''):
+        if not fs.exists(source_file):
+            st.write(f':red[{source_file} does not exist]')
+        else:
+            progress = st.empty()
+            on_progress = lambda rows: progress.write(f'{rows:,} rows harmonised')
+            try:
+                if layout is None:
+                    report = harmonise_study(name, source_file, output_format, n_workers=int(n_workers), on_progress=on_progress)
+                else:
+                    outputs = materialise_study(name, source_file, layout, on_progress=on_progress)
+            except ValueError as e:
+                st.write(f':red[{e}]')
+            except Exception as e: # eg. an unreadable dataset, no partial output is left behind
+                st.write(f':red[Harmonisation failed: {type(e).__name__}: {e}]')
+            else:
+                if layout is None:
+                    st.write(f':green[Harmonised data written to `{harmonised_path}/{name}/`] :white_check_mark:')
+                    st.dataframe(report, hide_index=True)
+                else:
+                    st.write(f':green[Relational tables written to `{relational_path}/{name}/`] :white_check_mark:')
+                    st.dataframe(pd.DataFrame({'table': list(outputs), 'path': list(outputs.values())}), hide_index=True)
 
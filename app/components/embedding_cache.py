@@ -0,0 +1,146 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+import time
+import numpy as np
+import fsspec
+
+cache_path = "cache"
+
+fs = fsspec.filesystem("")
+
+DEFAULT_MAX_ENTRIES = 100000 # roughly 600MB of ada-002 embeddings
+SQL_VARIABLE_LIMIT = 900
+
+def normalise_text(text):
+    """
+    Normalise a text before it is hashed, so trivially different spellings share a cache entry.
+
+    Args:
+        text (str): The text to normalise.
+
+    Returns:
+        str: The text with whitespace collapsed and stripped.
+    """
+    return ' '.join(str(text).split())
+
+def cache_key(model, text):
+    """
+    Get the content address of an embedding.
+
+    Args:
+        model (str): The embedding model.
+        text (str): The embedded text.
+
+    Returns:
+        str: The sha256 hex digest of the model and normalised text.
+    """
+    return hashlib.sha256(f"{model}\x00{normalise_text(text)}".encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent, content addressed embedding cache backed by SQLite.
+
+    Embeddings are keyed by a hash of (model, normalised text) and stored as float32 blobs. Once
+    the cache holds more than max_entries embeddings the least recently used are evicted. Hit and
+    miss counters are kept for the lifetime of the object.
+    """
+    def __init__(self, path=f"{cache_path}/embeddings.sqlite", max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        fs.mkdirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                key TEXT PRIMARY KEY,
+                                model TEXT,
+                                embedding BLOB,
+                                last_used REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn: # commits, or rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, model, texts):
+        """
+        Look up the embeddings of many texts.
+
+        Args:
+            model (str): The embedding model.
+            texts (list): The texts to look up.
+
+        Returns:
+            list: The cached embeddings as float32 arrays, in the order of texts, None where missing.
+        """
+        keys = [cache_key(model, text) for text in texts]
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock, self._connect() as conn:
+            for i in range(0, len(unique_keys), SQL_VARIABLE_LIMIT):
+                chunk = unique_keys[i:i + SQL_VARIABLE_LIMIT]
+                rows = conn.execute(f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            embeddings = [found.get(key) for key in keys]
+            n_hits = sum(x is not None for x in embeddings)
+            self.hits += n_hits
+            self.misses += len(embeddings) - n_hits
+        return embeddings
+
+    def put_many(self, model, texts, embeddings):
+        """
+        Store the embeddings of many texts, evicting the least recently used entries if over the size limit.
+
+        Args:
+            model (str): The embedding model.
+            texts (list): The embedded texts.
+            embeddings (list): The embeddings, entries that are None are not stored.
+        """
+        now = time.time()
+        rows = [(cache_key(model, text), model, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+                for text, embedding in zip(texts, embeddings) if embedding is not None]
+        if not rows:
+            return
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            n_entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if n_entries > self.max_entries:
+                conn.execute("""DELETE FROM embeddings WHERE key IN (
+                                    SELECT key FROM embeddings ORDER BY last_used LIMIT ?)""", (n_entries - self.max_entries,))
+
+    def stats(self):
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: The number of hits, misses and entries currently stored.
+        """
+        with self._lock, self._connect() as conn:
+            n_entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': n_entries}
+
+_default_cache = None
+
+def get_default_cache():
+    """
+    Get the embedding cache shared by every embedding call in the app.
+
+    Returns:
+        EmbeddingCache: The shared cache instance.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache()
+    return _default_cache
@@ -0,0 +1,316 @@
+import time
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import fsspec
+import tiktoken
+from .embedding_cache import get_default_cache, cache_key
+
+fs = fsspec.filesystem("")
+
+# request limits for the OpenAI embeddings endpoint
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_INPUT = 8191
+MAX_TOKENS_PER_REQUEST = 300000
+
+# retries of failed embedding requests
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Get the tiktoken encoding used by an embedding model.
+
+    Args:
+        model (str): The embedding model name.
+
+    Returns:
+        Encoding: The tiktoken encoding, or None if it could not be loaded.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        print(f"Could not load tiktoken encoding for {model}: {str(e)}")
+        return None
+
+def prepare_text(text, model="text-embedding-ada-002"):
+    """
+    Clean a text for embedding and truncate it to the per input token limit.
+
+    Args:
+        text (str): The text to be embedded.
+        model (str, optional): The embedding model. Defaults to "text-embedding-ada-002".
+
+    Returns:
+        tuple: The cleaned text and its (estimated) token count.
+    """
+    text = str(text).replace("\n", " ")
+    encoding = get_encoding(model)
+    if encoding is None:
+        n_tokens = len(text) // 3 + 1 # conservative estimate when no tokeniser is available
+        if n_tokens > MAX_TOKENS_PER_INPUT:
+            text = text[:MAX_TOKENS_PER_INPUT * 3]
+            n_tokens = MAX_TOKENS_PER_INPUT
+        return text, n_tokens
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) > MAX_TOKENS_PER_INPUT:
+        tokens = tokens[:MAX_TOKENS_PER_INPUT]
+        text = encoding.decode(tokens)
+    return text, len(tokens)
+
+def make_batches(token_counts, max_inputs=MAX_INPUTS_PER_REQUEST, max_tokens=MAX_TOKENS_PER_REQUEST):
+    """
+    Group consecutive inputs into batches that respect the per request limits.
+
+    Args:
+        token_counts (list): Token count of each input, in order.
+        max_inputs (int, optional): Maximum number of inputs per request. Defaults to MAX_INPUTS_PER_REQUEST.
+        max_tokens (int, optional): Maximum number of tokens per request. Defaults to MAX_TOKENS_PER_REQUEST.
+
+    Returns:
+        list: A list of (start, end) index pairs, one per request.
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, n_tokens in enumerate(token_counts):
+        if i > start and (i - start >= max_inputs or batch_tokens + n_tokens > max_tokens):
+            batches.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += n_tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+def is_retryable(error):
+    """
+    Check whether a failed request may succeed if sent again: rate limits, timeouts, server and connection errors.
+
+    Args:
+        error (Exception): The error raised by the request.
+
+    Returns:
+        bool: False if the API rejected the request itself (other 4xx errors, eg. an invalid input).
+    """
+    status = getattr(error, 'status_code', None)
+    return status is None or status in (408, 409, 429) or status >= 500
+
+def request_embeddings(openai_client, texts, model, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS):
+    """
+    Embed a single batch of texts.
+
+    Transient failures are retried with exponential backoff (backoff, 2 * backoff, ... seconds), and the
+    batch is given up if they persist. A batch the API rejects is bisected, so the input(s) responsible
+    are isolated in a logarithmic number of requests while the rest of the batch is still embedded.
+
+    Args:
+        openai_client: The OpenAI client instance.
+        texts (list): The prepared texts of the batch.
+        model (str): The embedding model.
+        max_retries (int, optional): The maximum number of attempts at transient failures. Defaults to MAX_RETRIES.
+        backoff (float, optional): The wait before the first retry, in seconds. Defaults to BACKOFF_SECONDS.
+
+    Returns:
+        list: The embeddings in the order of texts, None where an input failed.
+    """
+    for attempt in range(max_retries):
+        try:
+            response = openai_client.embeddings.create(input=texts, model=model)
+            data = sorted(response.data, key=lambda x: x.index)
+            return [x.embedding for x in data]
+        except Exception as e:
+            print(f"Error generating OpenAI embeddings for batch of {len(texts)}: {str(e)}")
+            if not is_retryable(e):
+                break
+            if attempt == max_retries - 1:
+                return [None] * len(texts)
+            time.sleep(backoff * 2 ** attempt)
+    if len(texts) == 1:
+        return [None]
+    middle = len(texts) // 2
+    return request_embeddings(openai_client, texts[:middle], model, max_retries, backoff) + request_embeddings(openai_client, texts[middle:], model, max_retries, backoff)
+
+def get_embeddings_batch(openai_client, texts, model="text-embedding-ada-002", max_inputs=MAX_INPUTS_PER_REQUEST, max_tokens=MAX_TOKENS_PER_REQUEST, cache=None, use_cache=True):
+    """
+    Generate embeddings for many texts, packing as many inputs into each request as the provider allows.
+
+    Texts are first looked up in the embedding cache (the shared on-disk cache unless another is given),
+    only unique texts that miss are sent to the API and the new embeddings are added to the cache.
+
+    Args:
+        openai_client: The OpenAI client instance.
+        texts (list): The texts to generate embeddings for.
+        model (str, optional): The model to use for generating the embeddings. Defaults to "text-embedding-ada-002".
+        max_inputs (int, optional): Maximum number of inputs per request. Defaults to MAX_INPUTS_PER_REQUEST.
+        max_tokens (int, optional): Maximum number of tokens per request. Defaults to MAX_TOKENS_PER_REQUEST.
+        cache (EmbeddingCache, optional): The cache to use. Defaults to the shared cache.
+        use_cache (bool, optional): Set to False to bypass the cache. Defaults to True.
+
+    Returns:
+        list: The generated embeddings as float32 arrays, in the same order as texts, None where an embedding failed.
+    """
+    texts = [str(text).replace("\n", " ") for text in texts]
+    embeddings = [None] * len(texts)
+    if use_cache:
+        cache = cache or get_default_cache()
+        embeddings = cache.get_many(model, texts)
+    # embed each distinct missing text once
+    to_embed = {}
+    for i, text in enumerate(texts):
+        if embeddings[i] is None:
+            to_embed.setdefault(cache_key(model, text), []).append(i)
+    if not to_embed:
+        return embeddings
+    if not openai_client:
+        raise ValueError("No OpenAI client available. Please provide an OpenAI API key.")
+    missing_texts = [texts[idx[0]] for idx in to_embed.values()]
+    prepared = [prepare_text(text, model) for text in missing_texts]
+    token_counts = [n_tokens for _, n_tokens in prepared]
+    prepared_texts = [text for text, _ in prepared]
+    new_embeddings = []
+    for start, end in make_batches(token_counts, max_inputs, max_tokens):
+        new_embeddings.extend(request_embeddings(openai_client, prepared_texts[start:end], model))
+    new_embeddings = [None if x is None else np.asarray(x, dtype=np.float32) for x in new_embeddings]
+    if use_cache:
+        cache.put_many(model, missing_texts, new_embeddings)
+    for idx, embedding in zip(to_embed.values(), new_embeddings):
+        for i in idx:
+            embeddings[i] = embedding
+    return embeddings
+
+def get_embedding(openai_client, text, model="text-embedding-ada-002"):
+    """
+    Generate an embedding for the given text using the specified OpenAI model.
+
+    Args:
+        openai_client: The OpenAI client instance.
+        text (str): The text to generate an embedding for.
+        model (str): The model to use for generating the embedding.
+
+    Returns:
+        ndarray: The generated embedding.
+    """
+    return get_embeddings_batch(openai_client, [text], model)[0]
+
+def get_embeddings_incremental(openai_client, texts, previous_texts=None, previous_matrix=None, model="text-embedding-ada-002"):
+    """
+    Generate embeddings for many texts, reusing the rows of a previous embedding matrix whose text is unchanged.
+
+    Args:
+        openai_client: The OpenAI client instance.
+        texts (list): The texts to generate embeddings for.
+        previous_texts (list, optional): The texts the previous matrix was generated from. Defaults to None.
+        previous_matrix (ndarray, optional): The previous embedding matrix. Defaults to None.
+        model (str, optional): The model to use for generating the embeddings. Defaults to "text-embedding-ada-002".
+
+    Returns:
+        list: The embeddings, in the same order as texts.
+    """
+    previous = {}
+    if previous_texts is not None and previous_matrix is not None:
+        previous = {str(text): i for i, text in enumerate(previous_texts) if previous_matrix[i].any()}
+    embeddings = [None] * len(texts)
+    to_embed = []
+    for i, text in enumerate(texts):
+        if str(text) in previous:
+            embeddings[i] = previous_matrix[previous[str(text)]]
+        else:
+            to_embed.append(i)
+    if to_embed:
+        new_embeddings = get_embeddings_batch(openai_client, [texts[i] for i in to_embed], model)
+        for i, embedding in zip(to_embed, new_embeddings):
+            embeddings[i] = embedding
+    return embeddings
+
+def embeddings_to_matrix(embeddings):
+    """
+    Stack a list of embeddings into a contiguous float32 matrix.
+
+    Args:
+        embeddings (list): The embeddings, None where an embedding could not be generated.
+
+    Returns:
+        ndarray: An (n, dim) float32 matrix, with zero rows in place of missing embeddings.
+    """
+    dim = next((len(x) for x in embeddings if x is not None), 0)
+    matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+    for i, embedding in enumerate(embeddings):
+        if embedding is not None:
+            matrix[i] = embedding
+    return matrix
+
+def embedding_store_paths(metadata_file):
+    """
+    Get the paths of the embedding matrices stored alongside a metadata file.
+
+    Args:
+        metadata_file (str): Path to the variable metadata CSV.
+
+    Returns:
+        tuple: Paths of the variable name and description embedding matrices.
+    """
+    prefix = metadata_file[:-len('.csv')] if metadata_file.endswith('.csv') else metadata_file
+    return f'{prefix}_var.npy', f'{prefix}_description.npy'
+
+def save_embedding_store(metadata_file, df, var_embeddings, description_embeddings):
+    """
+    Save variable metadata as CSV with a row_id index, and its embeddings as float32 .npy matrices.
+
+    Args:
+        metadata_file (str): Path to write the variable metadata CSV to.
+        df (DataFrame): The variable metadata, one row per variable.
+        var_embeddings (list or ndarray): Embeddings of the variable names.
+        description_embeddings (list or ndarray): Embeddings of the descriptions.
+    """
+    var_path, description_path = embedding_store_paths(metadata_file)
+    for path, embeddings in [(var_path, var_embeddings), (description_path, description_embeddings)]:
+        if not isinstance(embeddings, np.ndarray):
+            embeddings = embeddings_to_matrix(embeddings)
+        with fs.open(path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(embeddings, dtype=np.float32))
+    df = df.reset_index(drop=True)
+    df['row_id'] = range(len(df))
+    df.to_csv(metadata_file, index=False)
+
+def load_embedding_store(metadata_file, mmap_mode=None):
+    """
+    Load variable metadata and its embedding matrices.
+
+    Args:
+        metadata_file (str): Path to the variable metadata CSV.
+        mmap_mode (str, optional): Passed to np.load to memory map the matrices instead of reading them. Defaults to None.
+
+    Returns:
+        tuple: The metadata DataFrame (ordered by row_id) and the variable name and description embedding matrices.
+    """
+    var_path, description_path = embedding_store_paths(metadata_file)
+    df = pd.read_csv(metadata_file).sort_values('row_id').reset_index(drop=True)
+    var_matrix = np.load(var_path, mmap_mode=mmap_mode)
+    description_matrix = np.load(description_path, mmap_mode=mmap_mode)
+    return df, var_matrix, description_matrix
+
+def embedding_store_files(metadata_file):
+    """
+    Get every file making up an embedding store.
+
+    Args:
+        metadata_file (str): Path to the variable metadata CSV.
+
+    Returns:
+        list: The metadata file and both embedding matrices.
+    """
+    return [metadata_file, *embedding_store_paths(metadata_file)]
+
+def embedding_store_exists(metadata_file):
+    """
+    Check that a metadata file and both of its embedding matrices exist.
+
+    Args:
+        metadata_file (str): Path to the variable metadata CSV.
+
+    Returns:
+        bool: True if the store is complete.
+    """
+    return all(fs.exists(path) for path in embedding_store_files(metadata_file))
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import fsspec
+from .util import read_csv_chunks
+
+results_path = "results"
+input_path = "input"
+preprocess_path = "preprocess"
+
+fs = fsspec.filesystem("")
+
+SAMPLE_SIZE = 100 # example values kept per variable
+MAX_DISTINCT = 10000 # value frequencies are only kept for variables with at most this many distinct values
+TOP_VALUES = 20 # most frequent values stored per variable
+CHUNK_SIZE = 100000 # rows read at a time
+
+def example_paths(study):
+    """
+    Get the paths of a study's example data sample and value frequencies.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        tuple: Paths to the sample and frequencies Parquet files.
+    """
+    return f"{input_path}/{study}/example_data.parquet", f"{input_path}/{study}/example_frequencies.parquet"
+
+def sample_example_data(example_file, sep=',', sample_size=SAMPLE_SIZE, chunksize=CHUNK_SIZE, seed=0, on_progress=None):
+    """
+    Stream an example data CSV once, keeping a fixed size uniform random sample and value frequencies of every column.
+
+    Each non missing value is given a random key and the sample_size values with the smallest keys are
+    kept (a reservoir sample), so memory is bounded by the chunk size whatever the size of the file.
+    Frequencies stop being counted for columns with more than MAX_DISTINCT distinct values, eg. IDs.
+
+    Args:
+        example_file (str): Path to the CSV file.
+        sep (str, optional): The delimiter. Defaults to ','.
+        sample_size (int, optional): The number of values kept per column. Defaults to SAMPLE_SIZE.
+        chunksize (int, optional): The number of rows read at a time. Defaults to CHUNK_SIZE.
+        seed (int, optional): The random seed. Defaults to 0.
+        on_progress (callable, optional): Called with the fraction of the file read after each chunk. Defaults to None.
+
+    Returns:
+        tuple: The sample, a DataFrame with one column per variable, and the frequencies, a DataFrame of
+               (variable, value, count) rows with the missing count recorded against a null value.
+    """
+    rng = np.random.default_rng(seed)
+    reservoirs, counts, missing = {}, {}, {}
+    high_cardinality = set()
+    for chunk in read_csv_chunks(example_file, sep, chunksize, on_progress, dtype=str):
+        for column in chunk.columns:
+            values = chunk[column].dropna()
+            missing[column] = missing.get(column, 0) + len(chunk) - len(values)
+            keys = rng.random(len(values))
+            if column in reservoirs:
+                values = pd.concat([reservoirs[column][0], values], ignore_index=True)
+                keys = np.concatenate([reservoirs[column][1], keys])
+            if len(values) > sample_size:
+                keep = np.argpartition(keys, sample_size - 1)[:sample_size]
+                values, keys = values.iloc[keep].reset_index(drop=True), keys[keep]
+            reservoirs[column] = (values.reset_index(drop=True), keys)
+            if column not in high_cardinality:
+                column_counts = chunk[column].value_counts()
+                if column in counts:
+                    column_counts = counts[column].add(column_counts, fill_value=0)
+                counts[column] = column_counts
+                if len(column_counts) > MAX_DISTINCT:
+                    high_cardinality.add(column)
+                    del counts[column]
+    sample = pd.DataFrame({column: values.iloc[np.argsort(keys)].reset_index(drop=True) for column, (values, keys) in reservoirs.items()})
+    frequencies = []
+    for column in reservoirs:
+        frequencies.append(pd.DataFrame({'variable': [column], 'value': [None], 'count': [missing[column]]}))
+        if column in counts:
+            top = counts[column].sort_values(ascending=False, kind='stable').head(TOP_VALUES)
+            frequencies.append(pd.DataFrame({'variable': column, 'value': top.index.astype(str), 'count': top.values}))
+    frequencies = pd.concat(frequencies, ignore_index=True) if frequencies else pd.DataFrame(columns=['variable', 'value', 'count'])
+    frequencies['count'] = frequencies['count'].astype('int64')
+    return sample, frequencies
+
+def save_example_data(study, example_file, sep=',', on_progress=None):
+    """
+    Sample a study's example data and save the sample and value frequencies as Parquet, so single columns can be read.
+
+    Args:
+        study (str): The study name.
+        example_file (str): Path to the example data CSV.
+        sep (str, optional): The delimiter. Defaults to ','.
+        on_progress (callable, optional): Called with the fraction of the file read after each chunk. Defaults to None.
+    """
+    sample, frequencies = sample_example_data(example_file, sep, on_progress=on_progress)
+    sample_file, frequencies_file = example_paths(study)
+    sample.to_parquet(sample_file, index=False)
+    frequencies.to_parquet(frequencies_file, index=False)
+
+def example_data_available(study):
+    """
+    Check whether a study has example data, in the Parquet store or as a legacy CSV.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        bool: True if example data is available.
+    """
+    return fs.exists(example_paths(study)[0]) or fs.exists(f"{input_path}/{study}/example_data.csv")
+
+def read_example_column(study, variable):
+    """
+    Read the example values of a single variable.
+
+    Args:
+        study (str): The study name.
+        variable (str): The variable name.
+
+    Returns:
+        list: The example values as strings, or None if the variable has no example data.
+    """
+    sample_file = example_paths(study)[0]
+    if fs.exists(sample_file):
+        if variable not in pq.read_schema(sample_file).names:
+            return None
+        values = pd.read_parquet(sample_file, columns=[variable])[variable]
+    else: # studies uploaded before the Parquet store
+        legacy_file = f"{input_path}/{study}/example_data.csv"
+        if not fs.exists(legacy_file) or variable not in pd.read_csv(legacy_file, nrows=0).columns:
+            return None
+        values = pd.read_csv(legacy_file, usecols=[variable])[variable]
+    return [str(x) for x in list(values.dropna())]
+
+def read_example_frequencies(study, variable):
+    """
+    Read the most frequent values and missing count of a single variable.
+
+    Args:
+        study (str): The study name.
+        variable (str): The variable name.
+
+    Returns:
+        pd.DataFrame: The (value, count) rows, with the missing count against a null value, or None if unavailable.
+    """
+    frequencies_file = example_paths(study)[1]
+    if not fs.exists(frequencies_file):
+        return None
+    frequencies = pd.read_parquet(frequencies_file, filters=[('variable', '==', variable)])
+    return frequencies[['value', 'count']].reset_index(drop=True)
@@ -1,12 +1,19 @@
 import pandas as pd
 import math
+import os
 import fsspec
 import time
-from pdfminer.high_level import extract_text
-import re
-from scipy import spatial
+import asyncio
+import threading
+from itertools import islice
+import json
+import numpy as np
 from dotenv import dotenv_values
-from .util import init_llm_models
+from .pdf_extraction import context_documents, extract_document_text
+from .util import init_llm_models, init_async_llm_models, is_up_to_date, write_manifest, file_fingerprint
+from .embedding_utils import get_embeddings_batch, embeddings_to_matrix, MAX_INPUTS_PER_REQUEST
+from .text_splitter import iter_text_chunks, token_length
+from .similarity import cosine_distance_matrix, top_k_smallest
 
 results_path = "results"
 input_path = "input"
@@ -14,24 +21,26 @@ preprocess_path = "preprocess"
 
 fs = fsspec.filesystem("")
 
-def get_index(list_in, n, by):
+_request_slots = {}
+_request_slots_lock = threading.Lock()
+
+def request_slots(max_concurrency):
     """
-    Get the indices of the top 3 minimum or maximum values in a list.
+    Get the semaphore bounding the LLM requests in flight across every study described at the same time.
+
+    Each study's descriptions are generated on its own event loop (in a thread of the pipeline), so the
+    limit is shared as a process wide semaphore, one per limit value.
 
     Args:
-        list_in (list): The list of values.
-        n (int): The number of indices to get.
-        by (str): 'min' to get indices of the smallest values, 'max' for the largest.
+        max_concurrency (int): The maximum number of requests in flight.
 
     Returns:
-        list: Indices of the top 3 minimum or maximum values.
+        threading.BoundedSemaphore: The semaphore.
     """
-    indexed_values = list(enumerate(list_in)) # create tuple with og index
-    sorted_values = sorted(indexed_values, key=lambda x: x[1]) # sort tuples by values (2nd values in tuple)
-    if by == 'min':
-        return [index for index, _ in sorted_values[:n]] # return index
-    elif by == 'max':
-        return [index for index, _ in sorted_values[-n:]]
+    with _request_slots_lock:
+        if max_concurrency not in _request_slots:
+            _request_slots[max_concurrency] = threading.BoundedSemaphore(max_concurrency)
+        return _request_slots[max_concurrency]
 
 def return_prompt(init_prompt, variable, context='Not available', example_dict=None):
     """
@@ -60,126 +69,115 @@ def return_prompt(init_prompt, variable, context='Not available', example_dict=N
     prompts.append({"role": "user", "content": f"variable name:  {variable}, context: {context}"})
     return prompts
 
+def convert_study_pdf_to_txt(study, n_workers=None):
+    """
+    Convert a study's context documents to a single text file, if any of them changed since they were last converted.
+
+    Pages are extracted in parallel and cached by content, see pdf_extraction.extract_document_text.
+
+    Args:
+        study (str): The study name.
+        n_workers (int, optional): The number of worker processes per document. Defaults to the number of CPUs.
+    """
+    output_file = f"{input_path}/{study}/context.txt"
+    documents = context_documents(study)
+    if not is_up_to_date(output_file, documents):
+        text = '\n'.join(extract_document_text(document, n_workers) for document in documents)
+        with fs.open(output_file, 'w') as of:
+            of.write(text)
+        write_manifest(output_file, documents)
+
 def convert_pdf_to_txt():
     """
     Convert PDF files to text files for all available studies.
     """
     avail_studies = [x for x in fs.ls(f'{input_path}/') if fs.isdir(x)] # get directories
     avail_studies = [f.split('/')[-1] for f in avail_studies if f.split('/')[-1][0] != '.'] # strip path and remove hidden folders
-    avail_studies = [study for study in avail_studies if fs.exists(f"{input_path}/{study}/context.pdf")]
+    avail_studies = [study for study in avail_studies if context_documents(study)]
+    n_workers = int(dotenv_values(".env").get('pdf_workers') or 0) or None
     for study in avail_studies:
         # create plain text
-        if not fs.exists(f"{input_path}/{study}/context.txt"):
-            output_file = f"{input_path}/{study}/context.txt"
-            text = extract_text(f"{input_path}/{study}/context.pdf")
-            with fs.open(output_file, 'w') as of:
-                of.write(text)
+        convert_study_pdf_to_txt(study, n_workers)
 
-def get_embedding(openai_client, text, model="text-embedding-ada-002"):
+def embed_documents(openai_client, input_path, study, chunk_size=250, chunk_overlap=20, model="text-embedding-ada-002"):
     """
-    Get the embedding for a given text using OpenAI's API.
+    Embed the documents for a given study.
+
+    context.txt is split lazily into chunks of at most chunk_size tokens, which are embedded in batches
+    as they are produced, so the document is never loaded into memory as a whole. The chunk texts and
+    their embedding matrix are saved next to the study (context_chunks.json and context_embeddings.npy)
+    and reused on later runs for as long as context.txt is unchanged. A document without text (eg. an
+    image only PDF) has no chunks and no embeddings.
 
     Args:
         openai_client (object): The OpenAI client.
-        text (str): The text to be embedded.
-        model (str, optional): The model to be used for embedding. Defaults to "text-embedding-ada-002".
+        input_path (str): The input path for the study.
+        study (str): The study name.
+        chunk_size (int, optional): The maximum number of tokens of each chunk. Defaults to 250.
+        chunk_overlap (int, optional): The maximum number of tokens shared by consecutive chunks. Defaults to 20.
+        model (str, optional): The embedding model, whose tokeniser sizes the chunks. Defaults to "text-embedding-ada-002".
 
     Returns:
-        list: The embedding vector for the text.
+        tuple: A tuple containing the text chunks and their (n_chunks, dim) embedding matrix, None if there are no chunks.
     """
-    text = str(text).replace("\n", " ")
-    if openai_client:
-        try:
-            response = openai_client.embeddings.create(input=[text], model=model)
-            return response.data[0].embedding
-        except Exception as e:
-            print(f"Error generating OpenAI embedding: {str(e)}")
-    else:
-        raise ValueError("No OpenAI client available. Please provide an OpenAI API key.")
-    return None
+    context_file = f"{input_path}/{study}/context.txt"
+    chunks_file = f"{input_path}/{study}/context_chunks.json"
+    embeddings_file = f"{input_path}/{study}/context_embeddings.npy"
+    chunk_params = {'chunk_size': chunk_size, 'chunk_overlap': chunk_overlap, 'unit': 'tokens', 'model': model}
+    if is_up_to_date(chunks_file, [context_file], chunk_params):
+        with fs.open(chunks_file, 'r', encoding='utf-8') as file:
+            text_chunks = json.load(file)
+        if len(text_chunks) == 0:
+            return text_chunks, None
+        if is_up_to_date(embeddings_file, [chunks_file]):
+            return text_chunks, np.load(embeddings_file)
+
+    text_chunks, embeddings = [], []
+    with fs.open(context_file, 'r', encoding='utf-8') as file:
+        chunks = (chunk for chunk in iter_text_chunks(file, chunk_size, chunk_overlap, length_function=token_length(model)) if chunk.strip()) # drop empty chunks
+        for batch in iter(lambda: list(islice(chunks, MAX_INPUTS_PER_REQUEST)), []):
+            text_chunks += batch
+            embeddings += get_embeddings_batch(openai_client, batch, model=model)
+    with fs.open(chunks_file, 'w', encoding='utf-8') as file:
+        json.dump(text_chunks, file)
+    write_manifest(chunks_file, [context_file], chunk_params)
+    if len(text_chunks) == 0:
+        return text_chunks, None
+    embeddings = embeddings_to_matrix(embeddings)
+    with fs.open(embeddings_file, 'wb') as file:
+        np.save(file, embeddings)
+    write_manifest(embeddings_file, [chunks_file])
+    return text_chunks, embeddings
 
-def split_text_recursively(text, chunk_size=1000, chunk_overlap=20, separators=None, is_separator_regex=False):
+def get_relevent_contexts(openai_client, varnames, text_chunks, embeddings, relevance_dist='min', n_chunks=3):
     """
-    Split text by recursively looking at characters. Sourced from Langchain. Included directly to avoid adding extra dependencies. https://api.python.langchain.com/en/latest/_modules/langchain_text_splitters/character.html#RecursiveCharacterTextSplitter
+    Get the relevant context for many variable names at once.
 
-    Args:
-        text (str): The text to be split.
-        chunk_size (int, optional): The maximum size of each chunk. Defaults to 1000.
-        chunk_overlap (int, optional): The number of characters to overlap between chunks. Defaults to 20.
-        separators (list, optional): List of separators to use for splitting. Defaults to ["\n\n", "\n", " ", ""].
-        is_separator_regex (bool, optional): Whether the separators are regex patterns. Defaults to False.
-
-    Returns:
-        list: A list of text chunks.
-    """
-    if separators is None:
-        separators = ["\n\n", "\n", " ", ""]
-
-    def _split_text(text, separators):
-        final_chunks = []
-        separator = separators[-1]
-        new_separators = []
-        for i, _s in enumerate(separators):
-            _separator = _s if is_separator_regex else re.escape(_s)
-            if _s == "":
-                separator = _s
-                break
-            if re.search(_separator, text):
-                separator = _s
-                new_separators = separators[i + 1:]
-                break
-
-        _separator = separator if is_separator_regex else re.escape(separator)
-        splits = re.split(_separator, text)
-
-        _good_splits = []
-        for s in splits:
-            if len(s) < chunk_size:
-                _good_splits.append(s)
-            else:
-                if _good_splits:
-                    merged_text = _separator.join(_good_splits)
-                    final_chunks.append(merged_text)
-                    _good_splits = []
-                if not new_separators:
-                    final_chunks.append(s)
-                else:
-                    other_info = _split_text(s, new_separators)
-                    final_chunks.extend(other_info)
-        if _good_splits:
-            merged_text = _separator.join(_good_splits)
-            final_chunks.append(merged_text)
-        return final_chunks
-
-    chunks = _split_text(text, separators)
-    # Add overlap
-    final_chunks = []
-    for i in range(0, len(chunks)):
-        start = max(0, i * chunk_size - i * chunk_overlap)
-        end = start + chunk_size
-        final_chunks.append(chunks[i][start:end])
-    return final_chunks
-
-def embed_documents(openai_client, input_path, study):
-    """
-    Embed the documents for a given study.
+    All queries are embedded in batches and scored against every chunk in a single query x chunk
+    matrix product, the n_chunks closest chunks of each query are selected with a partial sort.
 
     Args:
         openai_client (object): The OpenAI client.
-        input_path (str): The input path for the study.
-        study (str): The study name.
+        varnames (list): The variable names.
+        text_chunks (list): The list of text chunks.
+        embeddings (ndarray): The (n_chunks, dim) embedding matrix of the text chunks.
+        relevance_dist (str, optional): 'min' for minimum distance, 'max' for maximum. Defaults to 'min'.
+        n_chunks (int, optional): The number of chunks joined into each context. Defaults to 3.
 
     Returns:
-        tuple: A tuple containing the text chunks and their embeddings.
-    """
-    with fs.open(f"{input_path}/{study}/context.txt", 'r', encoding='utf-8') as file:
-        doc_text = file.read()
-    text_chunks = split_text_recursively(doc_text, chunk_size=1000, chunk_overlap=20)
-    text_chunks = [chunk for chunk in text_chunks if chunk.strip()]  # Drop empty chunks
-    embeddings = []
-    for chunk in text_chunks:
-        embeddings.append(get_embedding(openai_client, chunk))
-    return text_chunks, embeddings
+        list: The relevant context for each variable, in the order of varnames, empty if there are no text chunks.
+    """
+    if len(varnames) == 0:
+        return []
+    if len(text_chunks) == 0:
+        return [''] * len(varnames)
+    queries = [f"variable name:  {varname}, label or description: " for varname in varnames]
+    embedded_queries = embeddings_to_matrix(get_embeddings_batch(openai_client, queries))
+    dists = cosine_distance_matrix(embedded_queries, embeddings)
+    if relevance_dist == 'max':
+        dists = -dists
+    idx, _ = top_k_smallest(dists, n_chunks)
+    return ['\n'.join([text_chunks[i] for i in row]) for row in idx]
 
 def get_relevent_context(openai_client, varname, text_chunks, embeddings, relevance_dist='min'):
     """
@@ -189,17 +187,13 @@ def get_relevent_context(openai_client, varname, text_chunks, embeddings, releva
         openai_client (object): The OpenAI client.
         varname (str): The variable name.
         text_chunks (list): The list of text chunks.
-        embeddings (list): The list of embeddings.
+        embeddings (ndarray): The (n_chunks, dim) embedding matrix of the text chunks.
         relevance_dist (str, optional): 'min' for minimum distance, 'max' for maximum. Defaults to 'min'.
 
     Returns:
         str: The relevant context for the variable.
     """
-    embedded_query = get_embedding(openai_client, f"variable name:  {varname}, label or description: ")
-    dists = [spatial.distance.cosine(embedded_query, x) for x in embeddings]
-    idx = get_index(dists, 3, by = relevance_dist)
-    example_context = [text_chunks[i] for i in idx] # type: ignore
-    return '\n'.join([x for x in example_context])
+    return get_relevent_contexts(openai_client, [varname], text_chunks, embeddings, relevance_dist)[0]
 
 def get_example_dict(openai_client, described, variables_df, text_chunks=None, embeddings=None):
     """
@@ -220,13 +214,12 @@ def get_example_dict(openai_client, described, variables_df, text_chunks=None, e
     example_limitor = len(described)
     if len(described)>5:
         example_limitor = 5
-    for num in range(0,example_limitor):
-        example = described[num]
+    examples = described[:example_limitor]
+    example_contexts = ['Not available'] * len(examples)
+    if embeddings is not None and text_chunks is not None:
+        example_contexts = get_relevent_contexts(openai_client, examples, text_chunks, embeddings)
+    for example, example_context in zip(examples, example_contexts):
         example_description = variables_df.loc[variables_df['variable_name'] == example]['description'].values[0]
-        if embeddings is not None and text_chunks is not None:
-            example_context = get_relevent_context(openai_client, example, text_chunks, embeddings)
-        else:
-            example_context = 'Not available'
         example_dict[example] = [example_description, example_context]
     return example_dict
 
@@ -274,68 +267,244 @@ def get_llm_response(openai_client, prompt):
     else:
         raise ValueError("No OpenAI API client found. Please provide an API key to proceed.")
 
+async def get_openai_llm_response_async(async_client, prompt, semaphore, slots=None):
+    """
+    Get the response from OpenAI's LLM for a given prompt without blocking the event loop.
+
+    Args:
+        async_client (object): The AsyncOpenAI client.
+        prompt (list): The prompt messages.
+        semaphore (asyncio.Semaphore): Bounds the number of requests in flight on this event loop.
+        slots (threading.BoundedSemaphore, optional): Bounds the number of requests in flight across event loops, see request_slots. Defaults to None.
+
+    Returns:
+        str: The response from the LLM.
+    """
+    llm_response = None
+    async with semaphore:
+        if slots is not None:
+            while not slots.acquire(blocking=False): # poll, so the event loop is never blocked
+                await asyncio.sleep(0.01)
+        try:
+            llm_response = await async_client.chat.completions.create(model="gpt-4o-mini", messages=prompt)
+        except:
+            await asyncio.sleep(1)
+            print('retry')
+            try:
+                llm_response = await async_client.chat.completions.create(model="gpt-4o-mini", messages=prompt)
+            except:
+                llm_response = None
+                print('openai fail') # if all fail good chance the context length is too long
+        finally:
+            if slots is not None:
+                slots.release()
+    if llm_response:
+        label = llm_response.choices[0].message.content # type: ignore
+        return ''.join(['*',label]) # add a * to indicate this description is AI generated
+    else:
+        return None
+
+async def get_llm_responses_async(async_client, prompts, max_concurrency, on_response=None):
+    """
+    Get the LLM responses for many prompts concurrently.
+
+    Args:
+        async_client (object): The AsyncOpenAI client.
+        prompts (list): The prompts, each a list of prompt messages.
+        max_concurrency (int): The maximum number of requests in flight, shared with the other studies described at the same time.
+        on_response (callable, optional): Called as on_response(i, response) as soon as the response to prompts[i] arrives. Defaults to None.
+
+    Returns:
+        list: The responses, in the same order as prompts.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    slots = request_slots(max_concurrency)
+
+    async def respond(i, prompt):
+        response = await get_openai_llm_response_async(async_client, prompt, semaphore, slots)
+        if on_response:
+            on_response(i, response)
+        return response
+
+    try:
+        return await asyncio.gather(*[respond(i, prompt) for i, prompt in enumerate(prompts)])
+    finally:
+        await async_client.close()
+
+def get_llm_responses(async_client, prompts, max_concurrency=16, on_response=None):
+    """
+    Get the LLM responses for many prompts, with at most max_concurrency requests in flight across every study described at the same time.
+
+    Args:
+        async_client (object): The AsyncOpenAI client.
+        prompts (list): The prompts, each a list of prompt messages.
+        max_concurrency (int, optional): The maximum number of requests in flight. Defaults to 16.
+        on_response (callable, optional): Called as on_response(i, response) as soon as the response to prompts[i] arrives. Defaults to None.
+
+    Returns:
+        list: The responses, in the same order as prompts.
+    """
+    if async_client:
+        return asyncio.run(get_llm_responses_async(async_client, prompts, max_concurrency, on_response))
+    else:
+        raise ValueError("No OpenAI API client found. Please provide an API key to proceed.")
+
+def description_inputs(study):
+    """
+    Get the files a study's completed descriptions are derived from.
+
+    Args:
+        study (str): The study name.
+    """
+    return [f'{input_path}/{study}/dataset_variables.csv', f'{input_path}/{study}/context.txt']
+
+def checkpoint_path(study):
+    """
+    Get the path of a study's description checkpoint.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        str: Path to the checkpoint, a JSON lines file with one generated description per line.
+    """
+    return f'{input_path}/{study}/descriptions_checkpoint.jsonl'
+
+def read_checkpoint(study):
+    """
+    Read the descriptions generated so far for a study.
+
+    The first line of the checkpoint records the fingerprint of the study's context document. A checkpoint
+    written against a different context is discarded, as its descriptions may no longer apply.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        dict: The generated descriptions, keyed by variable name.
+    """
+    checkpoint_file = checkpoint_path(study)
+    context = file_fingerprint(f'{input_path}/{study}/context.txt')
+    codebook = {}
+    if fs.exists(checkpoint_file):
+        with fs.open(checkpoint_file, 'r') as f:
+            lines = f.read().splitlines()
+        if lines and json.loads(lines[0]) == {'context': context}:
+            for line in lines[1:]:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError: # a line cut short by a crash
+                    continue
+                codebook[record['variable_name']] = record['description']
+            return codebook
+    with fs.open(checkpoint_file, 'w') as f:
+        f.write(json.dumps({'context': context}) + '\n')
+    return codebook
+
+def append_checkpoint(f, variable, description):
+    """
+    Append a generated description to a study's checkpoint and flush it to disk.
+
+    Args:
+        f (file): The checkpoint, open for appending.
+        variable (str): The variable name.
+        description (str): The generated description.
+    """
+    f.write(json.dumps({'variable_name': variable, 'description': description}) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+def generate_study_descriptions(openai_client, study, config):
+    """
+    Generate descriptions for the undescribed variables of a study.
+
+    Each description is appended to the study's checkpoint as soon as it is generated, and variables already
+    in the checkpoint are not sent to the LLM again, so an interrupted run resumes where it stopped.
+
+    Args:
+        openai_client (object): The OpenAI client.
+        study (str): The study name.
+        config (dict): The app configuration (.env values), holding the API key, init_prompt and max_concurrent_requests.
+    """
+    init_prompt = config['init_prompt']
+    max_concurrency = int(config.get('max_concurrent_requests') or 16)
+    variables_df = pd.read_csv(f'{input_path}/{study}/dataset_variables.csv')
+    # get variables to describe
+    to_do = []
+    described = []
+    for i in range(len(variables_df)):
+        if not type(variables_df.iloc[i]['description']) == str:
+            if math.isnan(variables_df.iloc[i]['description']):
+                to_do.append(variables_df.iloc[i]['variable_name'])
+        else:
+            described.append(variables_df.iloc[i]['variable_name'])
+
+    codebook = {}
+    if len(to_do) > 0:
+        codebook = {var: description for var, description in read_checkpoint(study).items() if var in to_do}
+        to_do = [var for var in to_do if var not in codebook] # skip variables described by an earlier run
+    if len(to_do) == 0 and len(codebook) == 0: # if all variables are described no need to do anything
+        variables_df.to_csv(f'{input_path}/{study}/dataset_variables_auto_completed.csv')
+        write_manifest(f'{input_path}/{study}/dataset_variables_auto_completed.csv', description_inputs(study))
+        return
+    if len(to_do) > 0:
+        # check if context is available
+        context_available = False
+        text_chunks, embeddings = None, None
+        if fs.exists(f"{input_path}/{study}/context.txt"):
+            text_chunks, embeddings = embed_documents(openai_client, input_path, study) 
+            context_available = len(text_chunks) > 0 # a document without text gives no context
+            if not context_available:
+                text_chunks, embeddings = None, None
+
+        # check if examples are available
+        example_dict = None
+        if not len(described) == 0:
+            example_dict = get_example_dict(openai_client, described, variables_df, text_chunks,embeddings)
+        
+        # get context for all variables if available
+        contexts = ['Not available'] * len(to_do)
+        if context_available:
+            contexts = get_relevent_contexts(openai_client, to_do, text_chunks, embeddings)
+
+        # create prompts
+        prompts = [return_prompt(init_prompt, var, context, example_dict) for var, context in zip(to_do, contexts)]
+
+        # get LLM responses concurrently, checkpointing each one as it arrives
+        with fs.open(checkpoint_path(study), 'a') as f:
+            def on_response(i, llm_response):
+                if llm_response: # failed requests are retried on the next run
+                    codebook[to_do[i]] = llm_response
+                    append_checkpoint(f, to_do[i], llm_response)
+            get_llm_responses(init_async_llm_models(config), prompts, max_concurrency, on_response)
+
+    # update variables_df from the checkpoint
+    variables_df['description'] = variables_df['description'].astype(str)
+    generated = variables_df['variable_name'].isin(list(codebook))
+    variables_df.loc[generated, 'description'] = variables_df.loc[generated, 'variable_name'].map(codebook)
+
+    # write to file
+    variables_df.to_csv(f'{input_path}/{study}/dataset_variables_auto_completed.csv', index = False)
+    failed = len(to_do) - sum(var in codebook for var in to_do)
+    if failed: # keep the checkpoint and leave the output stale so the next run retries only the failed variables
+        print(f'{failed} descriptions failed for {study}')
+    else:
+        write_manifest(f'{input_path}/{study}/dataset_variables_auto_completed.csv', description_inputs(study))
+        fs.rm(checkpoint_path(study))
+
 def generate_descriptions():
     """
     Generate descriptions for variables in datasets.
     """
     config = dotenv_values(".env")
     openai_client = init_llm_models(config)
-    init_prompt = config['init_prompt']
     avail_studies = [x for x in fs.ls(f'{input_path}/') if fs.isdir(x)] # get directories
     avail_studies = [f.split('/')[-1] for f in avail_studies if f.split('/')[-1][0] != '.'] # strip path and remove hidden folders
-    done = [x for x in avail_studies if fs.exists(f'{input_path}/{x}/dataset_variables_auto_completed.csv')] # skip already done
+    done = [x for x in avail_studies if is_up_to_date(f'{input_path}/{x}/dataset_variables_auto_completed.csv', description_inputs(x))] # skip already done
     avail_studies = [x for x in avail_studies if x not in done]
     for study in avail_studies:
         print(study)
-        variables_df = pd.read_csv(f'{input_path}/{study}/dataset_variables.csv')
-        # get variables to describe
-        to_do = []
-        described = []
-        for i in range(len(variables_df)):
-            if not type(variables_df.iloc[i]['description']) == str:
-                if math.isnan(variables_df.iloc[i]['description']):
-                    to_do.append(variables_df.iloc[i]['variable_name'])
-            else:
-                described.append(variables_df.iloc[i]['variable_name'])
-
-        if len(to_do) == 0: # if all variables are described no need to do anything
-            variables_df.to_csv(f'{input_path}/{study}/dataset_variables_auto_completed.csv')
-        else:
-            # check if context is available
-            context_available = False
-            text_chunks, embeddings = None, None
-            if fs.exists(f"{input_path}/{study}/context.txt"):
-                text_chunks, embeddings = embed_documents(openai_client, input_path, study) 
-                context_available = True
-
-            # check if examples are available
-            example_dict = None
-            if not len(described) == 0:
-                example_dict = get_example_dict(openai_client, described, variables_df, text_chunks,embeddings)
-            
-            # create descriptions
-            codebook = {}
-            for var in to_do:
-                # get context for variable if available
-                context = 'Not available'
-                if context_available:
-                    context = get_relevent_context(openai_client, var, text_chunks, embeddings)
-
-                # create prompt
-                prompt = return_prompt(init_prompt, var, context, example_dict)
-
-                # get LLM response
-                llm_response = get_llm_response(openai_client, prompt)
-                if llm_response:
-                    codebook[var] = llm_response
-            
-            # update variables_df
-            variables_df['description'] = variables_df['description'].astype(str)
-            for var in list(codebook):
-                variables_df.loc[variables_df['variable_name'] == var,'description'] = codebook[var]
-            
-            # write to file
-            variables_df.to_csv(f'{input_path}/{study}/dataset_variables_auto_completed.csv', index = False)
+        generate_study_descriptions(openai_client, study, config)
 
 if __name__ == '__main__':
     generate_descriptions()
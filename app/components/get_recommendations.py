@@ -1,8 +1,12 @@
 import pandas as pd
+import numpy as np
 import fsspec
-from scipy import spatial
 from dotenv import dotenv_values
-from .util import init_llm_models
+from .util import init_llm_models, is_up_to_date, write_manifest
+from .similarity import normalise_rows, cosine_distance_matrix, top_k_smallest, blocked_top_k
+from .ann_index import build_ivf_index, save_ivf_index, load_ivf_index, search_ivf_index, recall_at_k, default_n_probe
+from .embedding_cache import get_default_cache
+from .embedding_utils import get_embeddings_batch, get_embeddings_incremental, embeddings_to_matrix, save_embedding_store, load_embedding_store, embedding_store_exists, embedding_store_files, embedding_store_paths
 
 results_path = "results"
 input_path = "input"
@@ -10,42 +14,93 @@ preprocess_path = "preprocess"
 
 fs = fsspec.filesystem("")
 
-def get_embedding(openai_client, text, model="text-embedding-ada-002"):
+def embed_variables(openai_client, df, metadata_file):
     """
-    Generate an embedding for the given text using the specified OpenAI model.
+    Embed variable names and descriptions, only re-embedding rows that changed since the store was last written.
 
     Args:
         openai_client: The OpenAI client instance.
-        text (str): The text to generate an embedding for.
-        model (str): The model to use for generating the embedding.
+        df (DataFrame): The variables to embed, with 'variable_name' and 'description' columns.
+        metadata_file (str): Path of the embedding store to update.
+    """
+    previous_df, previous_var, previous_desc = pd.DataFrame(columns=['variable_name', 'description']), None, None
+    if embedding_store_exists(metadata_file):
+        previous_df, previous_var, previous_desc = load_embedding_store(metadata_file)
+    var_embeddings = get_embeddings_incremental(openai_client, df['variable_name'].to_list(), previous_df['variable_name'].to_list(), previous_var)
+    description_embeddings = get_embeddings_incremental(openai_client, df['description'].to_list(), previous_df['description'].to_list(), previous_desc)
+    save_embedding_store(metadata_file, df, var_embeddings, description_embeddings)
 
-    Returns:
-        list: The generated embedding.
-    """
-    text = str(text).replace("\n", " ")
-    if openai_client:
-        try:
-            response = openai_client.embeddings.create(input=[text], model=model)
-            return response.data[0].embedding
-        except Exception as e:
-            print(f"Error generating OpenAI embedding: {str(e)}")
-    else:
-        raise ValueError("No OpenAI client available. Please provide an OpenAI API key.")
-    return None
+def codebook_embedding_inputs():
+    """
+    Get the files the codebook embeddings are derived from.
+    """
+    return [f"{input_path}/target_variables.csv"]
+
+def study_embedding_inputs(study):
+    """
+    Get the files a study's embeddings are derived from.
+
+    Args:
+        study (str): The study name.
+    """
+    return [f'{input_path}/{study}/dataset_variables_auto_completed.csv']
+
+def recommendation_inputs(study):
+    """
+    Get the files a study's codebook recommendations are derived from.
+
+    Args:
+        study (str): The study name.
+    """
+    return embedding_store_files(f'{input_path}/{study}/dataset_variables_with_embeddings.csv') + embedding_store_files(f'{input_path}/target_variables_with_embeddings.csv')
+
+def PID_date_ranking_inputs(study):
+    """
+    Get the files a study's PID and date rankings are derived from: only the study's own embeddings, so codebook changes do not invalidate them.
+
+    Args:
+        study (str): The study name.
+    """
+    return embedding_store_files(f'{input_path}/{study}/dataset_variables_with_embeddings.csv')
+
+def PID_date_inputs(study):
+    """
+    Get the files a study's PID and date recommendations file (its codebook recommendations joined with its PID and date rankings) is derived from.
+
+    Args:
+        study (str): The study name.
+    """
+    return [f'{input_path}/{study}/dataset_variables_with_recommendations.csv'] + embedding_store_files(f'{input_path}/{study}/dataset_variables_with_embeddings.csv')
 
+def recommendations_up_to_date(study):
+    """
+    Check that a study's embeddings and recommendations were derived from the current codebook and study variables.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        bool: True if no recommendation stage needs to be rerun.
+    """
+    return (is_up_to_date(f'{input_path}/target_variables_with_embeddings.csv', codebook_embedding_inputs())
+            and is_up_to_date(f'{input_path}/{study}/dataset_variables_with_embeddings.csv', study_embedding_inputs(study))
+            and is_up_to_date(f'{input_path}/{study}/dataset_variables_with_recommendations.csv', recommendation_inputs(study))
+            and is_up_to_date(f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv', PID_date_inputs(study)))
 
 def embed_codebook(openai_client):
     """
     Embed the codebook variables and descriptions using the OpenAI client and save the results.
 
+    Only new or edited codebook rows are embedded if the codebook has changed since it was last embedded.
+
     Args:
         openai_client: The OpenAI client instance.
     """
-    if not fs.exists(f'{input_path}/target_variables_with_embeddings.csv'):
+    metadata_file = f'{input_path}/target_variables_with_embeddings.csv'
+    if not is_up_to_date(metadata_file, codebook_embedding_inputs()):
         df = pd.read_csv(f"{input_path}/target_variables.csv")
-        df["var_embeddings"] = df['variable_name'].apply(lambda x: get_embedding(openai_client, x)) # type: ignore
-        df["description_embeddings"] = df['description'].apply(lambda x: get_embedding(openai_client, x)) # type: ignore
-        df.to_csv(f'{input_path}/target_variables_with_embeddings.csv', index=False)
+        embed_variables(openai_client, df, metadata_file)
+        write_manifest(metadata_file, codebook_embedding_inputs())
 
 def embed_study(openai_client, study):
     """
@@ -55,51 +110,80 @@ def embed_study(openai_client, study):
         openai_client: The OpenAI client instance.
         study (str): The study name.
     """
+    metadata_file = f'{input_path}/{study}/dataset_variables_with_embeddings.csv'
     df = pd.read_csv(f'{input_path}/{study}/dataset_variables_auto_completed.csv')[['variable_name','description']]
-    df["var_embeddings"] = df['variable_name'].apply(lambda x: get_embedding(openai_client, x)) # type: ignore
-    df["description_embeddings"] = df['description'].apply(lambda x: get_embedding(openai_client, x)) # type: ignore
-
-    df.to_csv(f'{input_path}/{study}/dataset_variables_with_embeddings.csv', index=False)
+    embed_variables(openai_client, df, metadata_file)
+    write_manifest(metadata_file, study_embedding_inputs(study))
 
-def calculate_cosine_similarity(embedding1, embedding2):
+def codebook_ann_index(n_lists=None):
     """
-    Calculate the cosine similarity between two embeddings.
+    Get the approximate nearest neighbour index of the codebook embeddings, building it if the codebook changed.
 
     Args:
-        embedding1 (str): The first embedding.
-        embedding2 (str): The second embedding.
+        n_lists (int, optional): The number of inverted lists. Defaults to 4 * sqrt(codebook size).
 
     Returns:
-        float: The cosine similarity between the two embeddings.
+        dict: The IVF index.
     """
-    similarity = spatial.distance.cosine(eval(embedding1), eval(embedding2))
-    return similarity
-    
-def generate_recommendations(study):
+    index_file = f'{input_path}/target_variables_ann_index.npz'
+    metadata_file = f'{input_path}/target_variables_with_embeddings.csv'
+    if not is_up_to_date(index_file, embedding_store_files(metadata_file), {'n_lists': n_lists}):
+        _, target_var_embeddings, target_desc_embeddings = load_embedding_store(metadata_file, mmap_mode='r')
+        index = build_ivf_index(target_desc_embeddings, target_var_embeddings, n_lists)
+        save_ivf_index(index_file, index)
+        write_manifest(index_file, embedding_store_files(metadata_file), {'n_lists': n_lists})
+        print(f"Built codebook ANN index with {len(index['centroids'])} lists")
+    return load_ivf_index(index_file)
 
+def generate_recommendations(study, top_k=50, ann_threshold=20000, n_lists=None, n_probe=None, block_size=None, n_workers=1, max_matrix_size=50000000):
     """
     Generate recommendations for the given study based on cosine similarity of embeddings.
 
+    The name and description distances to every codebook variable are computed as two matrix
+    products and blended (0.8 description, 0.2 name), only the top_k closest codebook variables
+    are kept for each study variable. Codebooks with at least ann_threshold variables are searched
+    with an approximate nearest neighbour (IVF) index instead, whose recall against exact search is
+    logged for a sample of the study variables. If the full distance matrix would hold
+    more than max_matrix_size values (or block_size is given) study rows are scored in blocks with a
+    running top_k, optionally sharded across n_workers processes over the memory mapped embeddings.
+
     Args:
         study (str): The study name.
+        top_k (int, optional): The number of recommendations to keep per variable. Defaults to 50.
+        ann_threshold (int, optional): The codebook size from which the ANN index is used. Defaults to 20000.
+        n_lists (int, optional): The number of inverted lists of the ANN index. Defaults to 4 * sqrt(codebook size).
+        n_probe (int, optional): The number of inverted lists searched per variable. Defaults to 2 * sqrt(n_lists), at least 8.
+        block_size (int, optional): The number of study rows scored at once in blocked mode. Defaults to None (1024 if the matrix is too large).
+        n_workers (int, optional): The number of processes blocked mode is sharded across. Defaults to 1.
+        max_matrix_size (int, optional): The largest distance matrix computed in one go. Defaults to 50000000.
     """
-
-    study_df = pd.read_csv(f'{input_path}/{study}/dataset_variables_with_embeddings.csv')
-    target_df = pd.read_csv(f'{input_path}/target_variables_with_embeddings.csv')
-    recommendations = []
-    distances = []
-    for i in range(len(study_df)):
-        study_var = study_df['var_embeddings'].iloc[i]
-        target_df["var_distance"] = target_df['var_embeddings'].apply(lambda x: calculate_cosine_similarity(study_var, x)) # type: ignore
-        study_desc = study_df['description_embeddings'].iloc[i]
-        target_df["desc_distance"] = target_df['description_embeddings'].apply(lambda x: calculate_cosine_similarity(study_desc, x)) # type: ignore
-        target_df["distance"] = (target_df["desc_distance"] * 0.8) + (target_df["var_distance"] * 0.2)
-        target_df = target_df.sort_values("distance")
-        recommendations.append(list(target_df.description))
-        distances.append(list(target_df.distance))
-    study_df['target_recommendations'] = recommendations
-    study_df['target_distances'] = distances
+    study_file = f'{input_path}/{study}/dataset_variables_with_embeddings.csv'
+    target_file = f'{input_path}/target_variables_with_embeddings.csv'
+    study_df, study_var_embeddings, study_desc_embeddings = load_embedding_store(study_file, mmap_mode='r')
+    target_df, target_var_embeddings, target_desc_embeddings = load_embedding_store(target_file, mmap_mode='r')
+    if block_size is None and len(study_df) * len(target_df) > max_matrix_size:
+        block_size = 1024
+    if len(target_df) >= ann_threshold:
+        index = codebook_ann_index(n_lists)
+        n_probe = n_probe or default_n_probe(len(index['centroids']))
+        target_desc_embeddings, target_var_embeddings = normalise_rows(target_desc_embeddings), normalise_rows(target_var_embeddings)
+        idx, top_distances = search_ivf_index(index, target_desc_embeddings, target_var_embeddings,
+                                              study_desc_embeddings, study_var_embeddings, top_k, n_probe)
+        sample = np.sort(np.random.default_rng(0).choice(len(study_df), min(200, len(study_df)), replace=False))
+        recall = recall_at_k(index, target_desc_embeddings, target_var_embeddings, study_desc_embeddings[sample], study_var_embeddings[sample], n_probe=n_probe)
+        print(f"{study}: ANN search of {len(index['centroids'])} lists with n_probe {n_probe}, recall@10 {recall:.3f} on {len(sample)} study variables")
+    elif block_size:
+        idx, top_distances = blocked_top_k(embedding_store_paths(study_file)[::-1], embedding_store_paths(target_file)[::-1], top_k, block_size, n_workers=n_workers)
+    else:
+        var_distance = cosine_distance_matrix(study_var_embeddings, target_var_embeddings)
+        desc_distance = cosine_distance_matrix(study_desc_embeddings, target_desc_embeddings)
+        distance = (desc_distance * 0.8) + (var_distance * 0.2)
+        idx, top_distances = top_k_smallest(distance, top_k)
+    target_descriptions = target_df['description'].to_numpy()
+    study_df['target_recommendations'] = [list(target_descriptions[row]) for row in idx]
+    study_df['target_distances'] = [row.tolist() for row in top_distances]
     study_df.to_csv(f'{input_path}/{study}/dataset_variables_with_recommendations.csv', index = False)
+    write_manifest(f'{input_path}/{study}/dataset_variables_with_recommendations.csv', recommendation_inputs(study))
 
 def get_embeddings():
     """
@@ -114,8 +198,9 @@ def get_embeddings():
     avail_studies = [x for x in fs.ls(f'{input_path}/') if fs.isdir(x)] # get directories
     avail_studies = [f.split('/')[-1] for f in avail_studies if f.split('/')[-1][0] != '.'] # strip path and remove hidden folders
     for study in avail_studies:
-        if not fs.exists(f'{input_path}/{study}/dataset_variables_with_embeddings.csv'):
+        if not is_up_to_date(f'{input_path}/{study}/dataset_variables_with_embeddings.csv', study_embedding_inputs(study)):
             embed_study(openai_client, study)
+    print(f"Embedding cache: {get_default_cache().stats()}")
         
 def get_recommendations():
     """
@@ -126,47 +211,65 @@ def get_recommendations():
     """
     avail_studies = [x for x in fs.ls(f'{input_path}/') if fs.isdir(x)] # get directories
     avail_studies = [f.split('/')[-1] for f in avail_studies if f.split('/')[-1][0] != '.'] # strip path and remove hidden folders
+    config = dotenv_values(".env")
+    n_lists = int(config['ann_n_lists']) if config.get('ann_n_lists') else None
+    n_probe = int(config['ann_n_probe']) if config.get('ann_n_probe') else None
+    block_size = int(config['score_block_size']) if config.get('score_block_size') else None
+    n_workers = int(config.get('score_workers') or 1)
     for study in avail_studies:
-        if not fs.exists(f'{input_path}/{study}/dataset_variables_with_recommendations.csv'):
-            generate_recommendations(study)
+        if not is_up_to_date(f'{input_path}/{study}/dataset_variables_with_recommendations.csv', recommendation_inputs(study)):
+            generate_recommendations(study, n_lists=n_lists, n_probe=n_probe, block_size=block_size, n_workers=n_workers)
 
-def generate_PID_date_recommendations(openai_client, study):
+def generate_PID_date_rankings(openai_client, study, top_k=50):
+    """
+    Rank a study's variables as the Index and date of each of its variables.
+
+    A 'Date of ...' and 'Unique Identifier of ...' query is embedded (in batches) for every variable
+    description and scored against all of the study's description embeddings in one matrix product,
+    only the top_k closest variables are kept. The rankings are saved to dataset_variables_PID_date_rankings.csv.
+
+    Args:
+        openai_client: The OpenAI client instance.
+        study (str): The study name.
+        top_k (int, optional): The number of recommendations to keep per variable. Defaults to 50.
+    """
+    rankings_file = f'{input_path}/{study}/dataset_variables_PID_date_rankings.csv'
+    study_df, _, study_desc_embeddings = load_embedding_store(f'{input_path}/{study}/dataset_variables_with_embeddings.csv')
+    study_desc_embeddings = normalise_rows(study_desc_embeddings)
+    variable_names = study_df['variable_name'].to_numpy()
+    rankings_df = study_df[['variable_name']].copy()
+    for type_, query in [('date', 'Date of {}'), ('PID', 'Unique Identifier of {}')]:
+        queries = [query.format(x) for x in study_df['description']]
+        query_embeddings = normalise_rows(embeddings_to_matrix(get_embeddings_batch(openai_client, queries)))
+        distance = cosine_distance_matrix(query_embeddings, study_desc_embeddings, normalised=True)
+        idx, top_distances = top_k_smallest(distance, top_k)
+        rankings_df[f'{type_}_recommendations'] = [list(variable_names[row]) for row in idx]
+        rankings_df[f'{type_}_distances'] = top_distances.tolist()
+    rankings_df.to_csv(rankings_file, index = False)
+    write_manifest(rankings_file, PID_date_ranking_inputs(study), {'top_k': top_k})
+
+def generate_PID_date_recommendations(openai_client, study, top_k=50):
     """
     Generate Index and date recommendations for the given study.
 
+    The study's codebook recommendations are joined with its PID and date rankings, which are only
+    recomputed (see generate_PID_date_rankings) when the study's own embeddings change, not when the codebook does.
+
     Args:
         openai_client: The OpenAI client instance.
         study (str): The study name.
+        top_k (int, optional): The number of recommendations to keep per variable. Defaults to 50.
     """
+    rankings_file = f'{input_path}/{study}/dataset_variables_PID_date_rankings.csv'
+    if not is_up_to_date(rankings_file, PID_date_ranking_inputs(study), {'top_k': top_k}):
+        generate_PID_date_rankings(openai_client, study, top_k)
     study_df = pd.read_csv(f'{input_path}/{study}/dataset_variables_with_recommendations.csv')
-    date_recommendations = []
-    date_distances = []
-    for i in range(len(study_df)):
-        study_var = study_df['description'].iloc[i]
-        date_embed = get_embedding(openai_client, f'Date of {study_var}')
-        date_embed = str(date_embed) # need to convert to string so eval in cosine similarity func works
-        study_df["date_distance"] = study_df['description_embeddings'].apply(lambda x: calculate_cosine_similarity(date_embed, x)) # type: ignore
-        study_df_sorted = study_df.sort_values("date_distance")
-        date_recommendations.append(list(study_df_sorted.variable_name))
-        date_distances.append(list(study_df_sorted.date_distance))
-    study_df['date_recommendations'] = date_recommendations
-    study_df['date_distances'] = date_distances
-
-    PID_recommendations = []
-    PID_distances = []
-    for i in range(len(study_df)):
-        study_var = study_df['description'].iloc[i]
-        PID_embed = get_embedding(openai_client, f'Unique Identifier of {study_var}')
-        PID_embed = str(PID_embed) # need to convert to string so eval in cosine similarity func works
-        study_df["PID_distance"] = study_df['description_embeddings'].apply(lambda x: calculate_cosine_similarity(PID_embed, x)) # type: ignore
-        study_df_sorted = study_df.sort_values("PID_distance")
-        PID_recommendations.append(list(study_df_sorted.variable_name))
-        PID_distances.append(list(study_df_sorted.PID_distance))
-
-    study_df['PID_recommendations'] = PID_recommendations
-    study_df['PID_distances'] = PID_distances
-
+    rankings_df = pd.read_csv(rankings_file)
+    if not study_df['variable_name'].astype(str).equals(rankings_df['variable_name'].astype(str)): # both follow the embedding store's row order
+        raise ValueError(f"The PID and date rankings of {study} do not match its recommendations, rerun the recommendation engine")
+    study_df = pd.concat([study_df, rankings_df.drop(columns='variable_name')], axis=1)
     study_df.to_csv(f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv', index = False)
+    write_manifest(f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv', PID_date_inputs(study))
 
 
 def get_PID_date_recommendations():
@@ -181,5 +284,5 @@ def get_PID_date_recommendations():
     avail_studies = [x for x in fs.ls(f'{input_path}/') if fs.isdir(x)] # get directories
     avail_studies = [f.split('/')[-1] for f in avail_studies if f.split('/')[-1][0] != '.'] # strip path and remove hidden folders
     for study in avail_studies:
-        if not fs.exists(f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv'):
+        if not is_up_to_date(f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv', PID_date_inputs(study)):
             generate_PID_date_recommendations(openai_client, study)
\ No newline at end of file
@@ -0,0 +1,247 @@
+import concurrent.futures as cf
+import numpy as np
+import pandas as pd
+import fsspec
+from .results_store import get_results
+from .transformation_utils import apply_transformation, compile_direct_conversion, compile_catagorical_conversion
+
+results_path = "results"
+input_path = "input"
+preprocess_path = "preprocess"
+
+harmonised_path = f"{results_path}/harmonised"
+
+fs = fsspec.filesystem("")
+
+CHUNK_SIZE = 500000 # source rows read at a time
+report_columns = ['source_var', 'target_var', 'rows', 'source_missing', 'output_missing', 'nulls_introduced', 'values_rejected', 'values_failed', 'error']
+
+def parse_categories(categories):
+    """
+    Parse the Categories cell of a codebook variable, eg. "yes', 'no'".
+
+    Args:
+        categories (str): The cell value.
+
+    Returns:
+        set: The allowed values, or None if the variable is not categorical.
+    """
+    if not isinstance(categories, str) or categories.strip() == '':
+        return None
+    return set(x.strip().strip("'\"").strip() for x in categories.split("',"))
+
+def harmonisation_plan(study):
+    """
+    Get the successfully mapped variables of a study with the codebook column name and transformation of each.
+
+    Mapping results record the codebook description, which is looked up in the codebook to get the
+    variable_name used as the output column. Studies mapping several variables to one codebook variable
+    get one '<target>__<source>' column per source variable.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        list: One dict per mapped variable, with the source and target column names, the transformation, the target's allowed
+              categories and the study's patient ID and date variables recorded in relational mode (None if not recorded).
+
+    Raises:
+        ValueError: If a mapped variable's transformation instructions are invalid.
+    """
+    results_df = get_results(study)
+    results_df = results_df[(results_df['marked'] == 'Successfully mapped') & results_df['codebook_var'].notna() & (results_df['codebook_var'] != 'None')]
+    codebook = pd.read_csv(f'{input_path}/target_variables.csv')
+    codebook = codebook.drop_duplicates(subset=['description']).set_index('description')
+    plan = []
+    for row in results_df.to_dict('records'):
+        instructions = row['transformation_instructions']
+        if not isinstance(instructions, str) or instructions.strip() in ('', 'x', 'None'):
+            instructions = None # values are copied as they are
+        elif row['transformation_type'] == 'Direct':
+            compile_direct_conversion(instructions, row['source_dtype'], row['target_dtype']) # fail before reading any data
+        elif row['transformation_type'] == 'Categorical':
+            compile_catagorical_conversion(instructions)
+        target = row['codebook_var']
+        categories = None
+        if target in codebook.index:
+            if 'Categories' in codebook.columns:
+                categories = parse_categories(codebook.loc[target, 'Categories'])
+            target = codebook.loc[target, 'variable_name']
+        plan.append({'source_var': row['study_var'], 'target_var': target, 'transformation_type': row['transformation_type'],
+                     'transformation_instructions': instructions, 'source_dtype': row['source_dtype'],
+                     'target_dtype': row['target_dtype'], 'categories': categories,
+                     'patient_id_var': None if row['patient_id_var'] in (None, 'None') or pd.isna(row['patient_id_var']) else row['patient_id_var'],
+                     'date_var': None if row['date_var'] in (None, 'None') or pd.isna(row['date_var']) else row['date_var']})
+    targets = [x['target_var'] for x in plan]
+    for variable in plan:
+        if targets.count(variable['target_var']) > 1:
+            variable['target_var'] = f"{variable['target_var']}__{variable['source_var']}"
+    return plan
+
+def output_column(values, variable):
+    """
+    Give a harmonised column a fixed dtype, so every part file of the output has the same schema.
+
+    Args:
+        values (pd.Series): The harmonised values.
+        variable (dict): The mapped variable.
+
+    Returns:
+        pd.Series: The values as float64, Int64 or boolean for direct conversions to those dtypes, otherwise as strings.
+    """
+    dtype = variable['target_dtype'] if variable['transformation_type'] == 'Direct' and variable['transformation_instructions'] is not None else None
+    if dtype == 'float':
+        return values.astype('float64')
+    if dtype in ('integer', 'int'):
+        return values.astype('Int64')
+    if dtype == 'boolean':
+        return values.astype('boolean')
+    return values.astype(str).where(values.notna()).astype('string')
+
+def transform_chunk(chunk, plan):
+    """
+    Apply the mapped transformations to a chunk of source data.
+
+    A variable whose transformation raises is output as nulls for the chunk, and its error recorded in the report,
+    so one bad transformation does not stop the others.
+
+    Args:
+        chunk (pd.DataFrame): The source rows, read as strings.
+        plan (list): The mapped variables, as returned by harmonisation_plan.
+
+    Returns:
+        tuple: The harmonised chunk, with the codebook column names, and its per variable report counts.
+    """
+    harmonised, report = {}, []
+    for variable in plan:
+        source = chunk[variable['source_var']]
+        failed, error = 0, None
+        if variable['transformation_instructions'] is None:
+            output = source
+        else:
+            try:
+                output = apply_transformation(source, variable['transformation_type'], variable['transformation_instructions'],
+                                              variable['source_dtype'], variable['target_dtype'])
+            except Exception as e:
+                output = pd.Series(np.nan, index=chunk.index)
+                failed, error = int(source.notna().sum()), f"{type(e).__name__}: {e}"
+        rejected = 0
+        if variable['categories'] is not None:
+            invalid = output.notna() & ~output.astype(str).isin(variable['categories'])
+            rejected = int(invalid.sum())
+            output = output.where(~invalid)
+        harmonised[variable['target_var']] = output_column(output, variable)
+        report.append({'source_var': variable['source_var'], 'target_var': variable['target_var'], 'rows': len(chunk),
+                       'source_missing': int(source.isna().sum()), 'output_missing': int(output.isna().sum()),
+                       'nulls_introduced': int((source.notna() & output.isna()).sum()), 'values_rejected': rejected,
+                       'values_failed': failed, 'error': error})
+    return pd.DataFrame(harmonised, index=chunk.index), pd.DataFrame(report, columns=report_columns)
+
+def harmonise_part(chunk, plan, part_file, output_format):
+    """
+    Transform a chunk and write it to its own part file.
+
+    Args:
+        chunk (pd.DataFrame): The source rows.
+        plan (list): The mapped variables.
+        part_file (str): Path to the part file.
+        output_format (str): 'parquet' or 'csv'.
+
+    Returns:
+        pd.DataFrame: The chunk's per variable report counts.
+    """
+    harmonised, report = transform_chunk(chunk, plan)
+    if output_format == 'parquet':
+        harmonised.to_parquet(part_file, index=False)
+    else:
+        harmonised.to_csv(part_file, index=False)
+    return report
+
+def harmonise_study(study, source_file, output_format='parquet', chunksize=CHUNK_SIZE, n_workers=1, on_progress=None):
+    """
+    Harmonise a study's full dataset: stream it in chunks, apply every mapped variable's transformation and
+    write the output with the target codebook's column names.
+
+    Chunks are transformed by a pool of n_workers processes, each writing its own part file
+    (results/harmonised/<study>/part-00000.parquet, ...). At most two chunks per worker are in flight,
+    so memory is bounded by the chunk size whatever the size of the dataset. A per variable report is
+    written to results/harmonised/<study>_report.csv: nulls_introduced counts the source values that
+    are missing from the output, either because their conversion failed or because they were rejected,
+    values_rejected counts the converted values that fall outside the codebook's categories and values_failed
+    the source values lost because the variable's transformation raised, with the first error in error.
+    If harmonisation stops, the part files written so far are removed.
+
+    Args:
+        study (str): The study name.
+        source_file (str): Path to the study's full dataset, a CSV with the study variable names as columns.
+        output_format (str, optional): 'parquet' or 'csv'. Defaults to 'parquet'.
+        chunksize (int, optional): The number of rows read at a time. Defaults to CHUNK_SIZE.
+        n_workers (int, optional): The number of worker processes. Defaults to 1.
+        on_progress (callable, optional): Called with the number of rows harmonised so far. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The per variable report.
+    """
+    plan = harmonisation_plan(study)
+    if len(plan) == 0:
+        raise ValueError(f"{study} has no successfully mapped variables to harmonise")
+    columns = pd.read_csv(source_file, nrows=0).columns
+    missing = [x['source_var'] for x in plan if x['source_var'] not in columns]
+    if missing:
+        raise ValueError(f"The source dataset is missing the mapped variables: {', '.join(missing)}")
+    output_path = f"{harmonised_path}/{study}"
+    if fs.exists(output_path):
+        fs.rm(output_path, recursive=True)
+    fs.mkdirs(output_path, exist_ok=True)
+    usecols = list(dict.fromkeys(x['source_var'] for x in plan))
+    try:
+        reports = harmonise_chunks(pd.read_csv(source_file, dtype=str, usecols=usecols, chunksize=chunksize), plan, output_path,
+                                   output_format, n_workers, on_progress)
+    except BaseException:
+        fs.rm(output_path, recursive=True) # no partial output
+        raise
+    report = pd.concat(reports, ignore_index=True)
+    report = report.groupby(['source_var', 'target_var'], sort=False).agg({**{x: 'sum' for x in report_columns[2:-1]}, 'error': 'first'}).reset_index()
+    report.to_csv(f"{harmonised_path}/{study}_report.csv", index=False)
+    return report
+
+def harmonise_chunks(chunks, plan, output_path, output_format, n_workers, on_progress):
+    """
+    Harmonise the chunks of a study's dataset into part files, in n_workers processes if more than one.
+
+    Args:
+        chunks (iterable): The chunks of source rows.
+        plan (list): The mapped variables.
+        output_path (str): The directory of the part files.
+        output_format (str): 'parquet' or 'csv'.
+        n_workers (int): The number of worker processes.
+        on_progress (callable): Called with the number of rows harmonised so far, or None.
+
+    Returns:
+        list: The per variable report of each chunk.
+    """
+    reports, rows = [], 0
+    if n_workers > 1:
+        with cf.ProcessPoolExecutor(max_workers=n_workers) as pool:
+            running = set()
+            for i, chunk in enumerate(chunks):
+                if len(running) >= 2 * n_workers:
+                    done, running = cf.wait(running, return_when=cf.FIRST_COMPLETED)
+                    for future in done:
+                        reports.append(future.result())
+                        rows += reports[-1]['rows'].iloc[0]
+                        if on_progress:
+                            on_progress(rows)
+                running.add(pool.submit(harmonise_part, chunk, plan, f"{output_path}/part-{i:05d}.{output_format}", output_format))
+            for future in cf.as_completed(running):
+                reports.append(future.result())
+                rows += reports[-1]['rows'].iloc[0]
+                if on_progress:
+                    on_progress(rows)
+    else:
+        for i, chunk in enumerate(chunks):
+            reports.append(harmonise_part(chunk, plan, f"{output_path}/part-{i:05d}.{output_format}", output_format))
+            rows += len(chunk)
+            if on_progress:
+                on_progress(rows)
+    return reports
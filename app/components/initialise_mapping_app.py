@@ -1,9 +1,13 @@
 import streamlit as st
+import pandas as pd
 import fsspec
 from dotenv import dotenv_values
-from .get_recommendations import get_embeddings, get_recommendations, get_PID_date_recommendations
-from .generate_descriptions import generate_descriptions, convert_pdf_to_txt
-from .util import modify_env, delete_files_and_folders
+from .get_recommendations import codebook_embedding_inputs, recommendations_up_to_date
+from .generate_descriptions import description_inputs
+from .pipeline import stages
+from .jobs import submit_pipeline_job, resume_interrupted_jobs, latest_job, job_progress
+from .util import modify_env, delete_files_and_folders, is_up_to_date
+from .results_store import close_store
 
 fs = fsspec.filesystem("")
 
@@ -11,6 +15,30 @@ results_path = "results"
 input_path = "input"
 preprocess_path = "preprocess"
 
+status_icons = {'pending': ':hourglass:', 'running': ':arrows_counterclockwise:', 'done': ':white_check_mark:',
+                'up_to_date': ':white_check_mark:', 'failed': ':x:', 'skipped': ':heavy_minus_sign:'}
+
+def show_job_progress(job):
+    """
+    Display the per study, per stage progress of a background job with its rate and ETA.
+
+    Args:
+        job (dict): The job record.
+    """
+    progress = job_progress(job)
+    st.write(f"Recommendation engine job `{job['id']}`: **{job['status']}**")
+    st.progress(progress['finished'] / max(progress['total'], 1), text=f"{progress['finished']} of {progress['total']} stages finished")
+    if job['status'] == 'running':
+        rate = f"{progress['rate']:.1f} stages/min" if progress['rate'] else 'measuring'
+        eta = f"{progress['eta'] / 60:.0f} min" if progress['eta'] is not None else 'unknown'
+        st.write(f"Rate: {rate}, ETA: {eta}")
+        st.button("Refresh Progress", key='refresh')
+    if 'error' in job:
+        st.write(f":red[{job['error']}]")
+    table = pd.DataFrame(progress['table']).T.reindex(columns=stages).fillna('')
+    table = table.apply(lambda col: col.map(lambda x: f"{status_icons.get(x, '')} {x}".strip()))
+    st.dataframe(table, use_container_width=True)
+
 def initialise_mapping_recommendations():
     """
     Initialise the mapping recommendations by setting up the environment and checking for necessary files.
@@ -46,6 +74,10 @@ def initialise_mapping_recommendations():
     else:
         pass
 
+    max_concurrent_requests = st.number_input('Concurrent LLM Requests', min_value=1, max_value=256, value=int(config.get('max_concurrent_requests') or 16), help='The maximum number of description requests sent to the LLM at the same time. Lower this if you hit rate limits.')
+    if config.get('max_concurrent_requests') != str(max_concurrent_requests):
+        modify_env('max_concurrent_requests', str(max_concurrent_requests))
+
     if 'auto_transform_available' not in list(config):
         modify_env('auto_transform_available', 'no')
     else:
@@ -56,10 +88,10 @@ def initialise_mapping_recommendations():
     ready_to_run = False
     if fs.exists(f'{input_path}/target_variables.csv'):
         ready_to_run = True
-        if fs.exists(f'{input_path}/target_variables_with_embeddings.csv'):
+        if is_up_to_date(f'{input_path}/target_variables_with_embeddings.csv', codebook_embedding_inputs()):
             st.write(":green[Codebook Uploaded and Embeddings Fetched :white_check_mark:]")
         else:
-            st.write(":green[Codebook Uploaded, ] :red[Embeddings Not Fetched]")
+            st.write(":green[Codebook Uploaded, ] :red[Embeddings Not Fetched or Out of Date]")
     else:
         st.write(":red[Please upload a codebook and study to map]")
 
@@ -68,34 +100,39 @@ def initialise_mapping_recommendations():
         avail_studies = [f for f in fs.ls(f"{input_path}/") if fs.isdir(f)]
         avail_studies = [f.split('/')[-1] for f in avail_studies if f.split('/')[-1][0] != '.']
         uploaded = [x for x in avail_studies if fs.exists(f"{input_path}/{x}/dataset_variables.csv")]
-        mapped = [x for x in avail_studies if fs.exists(f'{input_path}/{x}/dataset_variables_with_recommendations.csv')]
+        mapped = [x for x in uploaded if is_up_to_date(f'{input_path}/{x}/dataset_variables_auto_completed.csv', description_inputs(x)) and recommendations_up_to_date(x)]
 
         if len(uploaded) > 0 :
             if len(uploaded) == len(mapped):
                 st.write(f":green[{len(uploaded)} studies have been uploaded and recommendations created for all of them. :white_check_mark:]")
             else:
-                st.write(f":green[{len(uploaded)} studies have been uploaded.] :red[{len(mapped)} studies have had recommendations created for them.]")
+                st.write(f":green[{len(uploaded)} studies have been uploaded.] :red[{len(mapped)} studies have up to date recommendations.]")
         else:
             st.write(":red[Please upload a study to map]")
 
-        run = st.button("Run Recommendation Engine", key = 'run')
+        resumed = resume_interrupted_jobs()
+        if resumed:
+            st.write(f":orange[Resumed interrupted job {', '.join(resumed)}]")
+        job = latest_job()
+        job_running = job is not None and job['status'] == 'running'
+
+        run = st.button("Run Recommendation Engine", key = 'run', disabled = job_running, help = 'The engine runs in the background, you can close this tab and come back to check on progress.')
         if run:
-            with st.spinner('Phoning a friend :coffee:...'):
-                convert_pdf_to_txt()
-                generate_descriptions()
-                get_embeddings()
-                get_recommendations()
-                get_PID_date_recommendations()
-                del st.session_state['run'] 
-                # I need to use session states the above is a hack to fix death looping 
-                # see https://discuss.streamlit.io/t/how-should-st-rerun-behave/54153/2
-                st.rerun()
+            submit_pipeline_job()
+            del st.session_state['run'] 
+            # I need to use session states the above is a hack to fix death looping 
+            # see https://discuss.streamlit.io/t/how-should-st-rerun-behave/54153/2
+            st.rerun()
+
+        if job is not None:
+            show_job_progress(job)
 
         st.divider()
 
-        clear = st.button(":red[Clear Workspace]", key = 'clear')
+        clear = st.button(":red[Clear Workspace]", key = 'clear', disabled = job_running, help = 'Wait for the recommendation engine to finish before clearing the workspace.' if job_running else None)
         if clear:
             delete_files_and_folders("input/")
+            close_store()
             delete_files_and_folders("results/")
             st.cache_data.clear()
             st.rerun()
\ No newline at end of file
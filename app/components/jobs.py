@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import uuid
+import threading
+import fsspec
+from .pipeline import run_pipeline, list_studies, stages
+
+results_path = "results"
+input_path = "input"
+preprocess_path = "preprocess"
+
+jobs_path = f"{input_path}/.jobs"
+
+fs = fsspec.filesystem("")
+
+_active_jobs = set() # jobs running in this process
+_lock = threading.Lock()
+
+def job_file(job_id):
+    """
+    Get the path of a job record.
+
+    Args:
+        job_id (str): The job id.
+
+    Returns:
+        str: Path to the job's JSON record.
+    """
+    return f"{jobs_path}/{job_id}.json"
+
+def write_job(job):
+    """
+    Atomically write a job record to disk.
+
+    Args:
+        job (dict): The job record.
+    """
+    fs.mkdirs(jobs_path, exist_ok=True)
+    job['updated'] = time.time()
+    tmp_file = f"{job_file(job['id'])}.tmp"
+    with fs.open(tmp_file, 'w') as f:
+        json.dump(job, f, indent=1)
+    os.replace(tmp_file, job_file(job['id']))
+
+def read_job(job_id):
+    """
+    Read a job record from disk.
+
+    Args:
+        job_id (str): The job id.
+
+    Returns:
+        dict: The job record.
+    """
+    with fs.open(job_file(job_id), 'r') as f:
+        return json.load(f)
+
+def list_jobs():
+    """
+    List all job records, oldest first.
+
+    Returns:
+        list: The job records.
+    """
+    if not fs.exists(jobs_path):
+        return []
+    jobs = [read_job(f.split('/')[-1][:-len('.json')]) for f in fs.ls(jobs_path) if f.endswith('.json')]
+    return sorted(jobs, key=lambda x: x['created'])
+
+def latest_job():
+    """
+    Get the most recently created job.
+
+    Returns:
+        dict: The job record, or None if no job has been submitted.
+    """
+    jobs = list_jobs()
+    return jobs[-1] if jobs else None
+
+def process_alive(pid):
+    """
+    Check whether a process is still running.
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        bool: True if the process exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def is_interrupted(job):
+    """
+    Check whether a job was left running by a process that is no longer working on it, eg. after a server restart.
+
+    Args:
+        job (dict): The job record.
+
+    Returns:
+        bool: True if the job should be resumed.
+    """
+    if job['status'] != 'running' or job['id'] in _active_jobs:
+        return False
+    return job['pid'] == os.getpid() or not process_alive(job['pid'])
+
+def _run_job(job_id):
+    """
+    Run the pipeline of a job, recording every task status change in the job record.
+
+    Args:
+        job_id (str): The job id.
+    """
+    job = read_job(job_id)
+
+    def on_update(task_id, status):
+        with _lock:
+            task = job['tasks'].setdefault(task_id, {})
+            task['status'] = status
+            if status == 'running':
+                task['started'] = time.time()
+            elif status in ('done', 'up_to_date', 'failed', 'skipped'):
+                task['finished'] = time.time()
+            write_job(job)
+
+    try:
+        status = run_pipeline(job['studies'], on_update=on_update)
+        job['status'] = 'failed' if 'failed' in status.values() else 'done'
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    finally:
+        with _lock:
+            write_job(job)
+            _active_jobs.discard(job_id)
+
+def _claim_job(job):
+    """
+    Mark a job as running in this process. The caller must hold _lock.
+
+    Args:
+        job (dict): The job record.
+    """
+    _active_jobs.add(job['id'])
+    job['status'] = 'running'
+    job['pid'] = os.getpid()
+    job['runs'] = job.get('runs', 0) + 1
+    job['run_started'] = time.time()
+    write_job(job)
+
+def start_job(job):
+    """
+    Run a job in a background thread of this process, so it outlives the Streamlit script run that started it.
+
+    Args:
+        job (dict): The job record.
+    """
+    with _lock:
+        _claim_job(job)
+    threading.Thread(target=_run_job, args=(job['id'],), daemon=True).start()
+
+def submit_pipeline_job(studies=None):
+    """
+    Submit the recommendation engine as a background job.
+
+    Args:
+        studies (list, optional): The studies to process. Defaults to every uploaded study.
+
+    Returns:
+        str: The job id.
+    """
+    if studies is None:
+        studies = list_studies()
+    task_ids = ['codebook/embeddings'] + [f'{study}/{stage}' for study in studies for stage in stages]
+    job = {'id': time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6],
+           'created': time.time(),
+           'studies': studies,
+           'tasks': {task_id: {'status': 'pending'} for task_id in task_ids}}
+    start_job(job)
+    return job['id']
+
+def resume_interrupted_jobs():
+    """
+    Restart jobs that were interrupted before finishing. Finished stages are skipped as their outputs are up to date.
+
+    Each job is re-read, checked and claimed under one lock, so sessions opening the page at the same time
+    cannot both resume it.
+
+    Returns:
+        list: The ids of the resumed jobs.
+    """
+    resumed = []
+    for job in list_jobs():
+        with _lock:
+            job = read_job(job['id'])
+            if not is_interrupted(job):
+                continue
+            for task in job['tasks'].values():
+                if task['status'] in ('running', 'pending', 'failed', 'skipped'):
+                    task['status'] = 'pending'
+            _claim_job(job)
+        threading.Thread(target=_run_job, args=(job['id'],), daemon=True).start()
+        resumed.append(job['id'])
+    return resumed
+
+def job_progress(job):
+    """
+    Summarise the progress of a job.
+
+    Rate is the number of finished tasks per minute since the current run started, and the ETA
+    assumes the remaining tasks finish at the same rate.
+
+    Args:
+        job (dict): The job record.
+
+    Returns:
+        dict: The number of finished and total tasks, the rate (tasks/minute), the ETA in seconds (None if unknown) and
+              a {study: {stage: status}} table.
+    """
+    tasks = job['tasks']
+    finished = [x for x in tasks.values() if x['status'] in ('done', 'up_to_date', 'failed', 'skipped')]
+    rate, eta = None, None
+    worked = [x for x in finished if x['status'] == 'done' and x.get('finished', 0) >= job['run_started']]
+    if worked:
+        elapsed = (time.time() if job['status'] == 'running' else job['updated']) - job['run_started']
+        if elapsed > 0:
+            rate = len(worked) / elapsed * 60
+            remaining = len(tasks) - len(finished)
+            eta = remaining / rate * 60 if job['status'] == 'running' else 0
+    table = {}
+    for task_id, task in tasks.items():
+        study, stage = task_id.split('/', 1)
+        table.setdefault(study, {})[stage] = task['status']
+    return {'finished': len(finished), 'total': len(tasks), 'rate': rate, 'eta': eta, 'table': table}
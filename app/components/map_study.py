@@ -1,13 +1,14 @@
 import streamlit as st
 import pandas as pd
 import fsspec
-import duckdb
 import time
 import numpy as np
 from dotenv import dotenv_values
 from .generate_transformations import generate_transformations
-from .transformation_utils import generic_direct_conversion, generic_catagorical_conversion
+from .transformation_utils import apply_transformation
 from .util import split_var_confidence, format_example_data, add_to_session_state, pre_process_recomendations
+from .example_store import example_data_available, read_example_column, read_example_frequencies
+from .results_store import load_study, get_variables_to_map, get_variable, get_result, upsert_result
 
 fs = fsspec.filesystem("")
 
@@ -24,9 +25,9 @@ if 'transformation_instructions' not in st.session_state:
     st.session_state.transformation_instructions = {}
 
 
-def write_to_results(study, variable_to_map, mapped_variable, notes, avail_idx, results_file, transformation_instructions=None, transformation_type=None, source_dtype=None, target_dtype=None, patient_id=None, date=None):
+def write_to_results(study, variable_to_map, mapped_variable, notes, avail_idx, transformation_instructions=None, transformation_type=None, source_dtype=None, target_dtype=None, patient_id=None, date=None):
     """
-    Writes the mapping results to a CSV file.
+    Writes the mapping results to the results store.
 
     Args:
         study (str): The study name.
@@ -34,7 +35,6 @@ def write_to_results(study, variable_to_map, mapped_variable, notes, avail_idx,
         mapped_variable (str): The mapped variable.
         notes (str): Notes about the mapping.
         avail_idx (int): Index of the mapping option.
-        results_file (str): Path to the results file.
         transformation_instructions (str, optional): Transformation instructions. Defaults to None.
         transformation_type (str, optional): Type of transformation. Defaults to None.
         source_dtype (str, optional): Source data type. Defaults to None.
@@ -68,10 +68,7 @@ def write_to_results(study, variable_to_map, mapped_variable, notes, avail_idx,
         index=[0])
     st.write('The following has been saved:')
     st.write(df_new)
-    df_old = pd.read_csv(results_file)
-    df_updated = pd.concat([df_old, df_new], ignore_index=True)
-    df_updated = df_updated.drop_duplicates(subset=['study_var'], keep='last')
-    df_updated.to_csv(results_file, index=False)
+    upsert_result(study, df_new.iloc[0].to_dict())
     add_to_session_state(study, patient_id_var, date_var)
 
 def test_transformation(example_data, transformation_type, transformation_instructions, source_dtype, target_dtype):
@@ -90,14 +87,14 @@ def test_transformation(example_data, transformation_type, transformation_instru
     else:
         if transformation_type == 'Direct':
             try:
-                transformed_data = [generic_direct_conversion(x, transformation_instructions, source_dtype, target_dtype) for x in example_data]
-                transformed_data = format_example_data(transformed_data)
+                transformed_data = apply_transformation(example_data, transformation_type, transformation_instructions, source_dtype, target_dtype)
+                transformed_data = format_example_data(list(transformed_data))
             except Exception as e:
                 transformed_data = f'Direct transformation failed with error: {e}'
         elif transformation_type == 'Categorical':
             try:
-                transformed_data = [generic_catagorical_conversion(x, transformation_instructions) for x in example_data]
-                transformed_data = format_example_data(transformed_data)
+                transformed_data = apply_transformation(example_data, transformation_type, transformation_instructions)
+                transformed_data = format_example_data(list(transformed_data))
             except Exception as e:
                 transformed_data = f'Categorical transformation failed with error: {e}'
     st.write('Preview of transformation:')
@@ -129,8 +126,6 @@ def map_study(study, variables_status, show_about, original_order, relational_mo
         st.write(':red[No studies available, please initialise the mapping app]')
     else:
         transformation_instruction = None
-        fs.mkdirs(results_path, exist_ok=True)
-        results_file = f'{results_path}/{study}.csv'
         study_input_path = f"{input_path}/{study}"
         # about data
         if show_about:
@@ -144,43 +139,11 @@ def map_study(study, variables_status, show_about, original_order, relational_mo
         if not fs.exists(f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv'):
             st.write(":red[This study has not had a recommendations file created please initialise the mapping app before proceeding.]")
         else:
-            vars_df = pd.read_csv(
-                f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv'
-                )
+            # load the recommendations into the store if they have changed
+            load_study(study)
 
-            # the below sorts the variables by difficulty to match to a codebook variable
-            vars_df['best_dist'] = [eval(x)[0] for x in vars_df['target_distances']]
-            # get variables
-            vars_unsorted = vars_df['variable_name']
-            # get variables sorted
-            vars_df = vars_df.sort_values('best_dist')
-            all_variables = vars_df['variable_name']
-
-            # get already mapped/init
-            if not fs.exists(results_file):
-                # write an empty dataframe to file
-                empty_df = pd.DataFrame(columns=['study_var',
-                                                 'codebook_var',
-                                                 'confidence',
-                                                 'notes',
-                                                 'marked',
-                                                 'patient_id',
-                                                 'date',
-                                                 'time'])
-                empty_df['study_var'] = all_variables
-                empty_df['marked'] = 'To do'
-                empty_df.to_csv(results_file, index=False)
-
-            # query results file
-            variables = duckdb.sql(f"""SELECT study_var
-                                FROM read_csv_auto('{results_file}', delim = ',', header = True)
-                                WHERE marked = '{variables_status}'""")
-            # coerce db output to list
-            variables = list(variables.fetchdf()['study_var'].values)
-
-            # sort in original order if requested
-            if original_order:
-                variables = [x for x in vars_unsorted if x in variables]
+            # query results store
+            variables = get_variables_to_map(study, variables_status, original_order)
 
             if len(variables) == 0:
                 st.write(f'No variables have been: :red[{variables_status}]')
@@ -191,38 +154,38 @@ def map_study(study, variables_status, show_about, original_order, relational_mo
                 # previous info
                 if not variables_status == 'To do':
                     st.write('The following information has previously been recorded:')
-                    st.write(duckdb.sql(f"""SELECT *
-                                        FROM read_csv_auto('{results_file}', delim = ',', header = True)
-                                        WHERE study_var = '{variable_to_map}'""").fetchdf())
+                    st.write(get_result(study, variable_to_map))
 
                 example_avail = False
                 col1, col2 = st.columns(2)
                 with col1:
                     # information about variable
                     st.write('Variable name and description:')
-                    to_map_df = vars_df[vars_df['variable_name'] == variable_to_map]
+                    to_map_df = get_variable(study, variable_to_map)
                     df_to_show = to_map_df[['variable_name', 'description']].set_index('variable_name')
                     st.dataframe(df_to_show, use_container_width=True)
                 with col2:
                     # show synthetic
                     st.write('Example data:')
-                    if fs.exists(f"{study_input_path}/example_data.csv"):
-                        synthetic_df = pd.read_csv(f"{study_input_path}/example_data.csv")
-                        if variable_to_map in list(synthetic_df.columns):
-                            example_data = synthetic_df[variable_to_map]
-                            example_data = [str(x) for x in list(example_data.dropna())]
+                    if example_data_available(study):
+                        example_data = read_example_column(study, variable_to_map)
+                        if example_data is not None:
                             st.code(format_example_data(example_data))
                             example_avail = True
+                            frequencies = read_example_frequencies(study, variable_to_map)
+                            if frequencies is not None:
+                                with st.expander('Most frequent values'):
+                                    st.dataframe(frequencies.fillna({'value': '(missing)'}), hide_index=True, use_container_width=True)
 
                 st.write('Please complete the form below:')
                 # append confidence to var name
-                recommended_keys = pre_process_recomendations(to_map_df, 'target', study)
+                recommended_keys = pre_process_recomendations(variable_to_map, 'target', study)
                 # select variable
                 mapped_variable = st.selectbox('Does this map to any of these variables?', recommended_keys) # type: ignore
                 if relational_mode:
-                    patient_id_keys = pre_process_recomendations(to_map_df, 'PID', study)
+                    patient_id_keys = pre_process_recomendations(variable_to_map, 'PID', study)
                     patient_id = st.selectbox('Patient ID:', patient_id_keys) # type: ignore
-                    date_keys = pre_process_recomendations(to_map_df, 'date', study)
+                    date_keys = pre_process_recomendations(variable_to_map, 'date', study)
                     date = st.selectbox('Date:', date_keys) # type: ignore
                 else:
                     patient_id = 'None  - 0%'
@@ -298,7 +261,7 @@ def map_study(study, variables_status, show_about, original_order, relational_mo
                 submitted = st.button(":green[Submit]", key='submit')
                 if submitted:
                     # write mappings to results
-                    _ = write_to_results(study, variable_to_map, mapped_variable, notes, avail_idx, results_file, transformation_instruction, transformation_type, source_dtype, target_dtype, patient_id, date)
+                    _ = write_to_results(study, variable_to_map, mapped_variable, notes, avail_idx, transformation_instruction, transformation_type, source_dtype, target_dtype, patient_id, date)
                     transformation_instruction = None
                     # sleep a few seconds to show results being written
                     time.sleep(0.2)
@@ -0,0 +1,170 @@
+import pandas as pd
+import fsspec
+from .harmonise import harmonisation_plan, transform_chunk, CHUNK_SIZE
+
+results_path = "results"
+input_path = "input"
+preprocess_path = "preprocess"
+
+relational_path = f"{results_path}/relational"
+
+fs = fsspec.filesystem("")
+
+N_PARTITIONS = 16 # hash partitions of the (patient ID, date) keys spilled to disk for the wide layout
+key_columns = ['patient_id', 'date']
+
+def relational_groups(plan):
+    """
+    Group mapped variables by the (patient ID, date) pair recorded for them in relational mode.
+
+    Args:
+        plan (list): The mapped variables, as returned by harmonisation_plan.
+
+    Returns:
+        dict: {(patient_id_var, date_var): [mapped variables]}. Variables without a patient ID are left out, date_var is None for variables without a date.
+    """
+    groups = {}
+    for variable in plan:
+        if variable['patient_id_var'] is not None:
+            groups.setdefault((variable['patient_id_var'], variable['date_var']), []).append(variable)
+    return groups
+
+def group_name(patient_id_var, date_var):
+    """
+    Get the directory name of a (patient ID, date) group's tables.
+
+    Args:
+        patient_id_var (str): The study's patient ID variable.
+        date_var (str): The study's date variable, or None.
+
+    Returns:
+        str: The name.
+    """
+    return f"{patient_id_var}__{date_var if date_var is not None else 'no_date'}"
+
+def group_frame(chunk, harmonised, patient_id_var, date_var, variables):
+    """
+    Select a group's keys and harmonised variables from a chunk, dropping rows without a patient ID.
+
+    Args:
+        chunk (pd.DataFrame): The source rows.
+        harmonised (pd.DataFrame): The harmonised chunk.
+        patient_id_var (str): The study's patient ID variable.
+        date_var (str): The study's date variable, or None.
+        variables (list): The group's mapped variables.
+
+    Returns:
+        pd.DataFrame: The patient_id and date columns followed by the group's codebook columns.
+    """
+    frame = harmonised[[x['target_var'] for x in variables]].copy()
+    frame.insert(0, 'patient_id', chunk[patient_id_var].astype('string'))
+    frame.insert(1, 'date', chunk[date_var].astype('string') if date_var is not None else pd.Series(pd.NA, index=chunk.index, dtype='string'))
+    return frame[frame['patient_id'].notna()]
+
+def write_long(frame, part_file):
+    """
+    Write a group's rows as a long observation table: one (patient_id, date, variable, value) row per non missing value.
+
+    Args:
+        frame (pd.DataFrame): The group's rows, as returned by group_frame.
+        part_file (str): Path to the Parquet part file.
+    """
+    values = frame.drop(columns=key_columns).astype(object)
+    long_df = pd.concat([frame[key_columns], values.astype(str).where(values.notna())], axis=1)
+    long_df = long_df.melt(id_vars=key_columns, var_name='variable', value_name='value').dropna(subset=['value'])
+    long_df.astype('string').to_parquet(part_file, index=False)
+
+def spill_partitions(frame, spill_path, chunk_index, n_partitions):
+    """
+    Hash partition a group's rows on (patient_id, date) and append each partition to disk, so rows with the same key land in the same partition.
+
+    Args:
+        frame (pd.DataFrame): The group's rows, as returned by group_frame.
+        spill_path (str): The group's spill directory.
+        chunk_index (int): The index of the source chunk, naming the spilled files.
+        n_partitions (int): The number of partitions.
+    """
+    partitions = pd.util.hash_pandas_object(frame[key_columns], index=False).values % n_partitions
+    for partition, partition_df in frame.groupby(partitions):
+        partition_path = f"{spill_path}/p{partition:03d}"
+        fs.mkdirs(partition_path, exist_ok=True)
+        partition_df.to_parquet(f"{partition_path}/chunk-{chunk_index:05d}.parquet", index=False)
+
+def merge_partition(partition_path, part_file):
+    """
+    Combine the spilled rows of one hash partition into a wide table with one row per (patient_id, date), keeping the first non missing value of each variable.
+
+    Args:
+        partition_path (str): The partition's spill directory.
+        part_file (str): Path to the Parquet part file.
+    """
+    partition_df = pd.read_parquet(partition_path)
+    wide_df = partition_df.groupby(key_columns, dropna=False, sort=True).first().reset_index()
+    wide_df.to_parquet(part_file, index=False)
+
+def materialise_study(study, source_file, layout='long', chunksize=CHUNK_SIZE, n_partitions=N_PARTITIONS, on_progress=None):
+    """
+    Materialise a study's relational tables: stream its full dataset, harmonise the mapped variables and
+    reshape them around the (patient ID, date) pairs recorded in relational mode.
+
+    Variables sharing a (patient ID, date) pair form one group, written to results/relational/<study>/<patient_id_var>__<date_var>/.
+    The 'long' layout writes an observation table of (patient_id, date, variable, value) rows chunk by chunk.
+    The 'wide' layout writes one row per (patient_id, date) with a column per codebook variable: rows are
+    hash partitioned on the key and spilled to disk while streaming, then each partition is combined on its
+    own, so memory is bounded by the chunk size and the size of one partition rather than the dataset.
+    If materialisation stops, the tables written so far are removed.
+
+    Args:
+        study (str): The study name.
+        source_file (str): Path to the study's full dataset, a CSV with the study variable names as columns.
+        layout (str, optional): 'long' or 'wide'. Defaults to 'long'.
+        chunksize (int, optional): The number of rows read at a time. Defaults to CHUNK_SIZE.
+        n_partitions (int, optional): The number of hash partitions of the wide layout. Defaults to N_PARTITIONS.
+        on_progress (callable, optional): Called with the number of rows processed so far. Defaults to None.
+
+    Returns:
+        dict: {group name: output directory} of the tables written.
+    """
+    plan = harmonisation_plan(study)
+    groups = relational_groups(plan)
+    if len(groups) == 0:
+        raise ValueError(f"{study} has no successfully mapped variables with a patient ID, map studies in relational mode to record them")
+    plan = [variable for variables in groups.values() for variable in variables]
+    key_vars = [x for key in groups for x in key if x is not None]
+    columns = pd.read_csv(source_file, nrows=0).columns
+    missing = [x for x in dict.fromkeys([x['source_var'] for x in plan] + key_vars) if x not in columns]
+    if missing:
+        raise ValueError(f"The source dataset is missing the mapped variables: {', '.join(missing)}")
+    output_path = f"{relational_path}/{study}"
+    if fs.exists(output_path):
+        fs.rm(output_path, recursive=True)
+    outputs = {group_name(*key): f"{output_path}/{group_name(*key)}" for key in groups}
+    for path in outputs.values():
+        fs.mkdirs(path, exist_ok=True)
+    usecols = list(dict.fromkeys([x['source_var'] for x in plan] + key_vars))
+    try:
+        rows = 0
+        for i, chunk in enumerate(pd.read_csv(source_file, dtype=str, usecols=usecols, chunksize=chunksize)):
+            harmonised, _ = transform_chunk(chunk, plan)
+            for (patient_id_var, date_var), variables in groups.items():
+                frame = group_frame(chunk, harmonised, patient_id_var, date_var, variables)
+                name = group_name(patient_id_var, date_var)
+                if layout == 'long':
+                    write_long(frame, f"{outputs[name]}/part-{i:05d}.parquet")
+                else:
+                    spill_partitions(frame, f"{output_path}/.spill/{name}", i, n_partitions)
+            rows += len(chunk)
+            if on_progress:
+                on_progress(rows)
+        if layout == 'wide':
+            for name, path in outputs.items():
+                spill_path = f"{output_path}/.spill/{name}"
+                if fs.exists(spill_path):
+                    for partition_path in sorted(fs.ls(spill_path)):
+                        merge_partition(partition_path, f"{path}/part-{partition_path.split('/')[-1][1:]}.parquet")
+            if fs.exists(f"{output_path}/.spill"):
+                fs.rm(f"{output_path}/.spill", recursive=True)
+    except BaseException:
+        fs.rm(output_path, recursive=True) # no partial output
+        raise
+    return outputs
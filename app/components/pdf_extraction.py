@@ -0,0 +1,203 @@
+import os
+import hashlib
+import sqlite3
+import concurrent.futures as cf
+from contextlib import contextmanager
+from io import StringIO
+import fsspec
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import resolve1, PDFStream
+
+results_path = "results"
+input_path = "input"
+preprocess_path = "preprocess"
+cache_path = "cache"
+
+page_cache_file = f"{cache_path}/pdf_pages.sqlite"
+
+fs = fsspec.filesystem("")
+
+PAGES_PER_TASK = 8 # pages extracted per process pool task, smaller extractions run in process
+SQL_VARIABLE_LIMIT = 900
+
+def context_documents(study):
+    """
+    List a study's context documents: the PDFs in input/<study>/context_docs/, after a legacy input/<study>/context.pdf.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        list: Paths to the PDF files, in the order their text is joined.
+    """
+    documents = []
+    if fs.exists(f"{input_path}/{study}/context.pdf"):
+        documents.append(f"{input_path}/{study}/context.pdf")
+    if fs.exists(f"{input_path}/{study}/context_docs"):
+        documents += sorted(f"{input_path}/{study}/context_docs/{x.split('/')[-1]}" for x in fs.ls(f"{input_path}/{study}/context_docs")
+                            if x.lower().endswith('.pdf'))
+    return documents
+
+def _digest_object(sha, obj, seen):
+    """
+    Feed the parts of a PDF object that affect a page's extracted text into a hash.
+
+    Args:
+        sha (hashlib._Hash): The hash.
+        obj (any): The object, references are resolved.
+        seen (set): The ids of the streams and dictionaries already hashed, as resources can refer to each other.
+    """
+    obj = resolve1(obj)
+    if isinstance(obj, (dict, PDFStream)):
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+    if isinstance(obj, PDFStream):
+        if getattr(resolve1(obj.get('Subtype')), 'name', None) == 'Image':
+            return # images carry no text
+        _digest_object(sha, obj.attrs, seen)
+        sha.update(obj.get_data())
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            sha.update(str(key).encode('utf-8'))
+            _digest_object(sha, obj[key], seen)
+    elif isinstance(obj, list):
+        for value in obj:
+            _digest_object(sha, value, seen)
+    else:
+        sha.update(repr(obj).encode('utf-8'))
+
+def page_key(page):
+    """
+    Get the content address of a page's extracted text.
+
+    Args:
+        page (PDFPage): The page.
+
+    Returns:
+        str: The sha256 hex digest of the page's content streams, resources (fonts and forms, not images), media box and rotation.
+    """
+    sha = hashlib.sha256()
+    sha.update(repr((page.mediabox, page.rotate)).encode('utf-8'))
+    for stream in page.contents:
+        _digest_object(sha, stream, set())
+    _digest_object(sha, page.resources, set())
+    return sha.hexdigest()
+
+def document_page_keys(pdf_file):
+    """
+    Get the content address of every page of a PDF, without extracting any text.
+
+    Args:
+        pdf_file (str): Path to the PDF file.
+
+    Returns:
+        list: The page keys, in page order.
+    """
+    with open(pdf_file, 'rb') as f:
+        return [page_key(page) for page in PDFPage.get_pages(f)]
+
+def extract_page_texts(pdf_file, page_numbers):
+    """
+    Extract the text of some pages of a PDF, a page at a time.
+
+    The text of each page is what pdfminer's extract_text produces for it, including the form feed
+    ending the page, so joining the pages of a document gives the same text as extract_text.
+
+    Args:
+        pdf_file (str): Path to the PDF file.
+        page_numbers (list): The zero based page numbers.
+
+    Returns:
+        dict: The text of each page, keyed by page number.
+    """
+    texts, page_numbers = {}, set(page_numbers)
+    resource_manager = PDFResourceManager(caching=True)
+    with open(pdf_file, 'rb') as f:
+        for page_number, page in enumerate(PDFPage.get_pages(f)):
+            if page_number not in page_numbers:
+                continue
+            output = StringIO()
+            device = TextConverter(resource_manager, output, laparams=LAParams())
+            PDFPageInterpreter(resource_manager, device).process_page(page)
+            device.close()
+            texts[page_number] = output.getvalue()
+            if len(texts) == len(page_numbers):
+                break
+    return texts
+
+@contextmanager
+def _connect_cache():
+    fs.mkdirs(cache_path, exist_ok=True)
+    conn = sqlite3.connect(page_cache_file, timeout=30)
+    try:
+        with conn: # commits, or rolls back on error
+            conn.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, text TEXT)")
+            yield conn
+    finally:
+        conn.close()
+
+def get_cached_pages(keys):
+    """
+    Look up the extracted text of pages by content address.
+
+    Args:
+        keys (list): The page keys.
+
+    Returns:
+        dict: The cached texts, keyed by page key.
+    """
+    found = {}
+    unique_keys = list(dict.fromkeys(keys))
+    with _connect_cache() as conn:
+        for i in range(0, len(unique_keys), SQL_VARIABLE_LIMIT):
+            chunk = unique_keys[i:i + SQL_VARIABLE_LIMIT]
+            found.update(conn.execute(f"SELECT key, text FROM pages WHERE key IN ({','.join('?' * len(chunk))})", chunk))
+    return found
+
+def put_cached_pages(texts):
+    """
+    Store the extracted text of pages.
+
+    Args:
+        texts (dict): The texts, keyed by page key.
+    """
+    if texts:
+        with _connect_cache() as conn:
+            conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?)", list(texts.items()))
+
+def extract_document_text(pdf_file, n_workers=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Extract the text of a PDF, only extracting pages whose content is not already in the page cache.
+
+    Pages missing from the cache are split into ranges of consecutive pages that are extracted by a
+    pool of n_workers processes, so a re-uploaded document only has its changed pages extracted.
+
+    Args:
+        pdf_file (str): Path to the PDF file.
+        n_workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        pages_per_task (int, optional): The number of pages per task. Defaults to PAGES_PER_TASK.
+
+    Returns:
+        str: The text, as produced by pdfminer's extract_text.
+    """
+    keys = document_page_keys(pdf_file)
+    cached = get_cached_pages(keys)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    n_workers = min(n_workers or os.cpu_count(), -(-len(missing) // pages_per_task))
+    ranges = [missing[i:i + pages_per_task] for i in range(0, len(missing), pages_per_task)]
+    extracted = {}
+    if n_workers > 1:
+        with cf.ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for texts in pool.map(extract_page_texts, [pdf_file] * len(ranges), ranges):
+                extracted.update(texts)
+    elif missing:
+        extracted = extract_page_texts(pdf_file, missing)
+    new_pages = {keys[i]: text for i, text in extracted.items()}
+    put_cached_pages(new_pages)
+    cached.update(new_pages)
+    print(f"{pdf_file}: {len(keys)} pages, {len(missing)} extracted, {len(keys) - len(missing)} from cache")
+    return ''.join(cached[key] for key in keys)
@@ -0,0 +1,157 @@
+import os
+import concurrent.futures as cf
+from functools import partial
+import fsspec
+from dotenv import dotenv_values
+from .util import init_llm_models, is_up_to_date
+from .pdf_extraction import context_documents
+from .generate_descriptions import convert_study_pdf_to_txt, generate_study_descriptions, description_inputs
+from .get_recommendations import (embed_codebook, embed_study, generate_recommendations, generate_PID_date_recommendations,
+                                  codebook_embedding_inputs, study_embedding_inputs, recommendation_inputs, PID_date_inputs)
+
+results_path = "results"
+input_path = "input"
+preprocess_path = "preprocess"
+
+fs = fsspec.filesystem("")
+
+# per study stages, in dependency order
+stages = ['pdf', 'descriptions', 'embeddings', 'recommendations', 'PID_date']
+
+def list_studies():
+    """
+    List the studies that have had a variables table uploaded.
+
+    Returns:
+        list: The study names.
+    """
+    avail_studies = [x for x in fs.ls(f'{input_path}/') if fs.isdir(x)] # get directories
+    avail_studies = [f.split('/')[-1] for f in avail_studies if f.split('/')[-1][0] != '.'] # strip path and remove hidden folders
+    return [x for x in avail_studies if fs.exists(f"{input_path}/{x}/dataset_variables.csv")]
+
+def build_stage_graph(studies, openai_client, config):
+    """
+    Build the graph of pipeline tasks: the codebook embedding plus one task per stage and study.
+
+    Each task records the pool it runs on ('cpu' tasks go to a process pool, 'network' tasks to a
+    thread pool), the tasks it depends on, the callable to run and a check of whether its output is
+    already up to date.
+
+    Args:
+        studies (list): The study names.
+        openai_client (object): The OpenAI client.
+        config (dict): The app configuration (.env values).
+
+    Returns:
+        dict: The tasks, keyed by '<study>/<stage>' (the codebook task is 'codebook/embeddings').
+    """
+    n_lists = int(config['ann_n_lists']) if config.get('ann_n_lists') else None
+    n_probe = int(config['ann_n_probe']) if config.get('ann_n_probe') else None
+    block_size = int(config['score_block_size']) if config.get('score_block_size') else None
+    n_workers = int(config.get('score_workers') or 1)
+    pdf_workers = int(config.get('pdf_workers') or 0) or None
+    tasks = {'codebook/embeddings': {
+        'study': None, 'stage': 'embeddings', 'kind': 'network', 'deps': [],
+        'run': partial(embed_codebook, openai_client),
+        'up_to_date': partial(is_up_to_date, f'{input_path}/target_variables_with_embeddings.csv', codebook_embedding_inputs())}}
+    for study in studies:
+        study_path = f"{input_path}/{study}"
+        documents = context_documents(study)
+        tasks[f'{study}/pdf'] = {
+            'study': study, 'stage': 'pdf', 'kind': 'cpu', 'deps': [],
+            'run': partial(convert_study_pdf_to_txt, study, pdf_workers),
+            'up_to_date': partial(is_up_to_date, f"{study_path}/context.txt", documents) if documents else lambda: True}
+        tasks[f'{study}/descriptions'] = {
+            'study': study, 'stage': 'descriptions', 'kind': 'network', 'deps': [f'{study}/pdf'],
+            'run': partial(generate_study_descriptions, openai_client, study, config),
+            'up_to_date': partial(is_up_to_date, f'{study_path}/dataset_variables_auto_completed.csv', description_inputs(study))}
+        tasks[f'{study}/embeddings'] = {
+            'study': study, 'stage': 'embeddings', 'kind': 'network', 'deps': [f'{study}/descriptions'],
+            'run': partial(embed_study, openai_client, study),
+            'up_to_date': partial(is_up_to_date, f'{study_path}/dataset_variables_with_embeddings.csv', study_embedding_inputs(study))}
+        tasks[f'{study}/recommendations'] = {
+            'study': study, 'stage': 'recommendations', 'kind': 'cpu', 'deps': [f'{study}/embeddings', 'codebook/embeddings'],
+            'run': partial(generate_recommendations, study, n_lists=n_lists, n_probe=n_probe, block_size=block_size, n_workers=n_workers),
+            'up_to_date': partial(is_up_to_date, f'{study_path}/dataset_variables_with_recommendations.csv', recommendation_inputs(study))}
+        tasks[f'{study}/PID_date'] = {
+            'study': study, 'stage': 'PID_date', 'kind': 'network', 'deps': [f'{study}/recommendations'],
+            'run': partial(generate_PID_date_recommendations, openai_client, study),
+            'up_to_date': partial(is_up_to_date, f'{study_path}/dataset_variables_with_PID_date_recommendations.csv', PID_date_inputs(study))}
+    return tasks
+
+def run_stage_graph(tasks, cpu_workers=None, network_workers=4, on_update=None):
+    """
+    Run a graph of tasks, starting each one as soon as its dependencies have finished.
+
+    Up to date tasks are marked done without running. If a task fails, the tasks depending on it
+    are skipped while independent studies carry on.
+
+    Args:
+        tasks (dict): The tasks, as returned by build_stage_graph.
+        cpu_workers (int, optional): The size of the process pool. Defaults to the number of CPUs.
+        network_workers (int, optional): The size of the thread pool. Defaults to 4.
+        on_update (callable, optional): Called as on_update(task_id, status) whenever a task changes status. Defaults to None.
+
+    Returns:
+        dict: The final status of every task, one of 'done', 'up_to_date', 'failed' or 'skipped'.
+    """
+    status = {task_id: 'pending' for task_id in tasks}
+
+    def set_status(task_id, value):
+        status[task_id] = value
+        if on_update:
+            on_update(task_id, value)
+
+    cpu_workers = cpu_workers or os.cpu_count()
+    with cf.ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool, cf.ThreadPoolExecutor(max_workers=network_workers) as network_pool:
+        running = {}
+        while True:
+            scheduled = True
+            while scheduled: # finishing an up to date task can make its dependents ready
+                scheduled = False
+                for task_id, task in tasks.items():
+                    if status[task_id] != 'pending':
+                        continue
+                    if any(status[dep] in ('failed', 'skipped') for dep in task['deps']):
+                        set_status(task_id, 'skipped')
+                        scheduled = True
+                    elif all(status[dep] in ('done', 'up_to_date') for dep in task['deps']):
+                        if task['up_to_date']():
+                            set_status(task_id, 'up_to_date')
+                        else:
+                            pool = cpu_pool if task['kind'] == 'cpu' else network_pool
+                            running[pool.submit(task['run'])] = task_id
+                            set_status(task_id, 'running')
+                        scheduled = True
+            if not running:
+                break
+            finished, _ = cf.wait(running, return_when=cf.FIRST_COMPLETED)
+            for future in finished:
+                task_id = running.pop(future)
+                if future.exception() is not None:
+                    print(f"{task_id} failed: {future.exception()}")
+                    set_status(task_id, 'failed')
+                else:
+                    set_status(task_id, 'done')
+    return status
+
+def run_pipeline(studies=None, cpu_workers=None, network_workers=4, on_update=None):
+    """
+    Run the recommendation engine (PDF conversion, descriptions, embeddings, recommendations and
+    PID/date recommendations) for several studies at once, pipelining the stages of different studies.
+
+    Args:
+        studies (list, optional): The studies to process. Defaults to every uploaded study.
+        cpu_workers (int, optional): The size of the process pool for CPU bound stages. Defaults to the number of CPUs.
+        network_workers (int, optional): The size of the thread pool for network bound stages. Defaults to 4.
+        on_update (callable, optional): Called as on_update(task_id, status) whenever a task changes status. Defaults to None.
+
+    Returns:
+        dict: The final status of every task.
+    """
+    config = dotenv_values(".env")
+    openai_client = init_llm_models(config)
+    if studies is None:
+        studies = list_studies()
+    tasks = build_stage_graph(studies, openai_client, config)
+    return run_stage_graph(tasks, cpu_workers, network_workers, on_update)
@@ -0,0 +1,312 @@
+import threading
+import duckdb
+import pandas as pd
+import fsspec
+from .util import file_fingerprint, parse_list
+
+results_path = "results"
+input_path = "input"
+preprocess_path = "preprocess"
+
+store_file = f"{results_path}/results.duckdb"
+
+fs = fsspec.filesystem("")
+
+# the mapping decision recorded for each study variable, in export order
+result_columns = ['study_var',
+                  'codebook_var',
+                  'confidence',
+                  'notes',
+                  'marked',
+                  'transformation_instructions',
+                  'transformation_type',
+                  'source_dtype',
+                  'target_dtype',
+                  'patient_id_var',
+                  'patient_id_confidence',
+                  'date_var',
+                  'date_confidence']
+
+# prepared queries of the mapping page
+variables_query = """SELECT v.variable_name
+                     FROM variables v
+                     JOIN results r ON r.study = v.study AND r.study_var = v.variable_name
+                     WHERE v.study = ? AND r.marked = ?
+                     ORDER BY {order}, v.position"""
+variable_query = """SELECT variable_name, description
+                    FROM variables
+                    WHERE study = ? AND variable_name = ?"""
+result_query = """SELECT * EXCLUDE (study)
+                  FROM results
+                  WHERE study = ? AND study_var = ?"""
+
+_connection = None
+_lock = threading.Lock()
+_write_lock = threading.Lock() # serialises writes, so concurrent sessions never conflict on the same row
+
+def get_connection():
+    """
+    Get the workspace's results database connection, creating the database and its tables on first use.
+
+    The connection is shared by every session of the app; each caller should work on its own cursor.
+
+    Returns:
+        duckdb.DuckDBPyConnection: The connection.
+    """
+    global _connection
+    with _lock:
+        if _connection is None:
+            fs.mkdirs(results_path, exist_ok=True)
+            _connection = duckdb.connect(store_file)
+            columns = ', '.join(f'{x} VARCHAR' for x in result_columns[1:])
+            _connection.execute(f"""CREATE TABLE IF NOT EXISTS results (
+                                        study VARCHAR,
+                                        study_var VARCHAR,
+                                        {columns},
+                                        updated TIMESTAMP DEFAULT current_timestamp,
+                                        PRIMARY KEY (study, study_var))""")
+            _connection.execute(f"""CREATE TABLE IF NOT EXISTS results_history (
+                                        study VARCHAR,
+                                        study_var VARCHAR,
+                                        {columns},
+                                        updated TIMESTAMP DEFAULT current_timestamp)""")
+            _connection.execute("""CREATE TABLE IF NOT EXISTS variables (
+                                        study VARCHAR,
+                                        variable_name VARCHAR,
+                                        description VARCHAR,
+                                        position INTEGER,
+                                        best_dist DOUBLE,
+                                        PRIMARY KEY (study, variable_name))""")
+            _connection.execute("""CREATE TABLE IF NOT EXISTS loaded_files (
+                                        study VARCHAR PRIMARY KEY,
+                                        fingerprint VARCHAR)""")
+            variable_columns = _connection.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'variables'").fetchall()
+            if ('best_dist',) not in variable_columns:
+                # recommendations are read from the recommendations file (util.variable_recommendations), only best_dist is kept here
+                _connection.execute("DROP TABLE IF EXISTS recommendations")
+                _connection.execute("ALTER TABLE variables ADD COLUMN best_dist DOUBLE")
+                _connection.execute("DELETE FROM loaded_files") # reload every study to fill best_dist
+            _connection.execute("CREATE INDEX IF NOT EXISTS results_marked ON results (study, marked)")
+        return _connection
+
+def close_store():
+    """
+    Close the results database, eg. before the workspace is cleared.
+    """
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+def init_study_results(study, variables):
+    """
+    Add a 'To do' result for every variable of a study that has no result yet.
+
+    Results in a legacy results/<study>.csv file are imported the first time a study is initialised.
+
+    Args:
+        study (str): The study name.
+        variables (list): The study's variable names.
+    """
+    cursor = get_connection().cursor()
+    try:
+        with _write_lock:
+            if cursor.execute("SELECT count(*) FROM results WHERE study = ?", [study]).fetchone()[0] == 0:
+                legacy_file = f'{results_path}/{study}.csv'
+                if fs.exists(legacy_file):
+                    legacy_df = pd.read_csv(legacy_file, dtype=str)
+                    legacy_df = legacy_df.drop_duplicates(subset=['study_var'], keep='last')
+                    legacy_df = legacy_df.reindex(columns=result_columns)
+                    legacy_df.insert(0, 'study', study)
+                    cursor.execute(f"INSERT INTO results ({', '.join(['study'] + result_columns)}) SELECT * FROM legacy_df")
+            todo_df = pd.DataFrame({'study': study, 'study_var': pd.Series(variables, dtype=str), 'marked': 'To do'})
+            cursor.execute("INSERT INTO results (study, study_var, marked) SELECT * FROM todo_df ON CONFLICT DO NOTHING")
+    finally:
+        cursor.close()
+
+def load_study(study):
+    """
+    Load a study's variables into the store, if its recommendations file has changed since it was last loaded.
+
+    Only the distance to each variable's best recommendation is stored, to sort the variables by difficulty to match;
+    the recommendations themselves are read from the file by util.variable_recommendations.
+
+    Args:
+        study (str): The study name.
+    """
+    recommendations_file = f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv'
+    fingerprint = file_fingerprint(recommendations_file)
+    cursor = get_connection().cursor()
+    try:
+        loaded = cursor.execute("SELECT fingerprint FROM loaded_files WHERE study = ?", [study]).fetchone()
+        if loaded is not None and loaded[0] == fingerprint:
+            return
+        vars_df = pd.read_csv(recommendations_file)
+        vars_df['best_dist'] = [parse_list(x)[0] for x in vars_df['target_distances']] # sorts the variables by difficulty to match to a codebook variable
+        vars_df['position'] = range(len(vars_df))
+        vars_df.insert(0, 'study', study)
+        variables_df = vars_df[['study', 'variable_name', 'description', 'position', 'best_dist']]
+        init_study_results(study, list(vars_df['variable_name']))
+        with _write_lock:
+            cursor.execute("BEGIN TRANSACTION")
+            try:
+                cursor.execute("DELETE FROM variables WHERE study = ?", [study])
+                cursor.execute("INSERT INTO variables SELECT * FROM variables_df")
+                cursor.execute("INSERT OR REPLACE INTO loaded_files VALUES (?, ?)", [study, fingerprint])
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+    finally:
+        cursor.close()
+
+def get_variables_to_map(study, marked, original_order=False):
+    """
+    Get the variables of a study with a given mapping status.
+
+    Args:
+        study (str): The study name.
+        marked (str): The mapping status, eg. 'To do'.
+        original_order (bool, optional): Keep the order of the study's variables table, rather than sorting by difficulty to match. Defaults to False.
+
+    Returns:
+        list: The variable names.
+    """
+    order = 'v.position' if original_order else 'v.best_dist'
+    cursor = get_connection().cursor()
+    try:
+        return [x[0] for x in cursor.execute(variables_query.format(order=order), [study, marked]).fetchall()]
+    finally:
+        cursor.close()
+
+def get_variable(study, variable):
+    """
+    Get a study variable's description.
+
+    Args:
+        study (str): The study name.
+        variable (str): The variable name.
+
+    Returns:
+        pd.DataFrame: A single row with the variable name and description.
+    """
+    cursor = get_connection().cursor()
+    try:
+        return cursor.execute(variable_query, [study, variable]).fetchdf()
+    finally:
+        cursor.close()
+
+def get_result(study, variable):
+    """
+    Get the mapping result recorded for a study variable.
+
+    Args:
+        study (str): The study name.
+        variable (str): The variable name.
+
+    Returns:
+        pd.DataFrame: A single row with the result.
+    """
+    cursor = get_connection().cursor()
+    try:
+        return cursor.execute(result_query, [study, variable]).fetchdf()
+    finally:
+        cursor.close()
+
+def upsert_result(study, result):
+    """
+    Record the mapping decision for a study variable, replacing any previous decision.
+
+    Every decision is also appended to the results_history table. The upsert and history insert
+    are done in one transaction, with writes serialised across sessions, so concurrent submissions
+    cannot lose each other's work.
+
+    Args:
+        study (str): The study name.
+        result (dict): The decision, keyed by the names in result_columns.
+    """
+    values = [study] + [None if result.get(x) is None else str(result.get(x)) for x in result_columns]
+    columns = ', '.join(['study'] + result_columns)
+    placeholders = ', '.join(['?'] * len(values))
+    updates = ', '.join(f'{x} = excluded.{x}' for x in result_columns[1:])
+    cursor = get_connection().cursor()
+    try:
+        with _write_lock:
+            cursor.execute("BEGIN TRANSACTION")
+            try:
+                cursor.execute(f"INSERT INTO results ({columns}) VALUES ({placeholders}) ON CONFLICT DO UPDATE SET {updates}, updated = now()", values)
+                cursor.execute(f"INSERT INTO results_history ({columns}) VALUES ({placeholders})", values)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+    finally:
+        cursor.close()
+
+def list_result_studies():
+    """
+    List the studies that have results.
+
+    Returns:
+        list: The study names.
+    """
+    cursor = get_connection().cursor()
+    try:
+        return [x[0] for x in cursor.execute("SELECT DISTINCT study FROM results ORDER BY study").fetchall()]
+    finally:
+        cursor.close()
+
+def get_results(study):
+    """
+    Get the current mapping results of a study, most recently updated last.
+
+    Args:
+        study (str): The study name.
+
+    Returns:
+        pd.DataFrame: The results, with the columns in result_columns.
+    """
+    cursor = get_connection().cursor()
+    try:
+        return cursor.execute(f"SELECT {', '.join(result_columns)} FROM results WHERE study = ? ORDER BY updated, rowid", [study]).fetchdf()
+    finally:
+        cursor.close()
+
+def get_history(study, study_var=None):
+    """
+    Get the history of mapping decisions of a study, oldest first.
+
+    Args:
+        study (str): The study name.
+        study_var (str, optional): Only return the history of this variable. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The decisions and the time each was made.
+    """
+    query = f"SELECT {', '.join(result_columns)}, updated FROM results_history WHERE study = ?"
+    params = [study]
+    if study_var is not None:
+        query += " AND study_var = ?"
+        params.append(study_var)
+    cursor = get_connection().cursor()
+    try:
+        return cursor.execute(query + " ORDER BY updated, rowid", params).fetchdf()
+    finally:
+        cursor.close()
+
+def export_results(study, output_file=None):
+    """
+    Export the current mapping results of a study to CSV.
+
+    Args:
+        study (str): The study name.
+        output_file (str, optional): Path to the CSV file. Defaults to results/<study>.csv.
+
+    Returns:
+        str: Path to the CSV file.
+    """
+    if output_file is None:
+        output_file = f'{results_path}/{study}.csv'
+    get_results(study).to_csv(output_file, index=False)
+    return output_file
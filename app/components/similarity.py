@@ -0,0 +1,135 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+def normalise_rows(matrix):
+    """
+    Scale each row of a matrix to unit length so dot products give cosine similarity.
+
+    Args:
+        matrix (ndarray): An (n, dim) matrix of embeddings.
+
+    Returns:
+        ndarray: The row normalised float32 matrix. Rows with zero length are left as zeros.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def cosine_distance_matrix(queries, targets, normalised=False):
+    """
+    Calculate the cosine distance between every query and every target in a single matrix product.
+
+    Args:
+        queries (ndarray): An (n, dim) matrix of query embeddings.
+        targets (ndarray): An (m, dim) matrix of target embeddings.
+        normalised (bool, optional): Set if both matrices are already row normalised. Defaults to False.
+
+    Returns:
+        ndarray: An (n, m) matrix of cosine distances.
+    """
+    if not normalised:
+        queries = normalise_rows(queries)
+        targets = normalise_rows(targets)
+    return 1 - queries @ targets.T
+
+def top_k_smallest(matrix, k):
+    """
+    Get the k smallest values of each row, sorted, without sorting the full rows.
+
+    Args:
+        matrix (ndarray): An (n, m) matrix, eg. of distances.
+        k (int): The number of values to keep per row.
+
+    Returns:
+        tuple: (n, k) matrices of the column indices and values, in ascending order of value.
+    """
+    k = min(k, matrix.shape[1])
+    if k < matrix.shape[1]:
+        idx = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(matrix.shape[1]), matrix.shape)
+    values = np.take_along_axis(matrix, idx, axis=1)
+    order = np.argsort(values, axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+def merge_top_k(idx, values, new_idx, new_values, k):
+    """
+    Merge two sets of per row top k candidates into one.
+
+    Args:
+        idx (ndarray): (n, a) column indices of the running top k.
+        values (ndarray): (n, a) values of the running top k.
+        new_idx (ndarray): (n, b) column indices of the new candidates.
+        new_values (ndarray): (n, b) values of the new candidates.
+        k (int): The number of values to keep per row.
+
+    Returns:
+        tuple: (n, k) matrices of the column indices and values, in ascending order of value.
+    """
+    idx = np.hstack([idx, new_idx])
+    values = np.hstack([values, new_values])
+    order, values = top_k_smallest(values, k)
+    return np.take_along_axis(idx, order, axis=1), values
+
+def blended_top_k_block(query_paths, target_paths, start, end, k, target_block_size=8192, desc_weight=0.8):
+    """
+    Find the k closest targets of a block of query rows, streaming over the memory mapped targets a block at a time.
+
+    Args:
+        query_paths (tuple): Paths of the query (description, name) embedding .npy files.
+        target_paths (tuple): Paths of the target (description, name) embedding .npy files.
+        start (int): The first query row of the block.
+        end (int): The end (exclusive) of the block.
+        k (int): The number of targets to keep per query.
+        target_block_size (int, optional): The number of target rows scored at once. Defaults to 8192.
+        desc_weight (float, optional): The weight of the description distance. Defaults to 0.8.
+
+    Returns:
+        tuple: (end - start, k) matrices of the target indices and blended cosine distances.
+    """
+    query_desc = normalise_rows(np.load(query_paths[0], mmap_mode='r')[start:end])
+    query_var = normalise_rows(np.load(query_paths[1], mmap_mode='r')[start:end])
+    target_desc = np.load(target_paths[0], mmap_mode='r')
+    target_var = np.load(target_paths[1], mmap_mode='r')
+    idx = np.empty((end - start, 0), dtype=np.int64)
+    values = np.empty((end - start, 0), dtype=np.float32)
+    for target_start in range(0, len(target_desc), target_block_size):
+        target_end = target_start + target_block_size
+        distance = (desc_weight * cosine_distance_matrix(query_desc, normalise_rows(target_desc[target_start:target_end]), normalised=True)
+                    + (1 - desc_weight) * cosine_distance_matrix(query_var, normalise_rows(target_var[target_start:target_end]), normalised=True))
+        block_idx, block_values = top_k_smallest(distance, k)
+        idx, values = merge_top_k(idx, values, block_idx + target_start, block_values, k)
+    return idx, values
+
+def blocked_top_k(query_paths, target_paths, k, block_size=1024, target_block_size=8192, n_workers=1, desc_weight=0.8):
+    """
+    Find the k closest targets of every query without materialising the full query x target distance matrix.
+
+    Query rows are scored in blocks of block_size against blocks of target_block_size targets, keeping
+    a running top k per row, so peak memory is bounded by the block sizes. With n_workers > 1 the query
+    blocks are sharded across a process pool, each worker memory maps the same embedding files.
+
+    Args:
+        query_paths (tuple): Paths of the query (description, name) embedding .npy files.
+        target_paths (tuple): Paths of the target (description, name) embedding .npy files.
+        k (int): The number of targets to keep per query.
+        block_size (int, optional): The number of query rows scored at once. Defaults to 1024.
+        target_block_size (int, optional): The number of target rows scored at once. Defaults to 8192.
+        n_workers (int, optional): The number of worker processes. Defaults to 1.
+        desc_weight (float, optional): The weight of the description distance. Defaults to 0.8.
+
+    Returns:
+        tuple: (n, k) matrices of the target indices and blended cosine distances, in ascending order of distance.
+    """
+    n_rows = len(np.load(query_paths[0], mmap_mode='r'))
+    blocks = [(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+    args = [(query_paths, target_paths, start, end, k, target_block_size, desc_weight) for start, end in blocks]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(blended_top_k_block, *zip(*args)))
+    else:
+        results = [blended_top_k_block(*x) for x in args]
+    if not results:
+        return np.empty((0, 0), dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    return np.vstack([idx for idx, _ in results]), np.vstack([values for _, values in results])
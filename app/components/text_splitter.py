@@ -0,0 +1,205 @@
+import re
+from collections import deque
+from functools import lru_cache
+from io import StringIO
+from .embedding_utils import get_encoding
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+READ_SIZE = 1 << 16 # characters read from the stream at a time
+MAX_BUFFER = 1 << 20 # characters buffered while looking for the end of a paragraph
+
+@lru_cache(maxsize=32)
+def compile_separators(separators=DEFAULT_SEPARATORS, is_separator_regex=False):
+    """
+    Compile the separators of the text splitter once.
+
+    Args:
+        separators (tuple): The separators, from the coarsest to the finest, "" splits into characters.
+        is_separator_regex (bool, optional): Whether the separators are regex patterns. Defaults to False.
+
+    Returns:
+        tuple: (separator, compiled pattern, joiner) triples, the pattern is None for "" and the joiner is the
+               string chunks are joined with (the separator itself, or a single space for a regex).
+    """
+    compiled = []
+    for separator in separators:
+        if separator == "":
+            compiled.append((separator, None, ""))
+        elif is_separator_regex:
+            compiled.append((separator, re.compile(separator), " "))
+        else:
+            compiled.append((separator, re.compile(re.escape(separator)), separator))
+    return tuple(compiled)
+
+@lru_cache(maxsize=8)
+def token_length(model="text-embedding-ada-002"):
+    """
+    Get a function counting the tokens of a text with the tiktoken encoding of an embedding model.
+
+    Args:
+        model (str, optional): The embedding model. Defaults to "text-embedding-ada-002".
+
+    Returns:
+        callable: Takes a text and returns its token count, estimated as one token per 3 characters if no encoding is available.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return lambda text: -(-len(text) // 3)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+def merge_splits(splits, joiner, chunk_size, chunk_overlap, length_function):
+    """
+    Merge small splits into chunks of at most chunk_size, each starting with up to chunk_overlap of the end of the previous chunk.
+
+    Only the splits of the current chunk are held in memory.
+
+    Args:
+        splits (iterable): (text, length) pairs, each shorter than chunk_size.
+        joiner (str): The string the splits are joined with.
+        chunk_size (int): The maximum length of a chunk.
+        chunk_overlap (int): The maximum length shared by consecutive chunks.
+        length_function (callable): Measures a text.
+
+    Yields:
+        str: The chunks.
+    """
+    joiner_length = length_function(joiner) if joiner else 0
+    current, total = deque(), 0
+    for text, length in splits:
+        if current and total + joiner_length + length > chunk_size:
+            yield joiner.join(x for x, _ in current)
+            # keep the end of the chunk as the overlap, as long as the next split still fits
+            while current and (total > chunk_overlap or total + joiner_length + length > chunk_size):
+                total -= current.popleft()[1] + (joiner_length if current else 0)
+        total += length + (joiner_length if current else 0)
+        current.append((text, length))
+    if current:
+        yield joiner.join(x for x, _ in current)
+
+def _split_text(text, level, separators, chunk_size, chunk_overlap, length_function):
+    """
+    Recursively split a text with the first of separators[level:] it contains.
+
+    Args:
+        text (str): The text.
+        level (int): The index of the first separator to try.
+        separators (tuple): The compiled separators.
+        chunk_size (int): The maximum length of a chunk.
+        chunk_overlap (int): The maximum length shared by consecutive chunks.
+        length_function (callable): Measures a text.
+
+    Yields:
+        str: The chunks.
+    """
+    for level in range(level, len(separators)):
+        separator, pattern, joiner = separators[level]
+        if pattern is None or pattern.search(text):
+            break
+    splits = pattern.split(text) if pattern is not None else list(text)
+    good = []
+    for split in splits:
+        if split == "":
+            continue
+        length = length_function(split)
+        if length < chunk_size:
+            good.append((split, length))
+            continue
+        if good:
+            yield from merge_splits(good, joiner, chunk_size, chunk_overlap, length_function)
+            good = []
+        if level + 1 < len(separators):
+            yield from _split_text(split, level + 1, separators, chunk_size, chunk_overlap, length_function)
+        else:
+            yield split
+    if good:
+        yield from merge_splits(good, joiner, chunk_size, chunk_overlap, length_function)
+
+def iter_text_chunks(stream, chunk_size=1000, chunk_overlap=20, separators=DEFAULT_SEPARATORS, is_separator_regex=False, length_function=len):
+    """
+    Split a text stream into chunks lazily, by recursively looking at separators. Follows Langchain's
+    RecursiveCharacterTextSplitter: https://api.python.langchain.com/en/latest/_modules/langchain_text_splitters/character.html#RecursiveCharacterTextSplitter
+
+    The stream is read READ_SIZE characters at a time and cut into paragraphs on the first separator.
+    Paragraphs shorter than chunk_size are merged into chunks, longer ones are split on the next
+    separators. A paragraph growing past MAX_BUFFER characters is split up to its last finer separator,
+    so memory stays bounded whatever the size or layout of the document.
+
+    Args:
+        stream (file): The text stream, eg. an open text file.
+        chunk_size (int, optional): The maximum length of each chunk. Defaults to 1000.
+        chunk_overlap (int, optional): The maximum length shared by consecutive chunks. Defaults to 20.
+        separators (tuple, optional): The separators, from the coarsest to the finest. Defaults to DEFAULT_SEPARATORS.
+        is_separator_regex (bool, optional): Whether the separators are regex patterns. Defaults to False.
+        length_function (callable, optional): Measures a text, eg. token_length(model) to size chunks in tokens. Defaults to len.
+
+    Yields:
+        str: The chunks.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+    separators = compile_separators(tuple(separators), is_separator_regex)
+    _, pattern, joiner = separators[0]
+    if pattern is None: # a single level of characters
+        yield from _split_text(stream.read(), 0, separators, chunk_size, chunk_overlap, length_function)
+        return
+
+    def paragraphs():
+        buffer, eof = "", False
+        while not eof:
+            block = stream.read(READ_SIZE)
+            eof = block == ""
+            buffer += block
+            end = 0
+            for match in pattern.finditer(buffer):
+                if not eof and match.end() == len(buffer):
+                    break # the separator may continue in the next block
+                if match.start() > end:
+                    yield buffer[end:match.start()], False
+                end = match.end()
+            buffer = buffer[end:]
+            if len(buffer) > MAX_BUFFER: # a very long paragraph, cut it at the last finer separator of its second half
+                start, end = len(buffer) // 2, len(buffer) // 2
+                for _, finer, _ in separators[1:]:
+                    if finer is not None:
+                        for match in finer.finditer(buffer, len(buffer) // 2):
+                            start, end = match.start(), match.end()
+                        if end > len(buffer) // 2:
+                            break
+                yield buffer[:start], True
+                buffer = buffer[end:]
+        if buffer:
+            yield buffer, False
+
+    good = []
+    for paragraph, partial in paragraphs():
+        length = length_function(paragraph)
+        if length < chunk_size and not partial:
+            good.append((paragraph, length))
+            continue
+        if good:
+            yield from merge_splits(good, joiner, chunk_size, chunk_overlap, length_function)
+            good = []
+        if len(separators) > 1:
+            yield from _split_text(paragraph, 1, separators, chunk_size, chunk_overlap, length_function)
+        else:
+            yield paragraph
+    if good:
+        yield from merge_splits(good, joiner, chunk_size, chunk_overlap, length_function)
+
+def split_text_recursively(text, chunk_size=1000, chunk_overlap=20, separators=None, is_separator_regex=False, length_function=len):
+    """
+    Split text by recursively looking at characters, see iter_text_chunks.
+
+    Args:
+        text (str): The text to be split.
+        chunk_size (int, optional): The maximum length of each chunk. Defaults to 1000.
+        chunk_overlap (int, optional): The maximum length shared by consecutive chunks. Defaults to 20.
+        separators (list, optional): List of separators to use for splitting. Defaults to ["\\n\\n", "\\n", " ", ""].
+        is_separator_regex (bool, optional): Whether the separators are regex patterns. Defaults to False.
+        length_function (callable, optional): Measures a text. Defaults to len.
+
+    Returns:
+        list: A list of text chunks.
+    """
+    return list(iter_text_chunks(StringIO(text), chunk_size, chunk_overlap, separators or DEFAULT_SEPARATORS,
+                                 is_separator_regex, length_function))
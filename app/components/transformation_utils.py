@@ -1,4 +1,301 @@
+import ast
+import operator
+from functools import lru_cache
 import numpy as np
+import pandas as pd
+
+# the python subset allowed in direct transformation instructions, eg. "x*10" or "x.split('/')[0]"
+binary_operators = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+                    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow}
+unary_operators = {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Not: operator.not_}
+compare_operators = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+                     ast.Gt: operator.gt, ast.GtE: operator.ge}
+string_methods = {'split', 'rsplit', 'strip', 'lstrip', 'rstrip', 'lower', 'upper', 'title', 'capitalize', 'replace',
+                  'startswith', 'endswith', 'zfill', 'find', 'count', 'isdigit', 'isnumeric', 'isalpha'}
+functions = {'round', 'abs', 'float', 'int', 'str', 'len', 'min', 'max'}
+
+def validate_instructions(tree):
+    """
+    Check that a parsed direct transformation only uses the allowed python subset.
+
+    Allowed are the variable x, constants, arithmetic, comparisons, and/or/not, conditional expressions,
+    indexing and slicing, string methods and the functions round, abs, float, int, str, len, min and max.
+
+    Args:
+        tree (ast.Expression): The parsed instructions.
+
+    Raises:
+        ValueError: If the instructions use anything else, eg. imports, attributes other than string methods or other names.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id != 'x' and node.id not in functions:
+            raise ValueError(f"Unknown name '{node.id}' in transformation instructions, only x can be used")
+        if isinstance(node, ast.Attribute) and node.attr not in string_methods:
+            raise ValueError(f"Unsupported method '{node.attr}' in transformation instructions")
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id in functions:
+                continue
+            if not isinstance(node.func, ast.Attribute):
+                raise ValueError("Only string methods and round, abs, float, int, str, len, min and max can be called in transformation instructions")
+        if not isinstance(node, (ast.Expression, ast.Name, ast.Load, ast.Constant, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+                                 ast.IfExp, ast.Call, ast.Attribute, ast.Subscript, ast.Slice, ast.keyword, ast.And, ast.Or,
+                                 *binary_operators, *unary_operators, *compare_operators)):
+            raise ValueError(f"Unsupported syntax '{type(node).__name__}' in transformation instructions")
+
+def _whole_numbers(numbers):
+    """
+    Truncate floats to nullable integers, as int() does. Values int() rejects (NaN, infinity) and values outside the int64 range become missing.
+
+    Args:
+        numbers (pd.Series): Float values.
+
+    Returns:
+        pd.Series: The Int64 values.
+    """
+    numbers = np.trunc(numbers.astype(float))
+    return numbers.where(np.isfinite(numbers) & (numbers.abs() < 2 ** 63)).astype('Int64')
+
+def truthy(values):
+    """
+    Get the truth value of each value, as bool() does. Missing values count as true, as NaN does in python.
+
+    Args:
+        values (pd.Series or scalar): The values.
+
+    Returns:
+        pd.Series or bool: The truth values.
+    """
+    if not isinstance(values, pd.Series):
+        return bool(values)
+    if pd.api.types.is_bool_dtype(values):
+        return values.fillna(True).astype(bool)
+    if pd.api.types.is_numeric_dtype(values):
+        return (values != 0).fillna(True).astype(bool)
+    return values.map(lambda value: True if pd.isna(value) else bool(value)).astype(bool)
+
+def to_dtype(values, dtype):
+    """
+    Convert a column to a data type, the vectorized equivalent of dtype_conversion. Values that cannot be converted become NaN.
+
+    Missing values stay missing, rather than becoming 'nan' as a string or True as a boolean.
+
+    Args:
+        values (pd.Series): The values to convert.
+        dtype (str): The data type, one of 'string', 'str', 'float', 'integer', 'int', 'boolean' or 'other'.
+
+    Returns:
+        pd.Series: The converted values.
+    """
+    if dtype in ('string', 'str'):
+        return values.astype(str).astype(object).where(values.notna(), np.nan)
+    elif dtype == 'float':
+        if pd.api.types.is_numeric_dtype(values):
+            return values.astype(float)
+        return pd.to_numeric(values, errors='coerce').astype(float)
+    elif dtype in ('integer', 'int'):
+        if pd.api.types.is_numeric_dtype(values):
+            return _whole_numbers(values)
+        # int() of a string only accepts whole numbers, other values are truncated
+        if pd.api.types.infer_dtype(values, skipna=True) == 'string': # eg. a column read from a csv
+            is_text = values.notna()
+        else:
+            is_text = values.map(lambda value: isinstance(value, str)).astype(bool)
+        text = values.where(is_text).astype(str).str.strip()
+        numbers = pd.to_numeric(values.where(~is_text, text.where(text.str.fullmatch(r'[+-]?\d+'))), errors='coerce')
+        return _whole_numbers(numbers)
+    elif dtype == 'boolean':
+        return truthy(values).astype('boolean').mask(values.isna())
+    elif dtype == 'other':
+        return values
+    return pd.Series(None, index=values.index, dtype=object)
+
+def _select(condition, if_true, if_false):
+    """
+    Choose between two values element-wise, as a conditional expression does.
+
+    Args:
+        condition (pd.Series): The boolean condition.
+        if_true (pd.Series or scalar): The values where the condition holds.
+        if_false (pd.Series or scalar): The values elsewhere.
+
+    Returns:
+        pd.Series: The chosen values, as objects if the two sides have different types.
+    """
+    if_true = if_true if isinstance(if_true, pd.Series) else pd.Series([if_true] * len(condition), index=condition.index)
+    if_false = if_false if isinstance(if_false, pd.Series) else pd.Series([if_false] * len(condition), index=condition.index)
+    if if_true.dtype != if_false.dtype:
+        if_true, if_false = if_true.astype(object), if_false.astype(object)
+    return if_true.where(condition, if_false)
+
+def _vectorized(node, x):
+    """
+    Evaluate a validated instruction node over a whole column.
+
+    Args:
+        node (ast.AST): The node.
+        x (pd.Series): The column.
+
+    Returns:
+        pd.Series or scalar: The result.
+    """
+    if isinstance(node, ast.Expression):
+        return _vectorized(node.body, x)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return x
+    if isinstance(node, ast.BinOp):
+        return binary_operators[type(node.op)](_vectorized(node.left, x), _vectorized(node.right, x))
+    if isinstance(node, ast.UnaryOp):
+        operand = _vectorized(node.operand, x)
+        if isinstance(node.op, ast.Not) and isinstance(operand, pd.Series):
+            return ~truthy(operand)
+        return unary_operators[type(node.op)](operand)
+    if isinstance(node, ast.Compare):
+        result, left = True, _vectorized(node.left, x)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _vectorized(comparator, x)
+            comparison = compare_operators[type(op)](left, right)
+            if isinstance(comparison, pd.Series): # comparisons with a missing value are false, as with NaN
+                comparison = comparison.fillna(False).astype(bool)
+            result = result & comparison
+            left = right
+        return result
+    if isinstance(node, ast.BoolOp): # and/or return one of their operands, as in python
+        values = [_vectorized(value, x) for value in node.values]
+        result = values[0]
+        for value in values[1:]:
+            if isinstance(result, pd.Series):
+                result = _select(truthy(result), value, result) if isinstance(node.op, ast.And) else _select(truthy(result), result, value)
+            else:
+                result = (result and value) if isinstance(node.op, ast.And) else (result or value)
+        return result
+    if isinstance(node, ast.IfExp):
+        test, body, orelse = _vectorized(node.test, x), _vectorized(node.body, x), _vectorized(node.orelse, x)
+        if not isinstance(test, pd.Series):
+            return body if test else orelse
+        return _select(truthy(test), body, orelse)
+    if isinstance(node, ast.Subscript):
+        value = _vectorized(node.value, x)
+        if isinstance(node.slice, ast.Slice):
+            start, stop, step = [None if y is None else _vectorized(y, x) for y in (node.slice.lower, node.slice.upper, node.slice.step)]
+            return value.str.slice(start, stop, step) if isinstance(value, pd.Series) else value[start:stop:step]
+        index = _vectorized(node.slice, x)
+        return value.str[index] if isinstance(value, pd.Series) else value[index]
+    if isinstance(node, ast.Call):
+        args = [_vectorized(arg, x) for arg in node.args]
+        kwargs = {keyword.arg: _vectorized(keyword.value, x) for keyword in node.keywords}
+        if isinstance(node.func, ast.Attribute): # string method
+            value = _vectorized(node.func.value, x)
+            if isinstance(value, pd.Series):
+                return getattr(value.str, node.func.attr)(*args, **kwargs)
+            return getattr(value, node.func.attr)(*args, **kwargs)
+        name = node.func.id
+        if not any(isinstance(arg, pd.Series) for arg in args):
+            return {'round': round, 'abs': abs, 'float': float, 'int': int, 'str': str, 'len': len, 'min': min, 'max': max}[name](*args, **kwargs)
+        if name in ('round', 'abs') and pd.api.types.is_bool_dtype(args[0]): # round(True) is 1
+            args[0] = args[0].astype('Int64')
+        if name == 'round':
+            return args[0].round(*args[1:], **kwargs)
+        if name == 'abs':
+            return args[0].abs()
+        if name == 'float':
+            return to_dtype(args[0], 'float')
+        if name == 'int':
+            return to_dtype(args[0], 'int')
+        if name == 'str':
+            return to_dtype(args[0], 'str')
+        if name == 'len':
+            return args[0].str.len().astype('Int64') # stays integer next to missing values
+        result = args[0] # min and max return the first of the smallest or largest arguments, as in python
+        for arg in args[1:]:
+            replace = arg < result if name == 'min' else arg > result
+            if isinstance(replace, pd.Series):
+                result = _select(replace.fillna(False).astype(bool), arg, result)
+            elif replace:
+                result = arg
+        return result
+    raise ValueError(f"Unsupported syntax '{type(node).__name__}' in transformation instructions")
+
+@lru_cache(maxsize=256)
+def compile_direct_conversion(x_str, source_dtype, target_dtype):
+    """
+    Parse and validate direct transformation instructions once, returning a plan that converts whole columns.
+
+    Args:
+        x_str (str): The conversion expression, in terms of x, eg. "x*10".
+        source_dtype (str): The source data type.
+        target_dtype (str): The target data type.
+
+    Returns:
+        callable: Takes a pd.Series of source values and returns the pd.Series of converted values.
+
+    Raises:
+        ValueError: If the instructions are not valid python or use syntax outside the allowed subset.
+    """
+    try:
+        tree = ast.parse(x_str.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid transformation instructions: {e}")
+    validate_instructions(tree)
+
+    def plan(values):
+        x = to_dtype(values, source_dtype)
+        result = _vectorized(tree, x)
+        if not isinstance(result, pd.Series): # eg. the instructions are a constant
+            result = pd.Series([result] * len(values), index=values.index, dtype=object)
+        return to_dtype(result, target_dtype)
+    return plan
+
+@lru_cache(maxsize=256)
+def compile_catagorical_conversion(dictionary_str):
+    """
+    Parse categorical transformation instructions once, returning a plan that converts whole columns with a single lookup.
+
+    Args:
+        dictionary_str (str): The dictionary as a string, eg. "{'0.0': 'no', '1.0': 'yes'}".
+
+    Returns:
+        callable: Takes a pd.Series of source values and returns the pd.Series of converted values, NaN where a value is not in the dictionary.
+
+    Raises:
+        ValueError: If the instructions are not a dictionary literal.
+    """
+    try:
+        dictionary_init = ast.literal_eval(dictionary_str.strip())
+    except (SyntaxError, ValueError) as e:
+        raise ValueError(f"Categorical transformation instructions must be a dictionary: {e}")
+    if not isinstance(dictionary_init, dict):
+        raise ValueError("Categorical transformation instructions must be a dictionary")
+    dictionary = {str(key): value for key, value in dictionary_init.items()} # convert all keys to string dtype
+
+    def plan(values):
+        converted = values.astype(str).map(dictionary)
+        return converted.astype(object).where(converted.notna(), np.nan)
+    return plan
+
+def apply_transformation(values, transformation_type, transformation_instructions, source_dtype=None, target_dtype=None):
+    """
+    Apply transformation instructions to a whole column.
+
+    Args:
+        values (list or pd.Series): The values to convert.
+        transformation_type (str): 'Direct' or 'Categorical'.
+        transformation_instructions (str): The instructions.
+        source_dtype (str, optional): The source data type of a direct transformation. Defaults to None.
+        target_dtype (str, optional): The target data type of a direct transformation. Defaults to None.
+
+    Returns:
+        pd.Series: The converted values.
+    """
+    values = pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values
+    if transformation_type == 'Direct':
+        plan = compile_direct_conversion(transformation_instructions, source_dtype, target_dtype)
+    elif transformation_type == 'Categorical':
+        plan = compile_catagorical_conversion(transformation_instructions)
+    else:
+        raise ValueError(f"Unknown transformation type '{transformation_type}'")
+    return plan(values)
 
 def generic_catagorical_conversion(x, dictionary_str):
     """
@@ -11,17 +308,7 @@ def generic_catagorical_conversion(x, dictionary_str):
     Returns:
         any: The converted value or NaN if conversion fails.
     """
-    dictionary_init = eval(dictionary_str)
-    dictionary = {str(key): value for key, value in dictionary_init.items()} # convert all keys to string dtype
-    x = str(x)
-    if x in list(dictionary):
-        out = dictionary[x]
-        if not out == None:
-            return out
-        else:
-            return np.nan
-    else:
-        return np.nan
+    return compile_catagorical_conversion(dictionary_str)(pd.Series([x], dtype=object)).iloc[0]
 
 def dtype_conversion(x, dtype):
     """
@@ -38,7 +325,7 @@ def dtype_conversion(x, dtype):
         if dtype == 'string':
             return str(x)
         elif dtype == 'str':
-            return str(x)    
+            return str(x)
         elif dtype == 'float':
             return float(x)
         elif dtype == 'integer':
@@ -65,6 +352,4 @@ def generic_direct_conversion(x, x_str, source_dtype, target_dtype):
     Returns:
         any: The converted value.
     """
-    x = dtype_conversion(x, source_dtype)
-    x = eval(x_str)
-    return dtype_conversion(x, target_dtype)
\ No newline at end of file
+    return compile_direct_conversion(x_str, source_dtype, target_dtype)(pd.Series([x], dtype=object)).iloc[0]
@@ -1,10 +1,8 @@
 import streamlit as st
 import pandas as pd
 import fsspec
-import clevercsv
-from io import StringIO
 from dotenv import dotenv_values
-from .util import modify_env
+from .util import modify_env, streamlit_csv_reader
 
 results_path = "results"
 input_path = "input"
@@ -12,20 +10,6 @@ preprocess_path = "preprocess"
 
 fs = fsspec.filesystem("")
 
-def streamlit_csv_reader(file_up):
-    """
-    Reads a CSV file uploaded via Streamlit's file uploader and returns a pandas DataFrame.
-    
-    Args:
-        file_up (UploadedFile): The file uploaded via Streamlit's file uploader.
-    
-    Returns:
-        DataFrame: A pandas DataFrame containing the CSV data.
-    """
-    stringio = StringIO(file_up.getvalue().decode("utf-8"))
-    delim = clevercsv.Sniffer().sniff(stringio.read()).delimiter # type: ignore
-    return pd.read_csv(file_up, sep = delim)
-
 def upload_codebook(file_in):
     """
     Processes the uploaded codebook CSV file and saves it to the input path.
@@ -33,7 +17,7 @@ def upload_codebook(file_in):
     Args:
         file_in (UploadedFile): The codebook file uploaded via Streamlit's file uploader.
     """
-    target_df = streamlit_csv_reader(file_in)
+    target_df = streamlit_csv_reader(file_in, 'Reading codebook')
     try:
         target_df = target_df[['variable_name', 'description', 'dType', 'Unit', 'Categories', 'Unit Example']]
         modify_env('auto_transform_available', 'yes')
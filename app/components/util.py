@@ -1,8 +1,23 @@
-from openai import OpenAI # type: ignore
+from openai import OpenAI, AsyncOpenAI # type: ignore
 import streamlit as st
 import fsspec
+import hashlib
+import json
+import ast
+import os
+import tempfile
+import pandas as pd
+import clevercsv
+
+input_path = "input"
+preprocess_path = "preprocess"
+
+SNIFF_BYTES = 1 << 16 # size of the prefix the CSV dialect is detected from
+SPOOL_BYTES = 1 << 23 # size of the blocks an upload is copied to disk in
+CSV_CHUNK_ROWS = 100000 # rows parsed at a time
 
 fs = fsspec.filesystem("")
+_fingerprints = {}
 def init_llm_models(config):
     openai_client = None
     if 'OpenAI_api_key' in list(config):
@@ -11,6 +26,95 @@ def init_llm_models(config):
         raise ValueError("No OpenAI API key found. Please provide an API key to proceed.")
     return openai_client
 
+def init_async_llm_models(config):
+    async_client = None
+    if 'OpenAI_api_key' in list(config):
+        async_client = AsyncOpenAI(api_key=config['OpenAI_api_key'])
+    else:
+        raise ValueError("No OpenAI API key found. Please provide an API key to proceed.")
+    return async_client
+
+def spool_upload(file_up):
+    """
+    Copy an uploaded file to a temporary file on disk, a block at a time.
+
+    Args:
+        file_up (UploadedFile): The file uploaded via Streamlit's file uploader.
+
+    Returns:
+        str: Path to the temporary file, to be removed by the caller.
+    """
+    fs.mkdirs(f"{preprocess_path}/uploads", exist_ok=True)
+    handle, path = tempfile.mkstemp(suffix='.csv', dir=f"{preprocess_path}/uploads")
+    file_up.seek(0)
+    with os.fdopen(handle, 'wb') as f:
+        for block in iter(lambda: file_up.read(SPOOL_BYTES), b''):
+            f.write(block)
+    return path
+
+def sniff_delimiter(path, n_bytes=SNIFF_BYTES):
+    """
+    Detect the delimiter of a CSV file from its first n_bytes, cut back to the last complete line.
+
+    Args:
+        path (str): Path to the CSV file.
+        n_bytes (int, optional): The size of the prefix sniffed. Defaults to SNIFF_BYTES.
+
+    Returns:
+        str: The delimiter, ',' if it cannot be detected.
+    """
+    with fs.open(path, 'rb') as f:
+        prefix = f.read(n_bytes)
+    if len(prefix) == n_bytes and b'\n' in prefix:
+        prefix = prefix[:prefix.rindex(b'\n')]
+    dialect = clevercsv.Sniffer().sniff(prefix.decode('utf-8', errors='ignore'))
+    return dialect.delimiter if dialect is not None and dialect.delimiter else ','
+
+def read_csv_chunks(path, sep=',', chunksize=CSV_CHUNK_ROWS, on_progress=None, **kwargs):
+    """
+    Parse a CSV file in a single streaming pass, a chunk of rows at a time.
+
+    Args:
+        path (str): Path to the CSV file.
+        sep (str, optional): The delimiter. Defaults to ','.
+        chunksize (int, optional): The number of rows per chunk. Defaults to CSV_CHUNK_ROWS.
+        on_progress (callable, optional): Called with the fraction of the file parsed after each chunk. Defaults to None.
+        **kwargs: Other pd.read_csv arguments, eg. dtype or usecols.
+
+    Yields:
+        DataFrame: The chunks.
+    """
+    size = max(fs.info(path)['size'], 1)
+    with open(path, 'rb') as f:
+        for chunk in pd.read_csv(f, sep=sep, chunksize=chunksize, **kwargs):
+            if on_progress:
+                on_progress(min(f.tell() / size, 1.0))
+            yield chunk
+
+def streamlit_csv_reader(file_up, label='Reading file'):
+    """
+    Reads a CSV file uploaded via Streamlit's file uploader and returns a pandas DataFrame.
+
+    The upload is spooled to disk, its delimiter sniffed from a bounded prefix and the data parsed once,
+    with a progress bar.
+
+    Args:
+        file_up (UploadedFile): The file uploaded via Streamlit's file uploader.
+        label (str, optional): The progress bar label. Defaults to 'Reading file'.
+
+    Returns:
+        DataFrame: A pandas DataFrame containing the CSV data.
+    """
+    path = spool_upload(file_up)
+    try:
+        progress = st.progress(0.0, text=f'{label}: {file_up.name}')
+        chunks = read_csv_chunks(path, sniff_delimiter(path), on_progress=lambda x: progress.progress(x, text=f'{label}: {file_up.name}'))
+        df = pd.concat(chunks, ignore_index=True)
+        progress.empty()
+        return df
+    finally:
+        os.remove(path)
+
 def delete_files_and_folders(directory_path):
     """
     Delete all files and folders in the specified directory.
@@ -55,11 +159,92 @@ def modify_env(key, value=None, delete=False):
     with open(".env", 'w') as file:
         file.writelines(lines)
 
+def file_fingerprint(path):
+    """
+    Get the sha256 hash of a file's content. Hashes are memoised on (path, size, modification time).
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: The hex digest, or None if the file does not exist.
+    """
+    if not fs.exists(path):
+        return None
+    info = fs.info(path)
+    stamp = (path, info['size'], info.get('mtime'))
+    if stamp not in _fingerprints:
+        sha = hashlib.sha256()
+        with fs.open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        _fingerprints[stamp] = sha.hexdigest()
+    return _fingerprints[stamp]
+
+def manifest_path(output_file):
+    """
+    Get the path of the manifest recording the inputs an output file was derived from.
+
+    Args:
+        output_file (str): Path to the derived file.
+
+    Returns:
+        str: Path to the manifest.
+    """
+    return f"{output_file}.manifest.json"
+
+def build_manifest(input_files, params=None):
+    """
+    Fingerprint the inputs of a derived file.
+
+    Args:
+        input_files (list): Paths of the files the output depends on, missing files are recorded as None.
+        params (dict, optional): Other values the output depends on, eg. prompts. Defaults to None.
+
+    Returns:
+        dict: The manifest.
+    """
+    return {'inputs': {path: file_fingerprint(path) for path in input_files},
+            'params': params or {}}
+
+def write_manifest(output_file, input_files, params=None):
+    """
+    Record the fingerprints of the inputs a derived file was created from.
+
+    Args:
+        output_file (str): Path to the derived file.
+        input_files (list): Paths of the files the output depends on.
+        params (dict, optional): Other values the output depends on. Defaults to None.
+    """
+    with fs.open(manifest_path(output_file), 'w') as f:
+        json.dump(build_manifest(input_files, params), f, indent=1)
+
+def is_up_to_date(output_file, input_files, params=None):
+    """
+    Check whether a derived file exists and was created from the current version of its inputs.
+
+    Args:
+        output_file (str): Path to the derived file.
+        input_files (list): Paths of the files the output depends on.
+        params (dict, optional): Other values the output depends on. Defaults to None.
+
+    Returns:
+        bool: True if the output does not need to be recomputed.
+    """
+    if not fs.exists(output_file) or not fs.exists(manifest_path(output_file)):
+        return False
+    with fs.open(manifest_path(output_file), 'r') as f:
+        recorded = json.load(f)
+    return recorded == json.loads(json.dumps(build_manifest(input_files, params)))
+
 # map study utils below
 def reorder_lists(list1, list2, value):
     """
     Reorders two lists, such that the value is at the top of list1.
 
+    If the value is not in list1 (eg. recommendations truncated to the top k) it is added at the top,
+    paired with None in list2.
+
     Args:
         list1 (list): The first list.
         list2 (list): The second list.
@@ -68,6 +253,8 @@ def reorder_lists(list1, list2, value):
     Returns:
         tuple: The reordered lists.
     """
+    if value not in list1:
+        return [value] + list1, [None] + list2
     index = list1.index(value)
     reordered_list1 = [value] + list1[:index] + list1[index+1:]
     reordered_list2 = [list2[index]] + list2[:index] + list2[index+1:]
@@ -105,25 +292,73 @@ def format_example_data(example_data):
     example = ' ; '.join(example_data)
     return example
 
-def pre_process_recomendations(to_map_df, type_, study):
+def parse_list(text):
+    """
+    Parse a list written to CSV with str(), eg. a list of recommendations or distances.
+
+    Args:
+        text (str): The list's string representation.
+
+    Returns:
+        list: The parsed list.
+    """
+    try:
+        return json.loads(text) # much faster than literal_eval, works for lists of numbers
+    except ValueError:
+        return ast.literal_eval(text)
+
+@st.cache_resource(max_entries=32)
+def _load_recommendations(recommendations_file, fingerprint):
+    """
+    Load a study's recommendations file, once per file version. Variables are parsed on first use.
+
+    Args:
+        recommendations_file (str): Path to the study's dataset_variables_with_PID_date_recommendations.csv.
+        fingerprint (str): The file's fingerprint, so a changed file is loaded again.
+
+    Returns:
+        dict: The unparsed rows keyed by variable name ('raw') and the variables parsed so far ('parsed').
+    """
+    vars_df = pd.read_csv(recommendations_file)
+    return {'raw': vars_df.set_index('variable_name').to_dict('index'), 'parsed': {}}
+
+def variable_recommendations(study, variable):
+    """
+    Get the parsed recommendations of a study variable. These are cached in memory and shared by every session until the file changes.
+
+    Args:
+        study (str): The study name.
+        variable (str): The variable name.
+
+    Returns:
+        dict: {type_: (recommendations, distances)} for the 'target', 'PID' and 'date' types. Treat as read only.
+    """
+    recommendations_file = f'{input_path}/{study}/dataset_variables_with_PID_date_recommendations.csv'
+    recommendations = _load_recommendations(recommendations_file, file_fingerprint(recommendations_file))
+    if variable not in recommendations['parsed']:
+        row = recommendations['raw'][variable]
+        recommendations['parsed'][variable] = {type_: (parse_list(row[f'{type_}_recommendations']), parse_list(row[f'{type_}_distances']))
+                                               for type_ in ['target', 'PID', 'date']}
+    return recommendations['parsed'][variable]
+
+def pre_process_recomendations(variable, type_, study):
     """
     Pre-processes recommendations for mapping. By appending the confidence to the recommendation and reordering the list to have the previous PID or Date at the top of the respective lists. 
 
     Args:
-        to_map_df (DataFrame): The DataFrame containing variables to map.
+        variable (str): The variable to map.
         type_ (str): The type of recommendation (e.g., 'target', 'PID', 'date').
         study (str): The study name.
 
     Returns:
         list: List of recommended keys.
     """
-    recommended_codebook = eval(to_map_df[f'{type_}_recommendations'].to_list()[0])
-    recommended_confidence = eval(to_map_df[f'{type_}_distances'].to_list()[0])
+    recommended_codebook, recommended_confidence = variable_recommendations(study, variable)[type_]
     recommended_confidence = [f" - {round((1-x)*(100))}%" for x in recommended_confidence]
     if f'{type_}_{study}' in st.session_state:
         if st.session_state[f'{type_}_{study}'] != 'None':
             recommended_codebook, recommended_confidence = reorder_lists(recommended_codebook, recommended_confidence, st.session_state[f'{type_}_{study}'])
-    recommended_keys = [f"{x} {y}" for x, y in zip(recommended_codebook, recommended_confidence)]
+    recommended_keys = [x if y is None else f"{x} {y}" for x, y in zip(recommended_codebook, recommended_confidence)] # no confidence for a previous choice outside the top k
     if type_ in ['PID', 'date']:
         recommended_keys.insert(0, 'None  - 0%')
         if f'{type_}_{study}' in st.session_state:
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+EMBEDDING_DIM = 1536 # the dimension of text-embedding-ada-002
+
+def word_vector(word, dim):
+    """
+    Get the deterministic random unit vector of a word.
+
+    Args:
+        word (str): The word.
+        dim (int): The embedding dimension.
+
+    Returns:
+        ndarray: The float32 vector.
+    """
+    seed = int.from_bytes(hashlib.sha256(word.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+class FakeEmbeddings:
+    """
+    Offline stand-in for the OpenAI embeddings endpoint.
+
+    A text is embedded as the normalised sum of deterministic random vectors of its words and character
+    trigrams, so texts sharing words are close, as with a real model, and every run gives the same
+    embeddings. Requests, inputs and (estimated) tokens are counted, as is the time spent computing the
+    fake embeddings (seconds), which a real backend would not spend locally. An optional latency is
+    added to each request to model the network.
+    """
+    def __init__(self, dim=EMBEDDING_DIM, latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.requests = 0
+        self.inputs = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self._vectors = {}
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        """
+        Embed a single text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            list: The embedding.
+        """
+        words = re.findall(r'\w+', str(text).lower())
+        features = words + [word[i:i + 3] for word in words for i in range(len(word) - 2)]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in features or ['<empty>']:
+            if feature not in self._vectors:
+                self._vectors[feature] = word_vector(feature, self.dim)
+            vector += self._vectors[feature]
+        return (vector / (np.linalg.norm(vector) or 1)).tolist()
+
+    def create(self, input, model):
+        with self._lock:
+            self.requests += 1
+            self.inputs += len(input)
+            self.tokens += sum(len(str(x)) // 3 + 1 for x in input)
+        if self.latency:
+            time.sleep(self.latency)
+        start = time.perf_counter()
+        data = [SimpleNamespace(index=i, embedding=self.embed(text)) for i, text in enumerate(input)]
+        with self._lock:
+            self.seconds += time.perf_counter() - start
+        return SimpleNamespace(data=data)
+
+def fake_completion(messages):
+    """
+    Get the deterministic response of the LLM stand-in, a description built from the variable name of the last message.
+
+    Args:
+        messages (list): The prompt messages.
+
+    Returns:
+        SimpleNamespace: A chat completion with a single choice.
+    """
+    prompt = messages[-1]['content']
+    name = prompt.split('variable name:')[-1].split(',')[0].strip()
+    content = f"{' '.join(name.replace('_', ' ').split())} (?)"
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class FakeChat:
+    """
+    Offline stand-in for the OpenAI chat completions endpoint, counting requests and prompt characters.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def create(self, model, messages):
+        with self._lock:
+            self.requests += 1
+            self.prompt_chars += sum(len(x['content']) for x in messages)
+        if self.latency:
+            time.sleep(self.latency)
+        return fake_completion(messages)
+
+class FakeAsyncChat:
+    """
+    Offline stand-in for the asynchronous chat completions endpoint, sharing the counters of a FakeChat.
+    """
+    def __init__(self, chat):
+        self.chat = chat
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def create(self, model, messages):
+        self.chat.requests += 1
+        self.chat.prompt_chars += sum(len(x['content']) for x in messages)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.chat.latency)
+        finally:
+            self.in_flight -= 1
+        return fake_completion(messages)
+
+class FakeClient:
+    """
+    Offline stand-in for the OpenAI client, with the embeddings and chat.completions endpoints used by the app.
+    """
+    def __init__(self, dim=EMBEDDING_DIM, embedding_latency=0.0, chat_latency=0.0):
+        self.embeddings = FakeEmbeddings(dim, embedding_latency)
+        self.chat = SimpleNamespace(completions=FakeChat(chat_latency))
+
+    def async_client(self):
+        """
+        Get an asynchronous client sharing this client's counters, in place of AsyncOpenAI.
+
+        Returns:
+            FakeAsyncClient: The client.
+        """
+        return FakeAsyncClient(self.chat.completions)
+
+    def counters(self):
+        """
+        Get the call counters.
+
+        Returns:
+            dict: The embedding requests, inputs and tokens, the time spent computing fake embeddings, and the chat requests and prompt characters.
+        """
+        return {'embedding_requests': self.embeddings.requests, 'embedding_inputs': self.embeddings.inputs,
+                'embedding_tokens': self.embeddings.tokens, 'backend_seconds': self.embeddings.seconds, 'chat_requests': self.chat.completions.requests,
+                'chat_prompt_chars': self.chat.completions.prompt_chars}
+
+class FakeAsyncClient:
+    """
+    Offline stand-in for the AsyncOpenAI client.
+    """
+    def __init__(self, chat):
+        self.chat = SimpleNamespace(completions=FakeAsyncChat(chat))
+
+    async def close(self):
+        pass
@@ -0,0 +1,317 @@
+"""
+Benchmark the recommendation pipeline on synthetic data with an offline embedding and LLM stand-in.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py --codebook-size 2000 --study-size 1000
+    python benchmarks/run_benchmarks.py --study-size 10000 --compare benchmarks/results/baseline.json
+
+Each stage is run once in a fresh temporary workspace and its wall time, peak resident memory and calls
+to the fake backend are saved to benchmarks/results/<label>.json. --compare reports the change against
+an earlier run and exits with status 1 if a stage got slower or used more memory than the threshold.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import logging
+import pandas as pd
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+repo_path = os.path.dirname(benchmarks_path)
+sys.path.insert(0, os.path.join(repo_path, 'app'))
+
+for logger in ['streamlit.runtime.scriptrunner_utils.script_run_context', 'streamlit.delta_generator', 'streamlit.runtime.state.session_state_proxy']:
+    logging.getLogger(logger).disabled = True # the bare mode warnings of the mapping page functions
+
+from synthetic import make_codebook, make_study, make_context_text, make_study_data
+from fake_backend import FakeClient, EMBEDDING_DIM
+from components import generate_descriptions, get_recommendations, map_study, results_store, transformation_utils
+
+results_path = os.path.join(benchmarks_path, "results")
+
+study = 'benchmark_study'
+
+RSS_INTERVAL = 0.005 # seconds between resident memory samples
+
+# (column, transformation type, instructions, source dtype, target dtype) of the transformation stage
+transformations = [('weight_g', 'Direct', 'x/1000', 'float', 'float'),
+                   ('weight_g', 'Direct', 'round(x/453.6, 1)', 'float', 'float'),
+                   ('sex_code', 'Categorical', "{'0': 'male', '1': 'female'}", None, None),
+                   ('smoker', 'Categorical', "{'Y': 'yes', 'N': 'no'}", None, None),
+                   ('visit_date', 'Direct', "x.split('/')[2]", 'string', 'integer')]
+
+def current_rss_mb():
+    """
+    Get the resident memory of the process.
+
+    Returns:
+        float: The resident set size in MB, or the peak so far where it cannot be read (outside Linux).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+def measure(name, function, client, trace_memory=False, items=None):
+    """
+    Run a stage once, measuring its wall time, peak memory and calls to the fake backend.
+
+    The resident memory is sampled every RSS_INTERVAL seconds by a background thread, which includes
+    native allocations (numpy, DuckDB) without slowing the stage down. Tracing python allocations
+    with tracemalloc is more precise but slows pure python code down several times.
+
+    Args:
+        name (str): The stage name.
+        function (callable): The stage, called without arguments.
+        client (FakeClient): The fake backend.
+        trace_memory (bool, optional): Also trace the peak python memory allocated by the stage. Defaults to False.
+        items (int, optional): The number of items processed, to report the throughput. Defaults to None.
+
+    Returns:
+        dict: The stage's measurements. app_seconds is the wall time less the time spent computing fake embeddings,
+              rss_increase_mb the peak resident memory during the stage less the resident memory before it.
+    """
+    gc.collect()
+    before = client.counters()
+    start_rss = current_rss_mb()
+    peak_rss = [start_rss]
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.wait(RSS_INTERVAL):
+            peak_rss[0] = max(peak_rss[0], current_rss_mb())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        function()
+    finally:
+        wall = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+    peak_rss[0] = max(peak_rss[0], current_rss_mb())
+    traced = None
+    if trace_memory:
+        traced = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    calls = {key: value - before[key] for key, value in client.counters().items()}
+    backend_seconds = calls.pop('backend_seconds')
+    result = {'stage': name, 'wall_seconds': round(wall, 4), 'app_seconds': round(wall - backend_seconds, 4),
+              'peak_rss_mb': round(peak_rss[0], 1), 'rss_increase_mb': round(peak_rss[0] - start_rss, 1),
+              'traced_peak_mb': None if traced is None else round(traced, 2), 'calls': calls}
+    if items:
+        result['items'] = items
+        result['items_per_second'] = round(items / max(wall, 1e-9), 1)
+    print(f"{name:<26} {wall:9.3f}s  app {result['app_seconds']:9.3f}s  rss {result['peak_rss_mb']:8.1f}MB (+{result['rss_increase_mb']:.1f})"
+          f"{'' if traced is None else f'  traced {traced:.1f}MB'}  {calls}")
+    return result
+
+def prepare_workspace(workspace, codebook_size, study_size, context_paragraphs, seed):
+    """
+    Write a synthetic codebook, study and context document into a workspace, as if uploaded through the app.
+
+    Args:
+        workspace (str): The workspace directory, the working directory of the run.
+        codebook_size (int): The number of codebook variables.
+        study_size (int): The number of study variables.
+        context_paragraphs (int): The number of paragraphs of the study's context document.
+        seed (int): The random seed.
+
+    Returns:
+        pd.DataFrame: The study variables.
+    """
+    codebook = make_codebook(codebook_size, seed)
+    study_df = make_study(codebook, study_size, seed=seed)
+    os.makedirs(os.path.join(workspace, 'input', study), exist_ok=True)
+    codebook.to_csv(os.path.join(workspace, 'input', 'target_variables.csv'), index=False)
+    study_df[['variable_name', 'description']].to_csv(os.path.join(workspace, 'input', study, 'dataset_variables.csv'))
+    if context_paragraphs:
+        with open(os.path.join(workspace, 'input', study, 'context.txt'), 'w', encoding='utf-8') as f:
+            f.write(make_context_text(study_df, context_paragraphs, seed))
+    return study_df
+
+def map_variables(study_df):
+    """
+    Record a mapping decision for every study variable, as a user working through the mapping page would.
+
+    Args:
+        study_df (pd.DataFrame): The study variables.
+    """
+    recommendations = pd.read_csv(f'input/{study}/dataset_variables_with_PID_date_recommendations.csv')
+    for row in recommendations.itertuples():
+        best = row.target_recommendations.split("'")[1]
+        map_study.write_to_results(study, row.variable_name, f'{best} (confidence: 0.9)', '', 1,
+                                   patient_id='participant_id (confidence: 0.8)', date='visit_date (confidence: 0.8)')
+
+def transform_columns(data):
+    """
+    Apply every benchmark transformation to its column, compiling the transformation plans from scratch.
+
+    Args:
+        data (pd.DataFrame): The source columns.
+    """
+    transformation_utils.compile_direct_conversion.cache_clear()
+    transformation_utils.compile_catagorical_conversion.cache_clear()
+    for column, transformation_type, instructions, source_dtype, target_dtype in transformations:
+        transformation_utils.apply_transformation(data[column], transformation_type, instructions, source_dtype, target_dtype)
+
+def run_benchmarks(codebook_size, study_size, rows, context_paragraphs, dim, embedding_latency, chat_latency, seed, trace_memory, keep_workspace):
+    """
+    Run every benchmark stage in a fresh workspace.
+
+    Args:
+        codebook_size (int): The number of codebook variables.
+        study_size (int): The number of study variables.
+        rows (int): The number of rows of the transformation benchmark.
+        context_paragraphs (int): The number of paragraphs of the study's context document, 0 for none.
+        dim (int): The embedding dimension.
+        embedding_latency (float): The seconds added to each embedding request.
+        chat_latency (float): The seconds added to each chat request.
+        seed (int): The random seed.
+        trace_memory (bool): Also trace the peak python memory of each stage.
+        keep_workspace (bool): Keep the workspace for inspection rather than deleting it.
+
+    Returns:
+        list: The measurements of each stage.
+    """
+    client = FakeClient(dim, embedding_latency, chat_latency)
+    generate_descriptions.init_async_llm_models = lambda config: client.async_client() # the offline LLM stand-in
+    config = {'init_prompt': 'Give a short description of the variable.', 'max_concurrent_requests': '16'}
+    workspace = tempfile.mkdtemp(prefix='benchmark_')
+    cwd = os.getcwd()
+    stages = []
+    try:
+        os.chdir(workspace)
+        study_df = prepare_workspace(workspace, codebook_size, study_size, context_paragraphs, seed)
+        n_to_do = int(study_df['description'].isna().sum())
+        stages.append(measure('descriptions', lambda: generate_descriptions.generate_study_descriptions(client, study, config), client, trace_memory, n_to_do))
+        stages.append(measure('codebook_embeddings', lambda: get_recommendations.embed_codebook(client), client, trace_memory, codebook_size))
+        stages.append(measure('study_embeddings', lambda: get_recommendations.embed_study(client, study), client, trace_memory, study_size))
+        for path in os.listdir(f'input/{study}'): # embed again from the embedding cache
+            if path.startswith('dataset_variables_with_embeddings'):
+                os.remove(f'input/{study}/{path}')
+        stages.append(measure('study_embeddings_cached', lambda: get_recommendations.embed_study(client, study), client, trace_memory, study_size))
+        stages.append(measure('recommendations', lambda: get_recommendations.generate_recommendations(study), client, trace_memory, study_size))
+        stages.append(measure('PID_date_recommendations', lambda: get_recommendations.generate_PID_date_recommendations(client, study), client, trace_memory, study_size))
+        stages.append(measure('load_results_store', lambda: results_store.load_study(study), client, trace_memory, study_size))
+        stages.append(measure('write_to_results', lambda: map_variables(study_df), client, trace_memory, study_size))
+        data = make_study_data(rows, seed)
+        stages.append(measure('transformations', lambda: transform_columns(data), client, trace_memory, rows * len(transformations)))
+    finally:
+        results_store.close_store()
+        os.chdir(cwd)
+        if keep_workspace:
+            print(f"Workspace kept at {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+    return stages
+
+def git_commit():
+    """
+    Get the commit of the benchmarked code.
+
+    Returns:
+        str: The short commit hash, with '-dirty' if there are uncommitted changes, or None outside a git repository.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_path, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_path, capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_runs(run, baseline, threshold, min_seconds=0.05):
+    """
+    Print the change of each stage against a baseline run.
+
+    A stage regresses if its app time grew by more than the threshold ratio and by more than min_seconds, its resident
+    memory increase grew by more than the threshold ratio, or it made more backend calls.
+
+    Args:
+        run (dict): The current run.
+        baseline (dict): The baseline run.
+        threshold (float): The largest acceptable ratio, eg. 1.2 for 20% slower.
+        min_seconds (float, optional): The smallest slowdown reported, as short stages are noisy. Defaults to 0.05.
+
+    Returns:
+        list: The names of the regressed stages.
+    """
+    if run['config'] != baseline['config']:
+        print(f"Warning: the runs have different configurations:\n  baseline {baseline['config']}\n  current  {run['config']}")
+    baseline_stages = {x['stage']: x for x in baseline['stages']}
+    regressions = []
+    print(f"\nCompared to {baseline['label']} ({baseline.get('git_commit')}):")
+    for stage in run['stages']:
+        old = baseline_stages.get(stage['stage'])
+        if old is None:
+            continue
+        time_ratio = stage['app_seconds'] / max(old['app_seconds'], 1e-3)
+        memory_ratio = max(stage['rss_increase_mb'], 1) / max(old.get('rss_increase_mb') or 0, 1) # ignore changes under 1MB
+        more_calls = {key: (old['calls'].get(key, 0), value) for key, value in stage['calls'].items() if value > old['calls'].get(key, 0)}
+        slower = time_ratio > threshold and stage['app_seconds'] - old['app_seconds'] > min_seconds
+        regressed = slower or memory_ratio > threshold or bool(more_calls)
+        if regressed:
+            regressions.append(stage['stage'])
+        print(f"{stage['stage']:<26} time x{time_ratio:6.2f}  memory x{memory_ratio:6.2f}"
+              f"{'  calls ' + str(more_calls) if more_calls else ''}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation pipeline on synthetic data with an offline embedding and LLM stand-in.")
+    parser.add_argument('--codebook-size', type=int, default=2000, help="Number of codebook variables.")
+    parser.add_argument('--study-size', type=int, default=1000, help="Number of study variables.")
+    parser.add_argument('--rows', type=int, default=1000000, help="Rows of the transformation benchmark.")
+    parser.add_argument('--context-paragraphs', type=int, default=200, help="Paragraphs of the study's context document, 0 for none.")
+    parser.add_argument('--dim', type=int, default=EMBEDDING_DIM, help="Embedding dimension.")
+    parser.add_argument('--embedding-latency', type=float, default=0.0, help="Seconds added to each embedding request.")
+    parser.add_argument('--chat-latency', type=float, default=0.0, help="Seconds added to each chat request.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed of the synthetic data.")
+    parser.add_argument('--trace-memory', action='store_true', help="Also trace python allocations with tracemalloc, which slows stages down.")
+    parser.add_argument('--keep-workspace', action='store_true', help="Keep the temporary workspace for inspection.")
+    parser.add_argument('--label', help="Name of the results file. Defaults to the date and sizes.")
+    parser.add_argument('--output-dir', default=results_path, help="Directory the results are saved to.")
+    parser.add_argument('--compare', help="Path to the results of an earlier run to compare with.")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Ratio above which a stage counts as a regression.")
+    parser.add_argument('--min-seconds', type=float, default=0.05, help="Smallest slowdown counted as a regression.")
+    args = parser.parse_args()
+
+    config = {'codebook_size': args.codebook_size, 'study_size': args.study_size, 'rows': args.rows,
+              'context_paragraphs': args.context_paragraphs, 'dim': args.dim, 'embedding_latency': args.embedding_latency,
+              'chat_latency': args.chat_latency, 'seed': args.seed, 'trace_memory': args.trace_memory}
+    timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    label = args.label or f"{timestamp}_{args.study_size}x{args.codebook_size}"
+    print(f"Benchmark {label}: {config}")
+    stages = run_benchmarks(args.codebook_size, args.study_size, args.rows, args.context_paragraphs, args.dim, args.embedding_latency,
+                            args.chat_latency, args.seed, args.trace_memory, args.keep_workspace)
+    run = {'label': label, 'timestamp': timestamp, 'git_commit': git_commit(), 'config': config,
+           'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+                           'cpus': os.cpu_count(), 'pandas': pd.__version__},
+           'stages': stages}
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_file = os.path.join(args.output_dir, f"{label}.json")
+    with open(output_file, 'w') as f:
+        json.dump(run, f, indent=1)
+    print(f"Results saved to {output_file}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_runs(run, json.load(f), args.threshold, args.min_seconds)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
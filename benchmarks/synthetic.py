@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+# building blocks of the synthetic variable descriptions
+measures = ['weight', 'height', 'blood pressure', 'heart rate', 'temperature', 'glucose', 'cholesterol', 'haemoglobin',
+            'creatinine', 'albumin', 'bilirubin', 'sodium', 'potassium', 'oxygen saturation', 'respiratory rate',
+            'head circumference', 'gestational age', 'birth weight', 'apgar score', 'viral load', 'cd4 count',
+            'body mass index', 'waist circumference', 'platelet count', 'white cell count', 'ferritin', 'vitamin d']
+subjects = ['maternal', 'paternal', 'infant', 'child', 'participant', 'sibling', 'household', 'caregiver']
+timepoints = ['at enrolment', 'at birth', 'at 6 weeks', 'at 6 months', 'at 12 months', 'at 24 months', 'at follow up',
+              'at discharge', 'at delivery', 'during pregnancy', 'at baseline', 'at the last visit']
+qualifiers = ['measured', 'self reported', 'recorded', 'estimated', 'first', 'maximum', 'minimum', 'mean', 'repeat']
+units = {'weight': 'kg', 'height': 'cm', 'blood pressure': 'mmHg', 'heart rate': 'bpm', 'temperature': 'C', 'glucose': 'mmol/L',
+         'cholesterol': 'mmol/L', 'haemoglobin': 'g/dL', 'head circumference': 'cm', 'birth weight': 'g', 'body mass index': 'kg/m2'}
+categorical = ['sex', 'smoking status', 'hiv status', 'diabetes diagnosis', 'hypertension diagnosis', 'breastfeeding',
+               'delivery mode', 'education level', 'employment status', 'alcohol use']
+categories = {'sex': "male', 'female'", 'delivery mode': "vaginal', 'caesarean'", 'education level': "none', 'primary', 'secondary', 'tertiary'"}
+
+def variable_name(description, i):
+    """
+    Abbreviate a description into a study style variable name, eg. 'mat_wei_enr_12'.
+
+    Args:
+        description (str): The description.
+        i (int): A number making the name unique.
+
+    Returns:
+        str: The variable name.
+    """
+    words = [x for x in description.replace(' at ', ' ').replace(' the ', ' ').split() if x not in ('at', 'during', 'the')]
+    return '_'.join(x[:3] for x in words[:3]) + f'_{i}'
+
+def make_codebook(n_variables, seed=0):
+    """
+    Generate a synthetic target codebook.
+
+    Args:
+        n_variables (int): The number of codebook variables.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: The codebook, with the columns of an uploaded codebook (variable_name, description, dType, Unit, Categories, Unit Example).
+    """
+    rng = np.random.default_rng(seed)
+    rows, seen = [], set()
+    while len(rows) < n_variables:
+        if rng.random() < 0.2:
+            measure = categorical[rng.integers(len(categorical))]
+            dtype, unit, example = 'string', None, None
+            category = categories.get(measure, "yes', 'no'")
+        else:
+            measure = measures[rng.integers(len(measures))]
+            dtype, unit, category = 'float', units.get(measure), None
+            example = f'{rng.uniform(1, 200):.1f}'
+        description = f"{qualifiers[rng.integers(len(qualifiers))]} {subjects[rng.integers(len(subjects))]} {measure} {timepoints[rng.integers(len(timepoints))]}"
+        if description in seen: # descriptions identify codebook variables
+            description = f"{description} ({len(rows)})"
+        seen.add(description)
+        rows.append({'variable_name': f'cb_{len(rows):05d}', 'description': description, 'dType': dtype, 'Unit': unit,
+                     'Categories': category, 'Unit Example': example})
+    return pd.DataFrame(rows)
+
+def make_study(codebook, n_variables, missing_descriptions=0.1, seed=0):
+    """
+    Generate a synthetic study variables table whose variables correspond to codebook variables, with reworded descriptions.
+
+    Args:
+        codebook (pd.DataFrame): The codebook, as returned by make_codebook.
+        n_variables (int): The number of study variables.
+        missing_descriptions (float, optional): The fraction of variables without a description, to be generated by the LLM. Defaults to 0.1.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: The variables table (variable_name, description) and the codebook variable each was derived from (source).
+    """
+    rng = np.random.default_rng(seed + 1)
+    sources = codebook['description'].to_numpy()[rng.integers(len(codebook), size=n_variables)]
+    rows = []
+    for i, source in enumerate(sources):
+        words = source.split()
+        if len(words) > 3 and rng.random() < 0.5: # drop the qualifier
+            words = words[1:]
+        if rng.random() < 0.3: # reorder, eg. 'at birth infant weight'
+            words = words[-2:] + words[:-2]
+        description = ' '.join(words)
+        rows.append({'variable_name': variable_name(description, i),
+                     'description': description if rng.random() >= missing_descriptions else None,
+                     'source': source})
+    rows[0] = {'variable_name': 'participant_id', 'description': 'unique participant identifier', 'source': None}
+    if n_variables > 1:
+        rows[1] = {'variable_name': 'visit_date', 'description': 'date of study visit', 'source': None}
+    return pd.DataFrame(rows)
+
+def make_context_text(study, n_paragraphs=200, seed=0):
+    """
+    Generate a synthetic study protocol mentioning the study variables, as extracted from a context PDF.
+
+    Args:
+        study (pd.DataFrame): The study variables, as returned by make_study.
+        n_paragraphs (int, optional): The number of paragraphs. Defaults to 200.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        str: The text.
+    """
+    rng = np.random.default_rng(seed + 2)
+    paragraphs = []
+    for _ in range(n_paragraphs):
+        picks = study.iloc[rng.integers(len(study), size=5)]
+        sentences = [f"The variable {row.variable_name} records the {row.source or row.description}." for row in picks.itertuples()]
+        sentences.append(f"Data were collected by trained staff {timepoints[rng.integers(len(timepoints))]} using standard operating procedures.")
+        paragraphs.append(' '.join(sentences))
+    return '\n\n'.join(paragraphs)
+
+def make_study_data(n_rows, seed=0):
+    """
+    Generate synthetic source columns for the transformation benchmarks.
+
+    Args:
+        n_rows (int): The number of rows.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Columns read as strings, as in a study dataset: a numeric measurement, a coded category,
+                      a yes/no answer and a date, with about 5% missing values each.
+    """
+    rng = np.random.default_rng(seed + 3)
+    data = pd.DataFrame({'weight_g': rng.normal(3200, 500, n_rows).round(0).astype(int).astype(str),
+                         'sex_code': rng.choice(['0', '1', '9'], n_rows, p=[0.49, 0.49, 0.02]),
+                         'smoker': rng.choice(['Y', 'N'], n_rows),
+                         'visit_date': pd.to_datetime(rng.integers(1.5e9, 1.7e9, n_rows), unit='s').strftime('%d/%m/%Y')})
+    return data.mask(rng.random(data.shape) < 0.05)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the app is run from app/, where its modules import each other as components.*
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+import pytest
+from components import embedding_utils
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'status {status_code}')
+        self.status_code = status_code
+
+class Client:
+    """
+    Stands in for the OpenAI client, raising the queued errors before answering and rejecting any batch containing 'bad'.
+    """
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.requests = []
+        self.embeddings = self
+
+    def create(self, input, model):
+        self.requests.append(list(input))
+        if self.errors:
+            raise self.errors.pop(0)
+        if 'bad' in input:
+            raise APIError(400)
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)])
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(embedding_utils.time, 'sleep', sleeps.append)
+    return sleeps
+
+def test_rate_limit_is_retried_with_exponential_backoff(sleeps):
+    client = Client([APIError(429), APIError(429), APIError(500)])
+    assert embedding_utils.request_embeddings(client, ['a', 'bb'], 'model') == [[1.0], [2.0]]
+    assert sleeps == [1, 2, 4] and len(client.requests) == 4
+
+def test_persistent_rate_limit_gives_up_without_splitting_the_batch(sleeps):
+    client = Client([APIError(429)] * 10)
+    assert embedding_utils.request_embeddings(client, ['a'] * 64, 'model', max_retries=3) == [None] * 64
+    assert len(client.requests) == 3 and all(len(x) == 64 for x in client.requests)
+
+def test_rejected_batch_is_bisected(sleeps):
+    client = Client()
+    texts = [f'text {i}' for i in range(63)] + ['bad']
+    embeddings = embedding_utils.request_embeddings(client, texts, 'model')
+    assert embeddings[-1] is None and all(x == [float(len(t))] for x, t in zip(embeddings[:-1], texts[:-1]))
+    assert len(client.requests) == 13 and sleeps == [] # 2 requests per halving, no backoff for a rejected input
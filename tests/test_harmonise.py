@@ -0,0 +1,44 @@
+import os
+import pandas as pd
+import pytest
+from components import harmonise
+
+def mapped_variable(source_var, target_var, instructions, source_dtype='integer', target_dtype='integer'):
+    return {'source_var': source_var, 'target_var': target_var, 'transformation_type': 'Direct', 'transformation_instructions': instructions,
+            'source_dtype': source_dtype, 'target_dtype': target_dtype, 'categories': None, 'patient_id_var': None, 'date_var': None}
+
+plan = [mapped_variable('weight_g', 'weight_kg', 'x / 1000', target_dtype='float'),
+        mapped_variable('code', 'code_plus', 'x + 1', source_dtype='string')] # str + int raises
+
+def test_failing_variable_is_output_as_nulls():
+    chunk = pd.DataFrame({'weight_g': ['3200', None], 'code': ['a', 'b']})
+    harmonised, report = harmonise.transform_chunk(chunk, plan)
+    assert harmonised['weight_kg'].iloc[0] == 3.2 and pd.isna(harmonised['weight_kg'].iloc[1])
+    assert harmonised['code_plus'].isna().all()
+    report = report.set_index('target_var')
+    assert report.loc['weight_kg', 'values_failed'] == 0 and pd.isna(report.loc['weight_kg', 'error'])
+    assert report.loc['code_plus', 'values_failed'] == 2 and report.loc['code_plus', 'error'].startswith('TypeError')
+
+def test_harmonise_study_reports_failures(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(harmonise, 'harmonisation_plan', lambda study: plan)
+    pd.DataFrame({'weight_g': ['3200', '2900', None], 'code': ['a', 'b', None]}).to_csv('data.csv', index=False)
+    report = harmonise.harmonise_study('study', 'data.csv', 'csv', chunksize=2).set_index('target_var')
+    assert report.loc['code_plus', 'values_failed'] == 2 and report.loc['code_plus', 'rows'] == 3
+    assert len(pd.read_csv(f'{harmonise.harmonised_path}/study/part-00001.csv')) == 1
+
+def test_harmonise_study_removes_partial_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(harmonise, 'harmonisation_plan', lambda study: plan)
+    pd.DataFrame({'weight_g': ['3200', '2900', None], 'code': ['a', 'b', None]}).to_csv('data.csv', index=False)
+    parts = []
+    def fail_second_part(chunk, plan, part_file, output_format):
+        if parts:
+            raise OSError('disk full')
+        parts.append(part_file)
+        return harmonise_part(chunk, plan, part_file, output_format)
+    harmonise_part = harmonise.harmonise_part
+    monkeypatch.setattr(harmonise, 'harmonise_part', fail_second_part)
+    with pytest.raises(OSError):
+        harmonise.harmonise_study('study', 'data.csv', 'csv', chunksize=2)
+    assert not os.path.exists(f'{harmonise.harmonised_path}/study')
@@ -0,0 +1,26 @@
+import threading
+import time
+from components import jobs
+
+def test_interrupted_job_is_resumed_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runs = []
+    monkeypatch.setattr(jobs, '_run_job', lambda job_id: runs.append(job_id))
+    is_interrupted = jobs.is_interrupted
+    def slow_is_interrupted(job): # widen the window between checking and claiming a job
+        interrupted = is_interrupted(job)
+        time.sleep(0.05)
+        return interrupted
+    monkeypatch.setattr(jobs, 'is_interrupted', slow_is_interrupted)
+    jobs.write_job({'id': 'job', 'created': time.time(), 'studies': [], 'status': 'running', 'pid': 2 ** 22 + 1, # no such process
+                    'tasks': {'codebook/embeddings': {'status': 'running'}}})
+    resumed = []
+    sessions = [threading.Thread(target=lambda: resumed.extend(jobs.resume_interrupted_jobs())) for _ in range(8)]
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.join()
+    time.sleep(0.1)
+    assert resumed == ['job'] and runs == ['job']
+    assert jobs.read_job('job')['runs'] == 1
+    jobs._active_jobs.discard('job')
@@ -0,0 +1,77 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from components.transformation_utils import apply_transformation
+
+# values as read from a study dataset, with missing values and values that do not convert
+values = ['1', '0', None, np.nan, '10', '20', '2.5', ' 3 ', 'abc', '-4', '', '1e3', 'inf']
+dtypes = ['string', 'float', 'integer', 'boolean']
+expressions = ['x', 'x == 1', 'x*10', 'x/2 if x > 15 else x', 'x > 5 and x < 15', 'not x', 'round(x)', 'x + 1', "x.split('.')[0]",
+               'abs(x)', '1 < x <= 10', 'x or 5', 'x and 5', 'x if x else 0', 'not x == 1', "x.strip() or 'empty'", 'min(x, 5)',
+               'max(x, 0)', 'x if x < 3 else "big"', 'float(x) * 2', 'int(x)', 'str(x) + "!"', 'len(x)', 'x[:1]']
+
+def is_missing(value):
+    return value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value))
+
+def legacy_dtype_conversion(x, dtype):
+    """
+    The scalar dtype_conversion the vectorized plans replace, except that missing values stay missing as strings and
+    booleans (rather than becoming 'nan' or True) and integers outside the int64 range are missing.
+    """
+    if dtype in ('string', 'boolean') and is_missing(x):
+        return np.nan
+    try:
+        if dtype == 'string':
+            return str(x)
+        elif dtype == 'float':
+            return float(x)
+        elif dtype == 'integer':
+            return int(x) if abs(int(x)) < 2 ** 63 else np.nan
+        elif dtype == 'boolean':
+            return bool(x)
+    except Exception:
+        return np.nan
+
+def legacy_direct_conversion(x, x_str, source_dtype, target_dtype):
+    """
+    The scalar generic_direct_conversion the vectorized plans replace, evaluated value by value.
+
+    Returns:
+        any: The converted value, or 'error' if the instructions raise for a value that is not missing.
+    """
+    was_missing = is_missing(x)
+    x = legacy_dtype_conversion(x, source_dtype)
+    try:
+        x = eval(x_str, {'x': x, 'str': lambda value: np.nan if is_missing(value) else str(value)})
+    except Exception:
+        return np.nan if was_missing else 'error'
+    return legacy_dtype_conversion(x, target_dtype)
+
+def same_value(expected, result):
+    if is_missing(expected) or is_missing(result):
+        return is_missing(expected) and is_missing(result)
+    if isinstance(expected, str) or isinstance(result, str):
+        return expected == result
+    return expected == result and isinstance(result, (bool, np.bool_)) == isinstance(expected, bool)
+
+@pytest.mark.parametrize('x_str', expressions)
+@pytest.mark.parametrize('source_dtype', dtypes)
+@pytest.mark.parametrize('target_dtype', dtypes)
+def test_direct_transformation_matches_scalar_semantics(x_str, source_dtype, target_dtype):
+    expected = [legacy_direct_conversion(x, x_str, source_dtype, target_dtype) for x in values]
+    if 'error' in expected: # the instructions do not apply to this source dtype
+        return
+    result = apply_transformation(values, 'Direct', x_str, source_dtype, target_dtype)
+    mismatches = [(x, e, r) for x, e, r in zip(values, expected, result) if not same_value(e, r)]
+    assert mismatches == []
+
+def test_missing_values_stay_missing():
+    assert apply_transformation(['1', '0', None], 'Direct', 'x == 1', 'integer', 'boolean').tolist() == [True, False, False]
+    assert apply_transformation(['1', '0', None], 'Direct', 'x', 'integer', 'boolean').tolist() == [True, False, pd.NA]
+    assert apply_transformation(['10', None, '20'], 'Direct', 'x/2 if x > 15 else x', 'integer', 'integer').tolist() == [10, pd.NA, 10]
+    assert is_missing(apply_transformation([None], 'Direct', 'x', 'string', 'string').iloc[0])
+
+def test_categorical_transformation():
+    result = apply_transformation(['0', '1', None, '2'], 'Categorical', "{0: 'no', 1: 'yes'}")
+    assert result.iloc[:2].tolist() == ['no', 'yes'] and result.iloc[2:].isna().all()
@@ -0,0 +1,13 @@
+from components.util import reorder_lists, split_var_confidence
+
+def test_reorder_lists_moves_value_to_top():
+    assert reorder_lists(['a', 'b', 'c'], [1, 2, 3], 'b') == (['b', 'a', 'c'], [2, 1, 3])
+
+def test_reorder_lists_adds_missing_value_to_top():
+    # a PID or date chosen earlier may not be in the truncated recommendations of the current variable
+    assert reorder_lists(['a', 'b'], [' - 90%', ' - 80%'], 'participant_id') == (['participant_id', 'a', 'b'], [None, ' - 90%', ' - 80%'])
+
+def test_split_var_confidence_without_confidence():
+    # a previous choice outside the top k is listed without a confidence
+    assert split_var_confidence('participant_id') == ('participant_id', None)
+    assert split_var_confidence('participant_id  - 80%') == ('participant_id', '80%')